@@ -0,0 +1,248 @@
+"""
+Benchmarks of the listing hot paths, run by benchmarks/run.py:
+
+- aspects: building, loading and validating the aspect schema of a category (Takamocha fixture),
+  from the decoded response, while it is streamed, or from the raw body
+- suggestions: parsing a streamed suggestions response, converting suggestions to the category selectbox options
+- taxonomy: checking the category IDs of a bulk import against the local category tree
+- session: saving and loading a session state holding image-sized values
+- sync: comparing a catalog with the inventory sync index when nothing changed
+- prep: the listing preparation run against the local mock eBay API and the stub LLM
+"""
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+from harness import ROOT_DIR, benchmark
+
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, 'src'))
+from eBay import EbayAPI, category_aspects_cache, category_tree_id_cache, rate_limiter
+from inventory_sync import InventorySync
+from listing_creator import build_listing_prep, suggestions_to_categories
+from lib.ai import StubBackend, compose_listing_stream, set_backend
+from lib.listing import build_inventory_item, build_offer, normalize_record
+from lib.pipeline import input_key
+from lib.ratelimit import DEFAULT_BUDGETS
+import lib.schema
+from lib.json_stream import STREAM_CHUNK_SIZE
+from lib.schema import CategorySchema, SchemaStore
+from lib.session import SessionStore
+from lib.sync import SyncIndex, record_state
+from lib.taxonomy import CategoryTreeSnapshot, iter_aspects, read_suggestions, write_snapshot
+from tools.mock_ebay import MockEbay, build_category_tree, load_fixtures, start_server
+
+TAKAMOCHA_ASPECTS = os.path.join(ROOT_DIR, 'Takamocha', 'sample_category_aspects_takamocha.json')
+TAKAMOCHA_SUGGESTIONS = os.path.join(ROOT_DIR, 'Takamocha', 'sample_suggested_category_takamocha.json')
+
+# Images kept in a session, of a typical phone photo size
+SESSION_IMAGES = 6
+IMAGE_SIZE = 1_500_000
+
+# Catalog size of the sync benchmark
+SYNC_CATALOG_SIZE = 10_000
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@benchmark('aspects.parse_takamocha', setup=lambda: read_bytes(TAKAMOCHA_ASPECTS))
+def parse_aspects(data):
+    # What get_category_aspects does with a 200 response
+    return CategorySchema.from_response('15687', json.loads(data)).required_aspects()
+
+
+@benchmark('aspects.extract_takamocha', setup=lambda: json.loads(read_bytes(TAKAMOCHA_ASPECTS)))
+def extract_aspects(aspects):
+    return CategorySchema.from_response('15687', aspects)
+
+
+def chunks(path):
+    # The response body as requests' iter_content hands it over
+    data = read_bytes(path)
+    return [data[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(data), STREAM_CHUNK_SIZE)]
+
+
+@benchmark('aspects.stream_takamocha', setup=lambda: chunks(TAKAMOCHA_ASPECTS))
+def stream_aspects(aspect_chunks):
+    # What get_category_aspects does with a streamed 200 response
+    return CategorySchema.from_aspects('15687', iter_aspects(aspect_chunks)).required_aspects()
+
+
+@benchmark('aspects.body_takamocha', setup=lambda: read_bytes(TAKAMOCHA_ASPECTS))
+def body_aspects(data):
+    # What the async client does with a response it read whole (decoded with orjson if installed)
+    return CategorySchema.from_aspects('15687', iter_aspects(data)).required_aspects()
+
+
+@benchmark('aspects.schema_load_takamocha',
+           setup=lambda: CategorySchema.from_response('15687', json.loads(read_bytes(TAKAMOCHA_ASPECTS))).to_bytes())
+def load_schema(data):
+    # What a process does with a schema another one stored, or the listing service sent
+    return CategorySchema.from_bytes(data)[0].required_aspects()
+
+
+def validate_setup():
+    schema = CategorySchema.from_response('15687', json.loads(read_bytes(TAKAMOCHA_ASPECTS)))
+    # Warm the value maps, as after the first validation of a session
+    aspects = {schema.names[i]: [schema.values(i)[-1]] if schema.value_count(i) else ['Takamocha']
+               for i in range(len(schema))}
+    schema.validate(aspects)
+    return schema, aspects
+
+
+@benchmark('aspects.schema_validate', setup=validate_setup)
+def validate_aspects(context):
+    schema, aspects = context
+    return schema.validate(aspects)
+
+
+@benchmark('suggestions.stream_takamocha', setup=lambda: chunks(TAKAMOCHA_SUGGESTIONS))
+def stream_suggestions(suggestion_chunks):
+    return read_suggestions(suggestion_chunks)
+
+
+@benchmark('suggestions.to_categories', setup=lambda: json.loads(read_bytes(TAKAMOCHA_SUGGESTIONS)))
+def convert_suggestions(suggestions):
+    return suggestions_to_categories(suggestions)
+
+
+class TreeContext:
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix='bench-tree-')
+        path = os.path.join(self.root, 'tree.ebtx')
+        write_snapshot(build_category_tree(load_fixtures(), '0'), path, marketplace_id='EBAY_US')
+        self.snapshot = CategoryTreeSnapshot(path)
+        # A catalog mixing valid, non-leaf and unknown categories
+        ids = [str(self.snapshot.node(index)[0]) for index in range(1, len(self.snapshot))] + ['999999']
+        self.category_ids = [ids[i % len(ids)] for i in range(1000)]
+        self.snapshot.find(ids[0])
+
+    def close(self):
+        self.snapshot.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+@benchmark('taxonomy.check_1000_categories', setup=TreeContext, teardown=TreeContext.close)
+def check_categories(context):
+    return [context.snapshot.check_category(category_id) for category_id in context.category_ids]
+
+
+class SessionContext:
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix='bench-session-')
+        self.store = SessionStore(self.root)
+        rng = random.Random(0)
+        # Random bytes don't compress, like JPEG data
+        self.images = [rng.randbytes(IMAGE_SIZE) for _ in range(SESSION_IMAGES + 1)]
+        self.state = {
+            'gen_title': 'Takamocha T-Shirt Coffee Lover Japanese Graphic Tee',
+            'gen_description': 'Soft cotton tee with the Takamocha coffee logo. ' * 40,
+            'categories': suggestions_to_categories(json.loads(read_bytes(TAKAMOCHA_SUGGESTIONS))),
+            'selected_category_index': 0,
+            'uploaded_images': [f"{i:064x}" for i in range(SESSION_IMAGES)],
+            **{f"image_{i}": image for i, image in enumerate(self.images[:SESSION_IMAGES])}
+        }
+        self.saves = 0
+        self.store.save('bench', self.state)
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+@benchmark('session.save_unchanged', setup=SessionContext, teardown=SessionContext.close)
+def save_unchanged(context):
+    # A rerun where nothing changed
+    return context.store.save('bench', context.state)
+
+
+@benchmark('session.save_image_changed', setup=SessionContext, teardown=SessionContext.close)
+def save_image_changed(context):
+    # A rerun after one image was replaced
+    context.saves += 1
+    state = dict(context.state, image_0=context.images[context.saves % 2 * SESSION_IMAGES],
+                 selected_category_index=context.saves)
+    return context.store.save('bench', state)
+
+
+@benchmark('session.load', setup=SessionContext, teardown=SessionContext.close)
+def load_session(context):
+    # A new browser session picking up the saved state (the digest cache of the store doesn't help loads)
+    return context.store.load('bench')
+
+
+class SyncContext:
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix='bench-sync-')
+        self.index = SyncIndex(os.path.join(self.root, 'sync.db'))
+        self.records = [normalize_record({
+            'sku': f"TKM-{i:05}",
+            'title': f"Takamocha T-Shirt Coffee Lover Japanese Graphic Tee {i}",
+            'description': 'Soft cotton tee with the Takamocha coffee logo. ' * 10,
+            'aspects': {'Brand': ['Takamocha'], 'Size': ['M'], 'Color': ['Black']},
+            'image_urls': [f"https://i.ebayimg.com/images/g/{i:05}/s-l1600.jpg"],
+            'price': 24.99,
+            'quantity': 3,
+            'category_id': '15687'
+        }) for i in range(SYNC_CATALOG_SIZE)]
+        self.index.put_many([{**record_state(record, build_inventory_item(record), build_offer(record)),
+                              'offer_id': str(i), 'listing_id': str(i)} for i, record in enumerate(self.records)])
+
+    def close(self):
+        self.index.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+@benchmark('sync.diff_10000_unchanged', setup=SyncContext, teardown=SyncContext.close)
+def diff_unchanged(context):
+    # A sync of an unchanged catalog: digests and index lookups only, no API call
+    sync = InventorySync(None, context.index, None, dry_run=True)
+    report = sync.run(context.records)
+    if report['counts']['unchanged'] != SYNC_CATALOG_SIZE:
+        raise RuntimeError(f"Unexpected changes: {report['counts']}")
+    return report
+
+
+class PrepContext:
+    def __init__(self):
+        self.server, url = start_server(MockEbay())
+        self.client = EbayAPI('bench-client', 'bench-secret', 'bench-dev', 'bench-ru', 'production')
+        self.client.endpoints = {env: {host: url for host in hosts} for env, hosts in self.client.endpoints.items()}
+        self.client.get_app_token()
+        # Thousands of runs would exhaust the taxonomy call budget and time the throttling instead
+        rate_limiter.configure({'taxonomy': {'daily': 10 ** 9, 'burst': 10 ** 6, 'rate': 10 ** 6}})
+        set_backend(StubBackend())
+        self.schema_dir = tempfile.mkdtemp(prefix='bench-schemas-')
+        self.schema_store, lib.schema._store = lib.schema._store, SchemaStore(self.schema_dir)
+        self.runs = 0
+
+    def close(self):
+        self.server.shutdown()
+        rate_limiter.configure({'taxonomy': DEFAULT_BUDGETS['taxonomy']})
+        set_backend(None)
+        lib.schema._store = self.schema_store
+        shutil.rmtree(self.schema_dir, ignore_errors=True)
+
+
+@benchmark('prep.end_to_end', setup=PrepContext, teardown=PrepContext.close)
+def listing_prep(context):
+    # Cold caches, so every run calls the mock like a new product would
+    category_tree_id_cache.clear()
+    category_aspects_cache.clear()
+    for name in os.listdir(context.schema_dir):
+        os.remove(os.path.join(context.schema_dir, name))
+    context.runs += 1
+
+    title, manufacturer, summary = 'Takamocha T-Shirt', 'Takamocha', f"Coffee graphic tee, run {context.runs}"
+    compose = lambda *args: compose_listing_stream(*args, use_cache=False)
+    run = build_listing_prep(input_key(title, manufacturer, summary), title, manufacturer, summary,
+                             compose, context.client, context.client.get_category_schema)
+    run.start().wait()
+    if run.errors:
+        raise RuntimeError(f"Listing preparation failed: {run.errors}")
+    return run.results
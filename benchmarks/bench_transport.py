@@ -0,0 +1,95 @@
+"""
+Compare requests/sec of bare requests.get calls against the shared pooled transport.
+
+Usage:
+    python benchmarks/bench_transport.py [--requests 500] [--threads 8] [--tls]
+
+With --tls the mock server uses cert.pem/key.pem from the project root, which is
+closer to api.ebay.com where every new connection pays for a TLS handshake.
+"""
+import argparse
+import json
+import ssl
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import sys
+import os
+
+# Add the project root directory to sys.path
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT_DIR)
+from lib.transport import Transport
+
+PAYLOAD = json.dumps({'categoryTreeId': '0', 'categoryTreeVersion': '130'}).encode()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that the server keeps connections alive
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, avoid Nagle delays on kept-alive sockets
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(PAYLOAD)))
+        self.end_headers()
+        self.wfile.write(PAYLOAD)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(tls):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+    server.daemon_threads = True
+
+    if tls:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(os.path.join(ROOT_DIR, 'cert.pem'), os.path.join(ROOT_DIR, 'key.pem'))
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    scheme = 'https' if tls else 'http'
+    return server, f"{scheme}://127.0.0.1:{server.server_address[1]}/commerce/taxonomy/v1/get_default_category_tree_id"
+
+
+def run(get, url, total, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for response in executor.map(lambda _: get(url, verify=False), range(total)):
+            response.raise_for_status()
+    return total / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--tls', action='store_true')
+    args = parser.parse_args()
+
+    warnings.filterwarnings('ignore', message='Unverified HTTPS request')
+    server, url = start_server(args.tls)
+
+    try:
+        bare = run(requests.get, url, args.requests, args.threads)
+
+        transport = Transport(pool_maxsize=args.threads)
+        pooled = run(transport.get, url, args.requests, args.threads)
+        transport.close()
+    finally:
+        server.shutdown()
+
+    print(f"bare requests.get: {bare:10.1f} req/s")
+    print(f"pooled transport:  {pooled:10.1f} req/s  ({pooled / bare:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
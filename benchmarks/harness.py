@@ -0,0 +1,162 @@
+"""
+Minimal benchmark harness: registration, timing, result history and regression checks.
+
+Benchmark modules (benchmarks/bench_*.py) register functions with @benchmark,
+benchmarks/run.py times them and appends the results to a JSONL history.
+"""
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import os
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Results of every run, one JSON line per benchmark
+HISTORY_PATH = os.path.join(ROOT_DIR, '.cache', 'benchmarks', 'history.jsonl')
+
+# A sample times enough calls to last at least this many seconds
+MIN_SAMPLE_TIME = 0.05
+# Samples per benchmark
+REPEAT = 7
+# Slower than the baseline by more than this share is a regression
+REGRESSION_THRESHOLD = 0.2
+# The baseline is the median of this many previous runs
+BASELINE_RUNS = 5
+
+BENCHMARKS = {}
+
+
+class Benchmark:
+    def __init__(self, name, fn, setup=None, teardown=None):
+        """
+        A timed function
+
+        Args:
+            name (str): Unique name, grouped by the prefix before the first dot
+            fn (callable): Called with the value returned by setup, if any
+            setup (callable): Builds the input once, outside the timing
+            teardown (callable): Called with the setup value after timing
+        """
+        self.name = name
+        self.fn = fn
+        self.setup = setup
+        self.teardown = teardown
+
+
+def benchmark(name, setup=None, teardown=None):
+    """
+    Register a benchmark function
+    """
+    def register(fn):
+        BENCHMARKS[name] = Benchmark(name, fn, setup, teardown)
+        return fn
+    return register
+
+
+def measure(bench, repeat=REPEAT, min_sample_time=MIN_SAMPLE_TIME):
+    """
+    Time a benchmark: calibrate the calls per sample, then take several samples
+
+    Returns:
+        dict: Seconds per call (median, min, IQR), calls per sample and samples
+    """
+    context = bench.setup() if bench.setup else None
+    call = (lambda: bench.fn(context)) if bench.setup else bench.fn
+
+    try:
+        # Warm up, and double the calls until a sample lasts long enough
+        loops = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(loops):
+                call()
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_sample_time or loops >= 1 << 20:
+                break
+            loops *= 2
+
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(loops):
+                call()
+            samples.append((time.perf_counter() - start) / loops)
+    finally:
+        if bench.teardown:
+            bench.teardown(context)
+
+    quartiles = statistics.quantiles(samples, n=4) if len(samples) > 1 else [samples[0]] * 3
+    return {
+        'median': statistics.median(samples),
+        'min': min(samples),
+        'iqr': quartiles[2] - quartiles[0],
+        'loops': loops,
+        'samples': samples
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class History:
+    def __init__(self, path=HISTORY_PATH):
+        """
+        Benchmark results over time, in a JSONL file
+
+        Args:
+            path (str): History file
+        """
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def append(self, results):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+
+    def baseline(self, name, machine, runs=BASELINE_RUNS):
+        """
+        Returns:
+            float: Median of the last runs of a benchmark on a machine, or None without history
+        """
+        medians = [result['median'] for result in self.load() if result['name'] == name and result['machine'] == machine]
+        return statistics.median(medians[-runs:]) if medians else None
+
+
+def result_record(name, stats):
+    return {
+        'name': name,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'machine': platform.node(),
+        'python': platform.python_version(),
+        **stats
+    }
+
+
+def is_regression(stats, baseline, threshold=REGRESSION_THRESHOLD):
+    # Slower than the baseline by more than the threshold and more than the noise of the samples
+    return baseline is not None and stats['median'] > baseline * (1 + threshold) and \
+        stats['median'] - baseline > stats['iqr']
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds / 1e-9:.3g} ns"
@@ -0,0 +1,77 @@
+"""
+Run the benchmark suite, record the results and flag regressions.
+
+Every benchmark registered by the benchmarks/bench_*.py modules is timed, its
+result is appended to the history (.cache/benchmarks/history.jsonl) and compared
+with the median of its previous runs on the same machine.
+
+Usage:
+    python benchmarks/run.py [-k session] [--repeat 7] [--threshold 0.2] [--no-save] [--check]
+
+With --check the exit status is 1 when a benchmark regressed, for CI.
+"""
+import argparse
+import importlib
+import os
+import sys
+
+from harness import (BENCHMARKS, HISTORY_PATH, REGRESSION_THRESHOLD, REPEAT, History, format_time, is_regression,
+                     measure, result_record)
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+# Standalone scripts with their own command line, not registered benchmarks
+STANDALONE = ('bench_transport',)
+
+
+def load_benchmarks():
+    for name in sorted(os.listdir(BENCHMARK_DIR)):
+        module = name[:-3]
+        if name.startswith('bench_') and name.endswith('.py') and module not in STANDALONE:
+            importlib.import_module(module)
+    return BENCHMARKS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-k', dest='pattern', help='Only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='Samples per benchmark')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='Slowdown over the baseline flagged as a regression')
+    parser.add_argument('--history', default=HISTORY_PATH, help='Result history file')
+    parser.add_argument('--no-save', action='store_true', help="Don't add the results to the history")
+    parser.add_argument('--check', action='store_true', help='Exit with status 1 if a benchmark regressed')
+    args = parser.parse_args()
+
+    history = History(args.history)
+    benchmarks = [bench for name, bench in sorted(load_benchmarks().items())
+                  if not args.pattern or args.pattern in name]
+
+    results = []
+    regressions = []
+    print(f"{'benchmark':<32} {'median':>10} {'min':>10} {'iqr':>10} {'baseline':>10} {'change':>8}")
+    for bench in benchmarks:
+        stats = measure(bench, repeat=args.repeat)
+        record = result_record(bench.name, stats)
+        baseline = history.baseline(bench.name, record['machine'])
+
+        change = f"{stats['median'] / baseline - 1:+.1%}" if baseline else ''
+        flag = ''
+        if is_regression(stats, baseline, args.threshold):
+            regressions.append(bench.name)
+            flag = '  REGRESSION'
+        print(f"{bench.name:<32} {format_time(stats['median']):>10} {format_time(stats['min']):>10} "
+              f"{format_time(stats['iqr']):>10} {format_time(baseline) if baseline else '-':>10} {change:>8}{flag}")
+        results.append(record)
+
+    if not args.no_save:
+        history.append(results)
+        print(f"Results added to {args.history}")
+
+    if regressions:
+        print(f"Regressed: {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
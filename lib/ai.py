@@ -1,24 +1,338 @@
 import streamlit as st
 
 import google.generativeai as genai
+import hashlib
 import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-def compose_listing(title, manufacturer, summary):
-    genai.configure(api_key=st.secrets['GOOGLE_API_KEY'])
+from lib.metrics import get_metrics
+from lib.partial_json import PartialJSONParser
 
-    model = genai.GenerativeModel("gemini-1.5-flash")
-    response = model.generate_content(
-        f'''
-        Write an eBay product listing for the product {title} manufactured by {manufacturer} 
-        with the following summary: {summary}. Make the listing attractive and persuasive, 
-        encouraging customers to purchase, but ensure it is accurate and not misleading. 
-        Format the response as a pure JSON object with the keys "title" and "description". 
+MODEL_NAME = "gemini-1.5-flash"
+
+# Where generated listings are cached
+LLM_CACHE_DIR = os.path.join('.cache', 'llm')
+
+# Number of listings generated at the same time by compose_listings
+MAX_CONCURRENCY = 4
+
+# Fields of a generated listing
+LISTING_KEYS = ('title', 'description')
+# Number of times a field missing from a streamed response is requested again
+MAX_FIELD_RETRIES = 2
+# Characters per chunk streamed by the stub backend
+STUB_CHUNK_SIZE = 16
+
+PROMPT_TEMPLATE = '''
+        Write an eBay product listing for the product {title} manufactured by {manufacturer}
+        with the following summary: {summary}. Make the listing attractive and persuasive,
+        encouraging customers to purchase, but ensure it is accurate and not misleading.
+        Format the response as a pure JSON object with the keys "title" and "description".
+        Do not include any additional text or format specifiers in the response.
+        Do not add any markdown code fences (like ```json or ```) or any extra text outside the JSON object.
+        '''
+
+FIELD_PROMPT_TEMPLATE = '''
+        Write the {key} of an eBay product listing for the product {title} manufactured by {manufacturer}
+        with the following summary: {summary}. Make the listing attractive and persuasive,
+        encouraging customers to purchase, but ensure it is accurate and not misleading.
+        Format the response as a pure JSON object with the single key "{key}".
         Do not include any additional text or format specifiers in the response.
         Do not add any markdown code fences (like ```json or ```) or any extra text outside the JSON object.
         '''
-        )
 
-    print(f'Gemini response: {response.text}')
 
-    return json.loads(response.text)
-    
\ No newline at end of file
+def normalize_text(text):
+    # Whitespace differences don't change the listing, they shouldn't miss the cache
+    return ' '.join(str(text or '').split())
+
+
+def build_prompt(title, manufacturer, summary):
+    return PROMPT_TEMPLATE.format(title=normalize_text(title),
+                                  manufacturer=normalize_text(manufacturer),
+                                  summary=normalize_text(summary))
+
+
+def build_field_prompt(key, title, manufacturer, summary):
+    return FIELD_PROMPT_TEMPLATE.format(key=key,
+                                        title=normalize_text(title),
+                                        manufacturer=normalize_text(manufacturer),
+                                        summary=normalize_text(summary))
+
+
+class GeminiBackend:
+    def __init__(self, model_name=MODEL_NAME, api_key=None):
+        """
+        Gemini model client, configured once and shared by all sessions
+
+        Args:
+            model_name (str): Gemini model
+            api_key (str): Google API key, defaults to GOOGLE_API_KEY from the environment or the Streamlit secrets
+        """
+        self.model_name = model_name
+        self.api_key = api_key
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self.model_name
+
+    def _get_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    genai.configure(api_key=self.api_key or os.environ.get('GOOGLE_API_KEY')
+                                    or st.secrets['GOOGLE_API_KEY'])
+                    self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def generate(self, prompt):
+        response = self._get_model().generate_content(prompt)
+
+        print(f'Gemini response: {response.text}')
+
+        return response.text
+
+    def generate_stream(self, prompt):
+        """
+        Yields:
+            str: Response text as it is generated
+        """
+        for chunk in self._get_model().generate_content(prompt, stream=True):
+            yield chunk.text
+
+
+class StubBackend:
+    def __init__(self, delay=0.0):
+        """
+        Offline backend answering every prompt with a deterministic listing
+
+        Args:
+            delay (float): Seconds each generation takes, to simulate the model latency
+        """
+        self.delay = delay
+
+    version = 'stub'
+
+    def _listing(self, prompt):
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:8]
+        return json.dumps({
+            'title': f"Stub listing {digest}",
+            'description': normalize_text(prompt)
+        })
+
+    def generate(self, prompt):
+        if self.delay:
+            time.sleep(self.delay)
+        return self._listing(prompt)
+
+    def generate_stream(self, prompt):
+        text = self._listing(prompt)
+        chunks = [text[i:i + STUB_CHUNK_SIZE] for i in range(0, len(text), STUB_CHUNK_SIZE)]
+        for chunk in chunks:
+            if self.delay:
+                time.sleep(self.delay / len(chunks))
+            yield chunk
+
+
+class ResponseCache:
+    def __init__(self, root=LLM_CACHE_DIR):
+        """
+        On-disk cache of generated listings, keyed by model version and prompt
+
+        Args:
+            root (str): Cache directory
+        """
+        self.root = root
+
+    def key(self, version, prompt):
+        return hashlib.sha256(f"{version}\0{normalize_text(prompt)}".encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+
+_backend = None
+_cache = None
+_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Returns:
+        The LLM backend, the stub when LLM_BACKEND=stub
+    """
+    global _backend
+
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                _backend = StubBackend() if os.environ.get('LLM_BACKEND') == 'stub' else GeminiBackend()
+    return _backend
+
+
+def set_backend(backend):
+    global _backend
+
+    with _lock:
+        _backend = backend
+
+
+def get_cache():
+    global _cache
+
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+
+def compose_listing(title, manufacturer, summary, use_cache=True):
+    """
+    Generate an eBay listing title and description
+
+    Args:
+        title (str): Product title
+        manufacturer (str): Manufacturer
+        summary (str): Product summary
+        use_cache (bool): Return a listing generated earlier for the same prompt and model
+
+    Returns:
+        dict: Listing with the keys "title" and "description"
+    """
+    backend = get_backend()
+    cache = get_cache()
+
+    metrics = get_metrics()
+
+    prompt = build_prompt(title, manufacturer, summary)
+    key = cache.key(backend.version, prompt)
+
+    if use_cache:
+        listing = cache.get(key)
+        metrics.inc('llm_cache_requests_total', result='miss' if listing is None else 'hit')
+        if listing is not None:
+            return listing
+
+    with metrics.span('llm_compose', backend=backend.version, mode='full'):
+        listing = json.loads(backend.generate(prompt))
+    cache.set(key, listing)
+    return listing
+
+
+def compose_listing_stream(title, manufacturer, summary, use_cache=True, max_retries=MAX_FIELD_RETRIES):
+    """
+    Generate an eBay listing title and description, yielding the fields as they are generated
+
+    A field missing from the response (e.g. the stream stopped in the middle of
+    the description) is requested again on its own, keeping the fields already received.
+
+    Args:
+        title (str): Product title
+        manufacturer (str): Manufacturer
+        summary (str): Product summary
+        use_cache (bool): Return a listing generated earlier for the same prompt and model
+        max_retries (int): Number of times a missing field is requested again
+
+    Yields:
+        dict: Listing received so far, the last one is complete
+
+    Raises:
+        ValueError: A field is still missing after the retries
+    """
+    backend = get_backend()
+    cache = get_cache()
+
+    metrics = get_metrics()
+
+    prompt = build_prompt(title, manufacturer, summary)
+    key = cache.key(backend.version, prompt)
+
+    if use_cache:
+        listing = cache.get(key)
+        metrics.inc('llm_cache_requests_total', result='miss' if listing is None else 'hit')
+        if listing is not None:
+            yield listing
+            return
+
+    # Timed without a span: the consumer runs its own code between the chunks
+    started_at = time.perf_counter()
+    first_chunk = True
+    listing = {}
+    missing = list(LISTING_KEYS)
+    attempt = 0
+    while missing:
+        if attempt > max_retries:
+            raise ValueError(f"Generated listing is missing {', '.join(missing)}")
+
+        # The first attempt asks for the whole listing, retries only for the first missing field
+        field_prompt = prompt if attempt == 0 else build_field_prompt(missing[0], title, manufacturer, summary)
+        parser = PartialJSONParser()
+        try:
+            for chunk in backend.generate_stream(field_prompt):
+                if first_chunk:
+                    metrics.observe('llm_first_chunk_seconds', time.perf_counter() - started_at, backend=backend.version)
+                    first_chunk = False
+                yield {**listing, **parser.feed(chunk)}
+        except ValueError as e:
+            print(f'Malformed LLM response: {e}')
+
+        listing.update({field: value for field, value in parser.values.items() if field in missing})
+        missing = [field for field in LISTING_KEYS if field not in listing]
+        attempt += 1
+
+    metrics.observe('llm_compose_seconds', time.perf_counter() - started_at, backend=backend.version, mode='stream')
+    metrics.inc('llm_field_retries_total', attempt - 1, backend=backend.version)
+    cache.set(key, listing)
+    yield listing
+
+
+def compose_listings(products, max_concurrency=MAX_CONCURRENCY, use_cache=True):
+    """
+    Generate listings for many products concurrently
+
+    Args:
+        products (list): Dicts with the keys "title", "manufacturer" and "summary"
+        max_concurrency (int): Maximum number of generations running at the same time
+        use_cache (bool): Reuse listings generated earlier for the same prompt and model
+
+    Returns:
+        list: Listing per product, in the same order, or the exception raised generating it
+    """
+    if not products:
+        return []
+
+    def compose(product):
+        try:
+            return compose_listing(product['title'], product['manufacturer'], product['summary'], use_cache)
+        except Exception as e:
+            return e
+
+    # Products with the same prompt are generated once
+    prompts = [build_prompt(product['title'], product['manufacturer'], product['summary']) for product in products]
+    unique = dict(zip(prompts, products))
+
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(unique))) as executor:
+        listings = dict(zip(unique, executor.map(compose, unique.values())))
+    return [listings[prompt] for prompt in prompts]
@@ -0,0 +1,147 @@
+from bisect import bisect_left
+from collections import defaultdict
+
+from lib.cache import TTLCache
+
+# Minimum share of the query trigrams a value must contain to be a fuzzy match
+MIN_TRIGRAM_OVERLAP = 0.5
+
+# Process-wide indexes, keyed by (env, marketplace_id, category_id, aspect_name)
+aspect_index_cache = TTLCache(maxsize=1024, ttl=6 * 3600)
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class AspectValueIndex:
+    def __init__(self, values):
+        """
+        Type-ahead index over the values of one category aspect
+
+        Args:
+            values (list): Aspect values in eBay order (most relevant first)
+        """
+        self.values = tuple(values)
+        # List the index was last requested for, see get_aspect_index
+        self.source = values
+
+        # Value -> position lookups instead of list.index()
+        self._positions = {}
+        for position, value in enumerate(self.values):
+            self._positions.setdefault(value, position)
+
+        folded = [value.casefold() for value in self.values]
+        self._folded_positions = {}
+        for position, value in enumerate(folded):
+            self._folded_positions.setdefault(value, position)
+
+        # Sorted keys for prefix range lookups
+        prefix_order = sorted(range(len(folded)), key=folded.__getitem__)
+        self._prefix_keys = [folded[position] for position in prefix_order]
+        self._prefix_positions = prefix_order
+
+        # Trigram -> positions for fuzzy/infix matches
+        self._trigram_postings = defaultdict(list)
+        for position, value in enumerate(folded):
+            for trigram in _trigrams(f" {value} "):
+                self._trigram_postings[trigram].append(position)
+
+    def __len__(self):
+        return len(self.values)
+
+    def position(self, value):
+        """
+        Args:
+            value (str): Aspect value
+
+        Returns:
+            int: Position of the value, or None if it isn't a known value
+        """
+        return self._positions.get(value)
+
+    def lookup(self, value):
+        """
+        Find the canonical spelling of a value, ignoring case
+
+        Args:
+            value (str): Aspect value as typed by the user
+
+        Returns:
+            str: The matching known value, or None
+        """
+        position = self._folded_positions.get(value.casefold())
+        return None if position is None else self.values[position]
+
+    def search(self, query, limit=20):
+        """
+        Get the best matching values for a type-ahead query
+
+        Exact matches come first, then prefix matches, then values sharing most
+        trigrams with the query. Ties keep eBay's original value order.
+
+        Args:
+            query (str): Text typed by the user
+            limit (int): Maximum number of matches
+
+        Returns:
+            list: Matching values
+        """
+        query = (query or '').strip().casefold()
+        if not query:
+            return list(self.values[:limit])
+
+        matches = []
+        seen = set()
+
+        def add(positions):
+            for position in sorted(positions):
+                if position not in seen:
+                    seen.add(position)
+                    matches.append(position)
+
+        exact = self._folded_positions.get(query)
+        if exact is not None:
+            add([exact])
+
+        # Prefix matches are a contiguous range of the sorted keys
+        start = bisect_left(self._prefix_keys, query)
+        end = start
+        while end < len(self._prefix_keys) and self._prefix_keys[end].startswith(query):
+            end += 1
+        add(self._prefix_positions[start:end])
+
+        if len(matches) < limit and len(query) >= 2:
+            query_trigrams = _trigrams(f" {query}")
+            counts = defaultdict(int)
+            for trigram in query_trigrams:
+                for position in self._trigram_postings.get(trigram, ()):
+                    counts[position] += 1
+
+            threshold = max(1, len(query_trigrams) * MIN_TRIGRAM_OVERLAP)
+            fuzzy = [position for position, count in counts.items() if count >= threshold and position not in seen]
+            fuzzy.sort(key=lambda position: (-counts[position], position))
+            matches.extend(fuzzy[:limit - len(matches)])
+
+        return [self.values[position] for position in matches[:limit]]
+
+
+def get_aspect_index(key, values):
+    """
+    Get the cached index of an aspect, building it on first use, and again once
+    the values change (e.g. the schema of the category was refreshed)
+
+    Args:
+        key (tuple): (env, marketplace_id, category_id, aspect_name)
+        values (list): Aspect values used to build the index
+
+    Returns:
+        AspectValueIndex: The index
+    """
+    index = aspect_index_cache.get(key)
+    # A schema builds its value lists once, the same list means the same schema and no comparison
+    if index is None or (index.source is not values and index.values != tuple(values)):
+        index = AspectValueIndex(values)
+        aspect_index_cache.set(key, index)
+    index.source = values
+    return index
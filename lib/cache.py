@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheEntry:
+    __slots__ = ('value', 'etag', 'expires_at')
+
+    def __init__(self, value, etag, expires_at):
+        self.value = value
+        self.etag = etag
+        self.expires_at = expires_at
+
+    def is_fresh(self):
+        return time.time() < self.expires_at
+
+
+class TTLCache:
+    def __init__(self, maxsize=256, ttl=3600):
+        """
+        Thread-safe, size-bounded LRU cache whose entries expire after a TTL
+
+        Expired entries are kept (until evicted) so that they can be revalidated
+        with their ETag instead of being downloaded again.
+
+        Args:
+            maxsize (int): Maximum number of entries, least recently used are evicted first
+            ttl (float): Default time to live of an entry in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Get a fresh value from the cache
+
+        Args:
+            key: Cache key
+
+        Returns:
+            The cached value, or None if it is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or not entry.is_fresh():
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def get_stale(self, key):
+        """
+        Get an entry even if it has expired, for ETag revalidation
+
+        Args:
+            key: Cache key
+
+        Returns:
+            CacheEntry: The entry or None
+        """
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key, value, etag=None, ttl=None):
+        with self._lock:
+            self._entries[key] = CacheEntry(value, etag, time.time() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def revalidated(self, key, ttl=None):
+        """
+        Extend the lifetime of an entry after the server confirmed it is unchanged (304)
+
+        Args:
+            key: Cache key
+            ttl (float): Time to live in seconds, defaults to the cache TTL
+
+        Returns:
+            The cached value, or None if the entry was evicted meanwhile
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            entry.expires_at = time.time() + (self.ttl if ttl is None else ttl)
+            self._entries.move_to_end(key)
+            self.revalidations += 1
+            return entry.value
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry.value if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry.is_fresh()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit/miss counters and current size
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'revalidations': self.revalidations,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,446 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+# Where the job queue database is stored
+JOB_DIR = os.path.join('.cache', 'jobs')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+# Failed on every attempt, kept aside until requeued
+DEAD = 'dead'
+
+# Seconds an idle worker waits before looking for a new job
+POLL_INTERVAL = 0.5
+# A running job whose worker stops renewing its lease for this long is taken over by another worker
+LEASE_SECONDS = 60
+# Attempts before a job is dead-lettered, and the backoff between them
+MAX_ATTEMPTS = 5
+RETRY_BASE = 5
+RETRY_CAP = 300
+# Backoff of a worker after a database error (e.g. "database is locked"), doubled up to the cap
+DB_ERROR_BACKOFF = 1
+DB_ERROR_BACKOFF_CAP = 30
+
+# Payload fields removed once a job is done with them (succeeded or dead-lettered)
+CREDENTIAL_FIELDS = ('refresh_token',)
+
+# Columns added after the first version of the table
+_MIGRATIONS = {
+    'attempts': 'INTEGER NOT NULL DEFAULT 0',
+    'max_attempts': f'INTEGER NOT NULL DEFAULT {MAX_ATTEMPTS}',
+    'available_at': 'REAL NOT NULL DEFAULT 0',
+    'lease_expires_at': 'REAL',
+    'progress': 'TEXT',
+    'dedupe_key': 'TEXT'
+}
+
+
+class PermanentJobError(Exception):
+    """
+    Raised by a handler when retrying can't help (e.g. invalid input), the job is dead-lettered at once
+    """
+    pass
+
+
+class LeaseLost(Exception):
+    """
+    The job was taken over by another worker after this one's lease expired
+    """
+    pass
+
+
+class JobQueue:
+    def __init__(self, root=JOB_DIR):
+        """
+        Durable job queue shared by all the processes using it, in a SQLite database
+
+        Workers hold a lease on the job they run and renew it while they make
+        progress, so the job of a crashed worker is picked up again once its
+        lease expires. Failed jobs are retried with backoff, then dead-lettered.
+
+        Job payloads may hold credentials (e.g. a refresh token), they are never
+        returned by get() and are removed from the database once the job
+        succeeds or is dead-lettered.
+
+        Args:
+            root (str): Directory of the database
+        """
+        os.makedirs(root, exist_ok=True)
+        self._db_path = os.path.join(root, 'jobs.db')
+        self._local = threading.local()
+
+        connection = self._connection()
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                worker TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )''')
+        columns = {row['name'] for row in connection.execute('PRAGMA table_info(jobs)')}
+        for column, definition in _MIGRATIONS.items():
+            if column not in columns:
+                connection.execute(f'ALTER TABLE jobs ADD COLUMN {column} {definition}')
+        connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, available_at)')
+        connection.execute('CREATE INDEX IF NOT EXISTS jobs_dedupe_key ON jobs (dedupe_key, status)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self._db_path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _transaction(self, fn):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = fn(connection)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return result
+
+    def submit(self, kind, payload, dedupe_key=None, max_attempts=MAX_ATTEMPTS):
+        """
+        Add a job
+
+        Args:
+            kind (str): Job type, selects the handler
+            payload (dict): Handler arguments (JSON serializable)
+            dedupe_key (str): While a job with this key is queued or running, submitting another returns it instead
+            max_attempts (int): Attempts before the job is dead-lettered
+
+        Returns:
+            str: Job ID
+        """
+        def insert(connection):
+            if dedupe_key is not None:
+                row = connection.execute(
+                    'SELECT id FROM jobs WHERE dedupe_key = ? AND kind = ? AND status IN (?, ?)',
+                    (dedupe_key, kind, QUEUED, RUNNING)).fetchone()
+                if row is not None:
+                    return row['id']
+
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            connection.execute(
+                'INSERT INTO jobs (id, kind, payload, status, created_at, updated_at, available_at, '
+                'max_attempts, dedupe_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, kind, json.dumps(payload), QUEUED, now, now, now, max_attempts, dedupe_key))
+            return job_id
+
+        return self._transaction(insert)
+
+    def _scrubbed_payload(self, connection, job_id):
+        row = connection.execute('SELECT payload FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        payload = json.loads(row['payload']) if row is not None else {}
+        return json.dumps({key: value for key, value in payload.items() if key not in CREDENTIAL_FIELDS})
+
+    def claim(self, worker, kinds):
+        """
+        Take the oldest job of the given types that is due, or whose worker's lease expired
+
+        Args:
+            worker (str): Worker ID
+            kinds (list): Job types the worker has handlers for
+
+        Returns:
+            dict: The job with its payload, attempt number and last progress, or None if there is none
+        """
+        placeholders = ', '.join('?' * len(kinds))
+
+        def take(connection):
+            now = time.time()
+            # A job whose worker died on its last attempt (e.g. a crash it causes) isn't run again
+            lost = connection.execute(
+                f'SELECT id, attempts FROM jobs WHERE kind IN ({placeholders}) AND status = ? '
+                f'AND lease_expires_at < ? AND attempts >= max_attempts',
+                (*kinds, RUNNING, now)).fetchall()
+            for job in lost:
+                connection.execute(
+                    'UPDATE jobs SET status = ?, error = ?, payload = ?, lease_expires_at = NULL, updated_at = ? '
+                    'WHERE id = ?',
+                    (DEAD, f"Worker lost on attempt {job['attempts']}", self._scrubbed_payload(connection, job['id']),
+                     now, job['id']))
+
+            row = connection.execute(
+                f'SELECT id, kind, payload, attempts, progress FROM jobs '
+                f'WHERE kind IN ({placeholders}) AND ((status = ? AND available_at <= ?) '
+                f'OR (status = ? AND lease_expires_at < ?)) ORDER BY created_at LIMIT 1',
+                (*kinds, QUEUED, now, RUNNING, now)).fetchone()
+            if row is not None:
+                connection.execute(
+                    'UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, lease_expires_at = ?, '
+                    'updated_at = ? WHERE id = ?',
+                    (RUNNING, worker, now + LEASE_SECONDS, now, row['id']))
+            return row
+
+        row = self._transaction(take)
+        if row is None:
+            return None
+        return {
+            'id': row['id'],
+            'kind': row['kind'],
+            'payload': json.loads(row['payload']),
+            'attempt': row['attempts'] + 1,
+            'progress': json.loads(row['progress']) if row['progress'] else {}
+        }
+
+    def _update_owned(self, job_id, worker, assignments, values):
+        cursor = self._connection().execute(
+            f'UPDATE jobs SET {assignments}, updated_at = ? WHERE id = ? AND worker = ? AND status = ?',
+            (*values, time.time(), job_id, worker, RUNNING))
+        if cursor.rowcount == 0:
+            raise LeaseLost(f"Job {job_id} is no longer run by {worker}")
+
+    def heartbeat(self, job_id, worker):
+        """
+        Renew the lease of a running job
+        """
+        self._update_owned(job_id, worker, 'lease_expires_at = ?', (time.time() + LEASE_SECONDS,))
+
+    def report_progress(self, job_id, worker, progress):
+        """
+        Save the progress of a running job and renew its lease. The progress is
+        given back to the handler if the job is retried, so it can skip the steps already done.
+
+        Args:
+            progress (dict): JSON serializable progress
+        """
+        self._update_owned(job_id, worker, 'progress = ?, lease_expires_at = ?',
+                           (json.dumps(progress), time.time() + LEASE_SECONDS))
+
+    def complete(self, job_id, worker, result):
+        self._update_owned(job_id, worker, 'status = ?, result = ?, error = NULL, payload = ?, lease_expires_at = NULL',
+                           (SUCCEEDED, json.dumps(result), self._scrubbed_payload(self._connection(), job_id)))
+
+    def fail(self, job_id, worker, error, permanent=False):
+        """
+        Retry a failed job later, or dead-letter it once it used all its attempts
+
+        Returns:
+            str: New status of the job
+        """
+        row = self._connection().execute('SELECT attempts, max_attempts FROM jobs WHERE id = ?',
+                                         (job_id,)).fetchone()
+        if permanent or row is None or row['attempts'] >= row['max_attempts']:
+            self._update_owned(job_id, worker, 'status = ?, error = ?, payload = ?, lease_expires_at = NULL',
+                               (DEAD, str(error), self._scrubbed_payload(self._connection(), job_id)))
+            return DEAD
+
+        delay = random.uniform(0, min(RETRY_CAP, RETRY_BASE * 2 ** row['attempts']))
+        self._update_owned(job_id, worker, 'status = ?, error = ?, available_at = ?, lease_expires_at = NULL',
+                           (QUEUED, str(error), time.time() + delay))
+        return QUEUED
+
+    def requeue(self, job_id, credentials=None):
+        """
+        Give a dead-lettered job a new round of attempts
+
+        Args:
+            job_id (str): Job ID
+            credentials (dict): Credentials to put back in the payload (e.g. refresh_token), they were
+                removed when the job was dead-lettered
+
+        Returns:
+            bool: False if the job isn't dead-lettered
+        """
+        def update(connection):
+            row = connection.execute('SELECT payload FROM jobs WHERE id = ? AND status = ?',
+                                     (job_id, DEAD)).fetchone()
+            if row is None:
+                return False
+            now = time.time()
+            connection.execute(
+                'UPDATE jobs SET status = ?, attempts = 0, payload = ?, available_at = ?, updated_at = ? WHERE id = ?',
+                (QUEUED, json.dumps({**json.loads(row['payload']), **(credentials or {})}), now, now, job_id))
+            return True
+
+        return self._transaction(update)
+
+    def get(self, job_id):
+        """
+        Returns:
+            dict: Job status, progress, result and error, or None if the job doesn't exist
+        """
+        row = self._connection().execute(
+            'SELECT id, kind, status, attempts, max_attempts, progress, result, error, created_at, updated_at '
+            'FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        job['progress'] = json.loads(job['progress']) if job['progress'] else {}
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def dead_letters(self, limit=100):
+        """
+        Returns:
+            list: Dead-lettered jobs, most recent first
+        """
+        rows = self._connection().execute(
+            'SELECT id FROM jobs WHERE status = ? ORDER BY updated_at DESC LIMIT ?', (DEAD, limit)).fetchall()
+        return [self.get(row['id']) for row in rows]
+
+    def counts(self):
+        """
+        Returns:
+            dict: Number of jobs per status
+        """
+        return dict(self._connection().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+
+class JobContext:
+    def __init__(self, queue, job, worker):
+        """
+        What a handler gets besides its payload: the attempt number, the progress
+        saved by earlier attempts, and a way to save its own
+        """
+        self.queue = queue
+        self.id = job['id']
+        self.attempt = job['attempt']
+        self.progress = job['progress']
+        self.worker = worker
+
+    def update(self, **fields):
+        """
+        Save progress fields (e.g. the step reached, IDs created so far)
+        """
+        self.progress = {**self.progress, **fields}
+        self.queue.report_progress(self.id, self.worker, self.progress)
+
+
+class WorkerPool:
+    def __init__(self, queue, handlers, workers=4, poll_interval=POLL_INTERVAL):
+        """
+        Threads running the jobs of a queue. Several pools (in several processes) can share a queue.
+
+        Args:
+            queue (JobQueue): Queue to take the jobs from
+            handlers (dict): Handler per job type, called with the payload and a JobContext,
+                returning a JSON serializable result
+            workers (int): Number of threads
+            poll_interval (float): Seconds an idle worker waits before looking for a new job
+        """
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_interval = poll_interval
+
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(f"{os.getpid()}-{uuid.uuid4().hex[:8]}",),
+                                      name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """
+        Stop the workers once their current job is done
+        """
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _heartbeat(self, job_id, worker, done):
+        while not done.wait(LEASE_SECONDS / 3):
+            try:
+                self.queue.heartbeat(job_id, worker)
+            except LeaseLost as e:
+                print(f"Worker {worker} stopped renewing the lease of job {job_id}: {e}")
+                return
+            except sqlite3.Error as e:
+                # The lease still has two thirds of its time, the next renewal may get through
+                print(f"Worker {worker} couldn't renew the lease of job {job_id}: {e}")
+
+    def _finish(self, job, worker, action, *args, **kwargs):
+        """
+        Record the outcome of a job, retrying database errors as long as the lease is kept,
+        so a done job isn't run again by another worker
+
+        Returns:
+            Return value of action, None if the lease was lost or the pool stopped
+        """
+        backoff = DB_ERROR_BACKOFF
+        while True:
+            try:
+                return action(job['id'], worker, *args, **kwargs)
+            except LeaseLost as e:
+                print(f"Worker {worker} lost job {job['id']} ({job['kind']}) before recording it: {e}")
+                return None
+            except sqlite3.Error as e:
+                print(f"Worker {worker} couldn't record job {job['id']} ({job['kind']}), "
+                      f"retrying in {backoff} s: {e}")
+                if self._stop.wait(backoff):
+                    print(f"Worker {worker} stopped, job {job['id']} runs again once its lease expires")
+                    return None
+                backoff = min(backoff * 2, DB_ERROR_BACKOFF_CAP)
+
+    def _work(self, worker):
+        backoff = DB_ERROR_BACKOFF
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(worker, list(self.handlers))
+            except sqlite3.Error as e:
+                print(f"Worker {worker} couldn't claim a job, retrying in {backoff} s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, DB_ERROR_BACKOFF_CAP)
+                continue
+            backoff = DB_ERROR_BACKOFF
+
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+
+            # Keep the lease while a long step (e.g. a slow eBay call) runs, and until the outcome is recorded
+            done = threading.Event()
+            threading.Thread(target=self._heartbeat, args=(job['id'], worker, done), daemon=True).start()
+
+            try:
+                result = self.handlers[job['kind']](job['payload'], JobContext(self.queue, job, worker))
+            except LeaseLost as e:
+                print(f"Worker {worker} lost job {job['id']} ({job['kind']}) while running it: {e}")
+            except Exception as e:
+                permanent = isinstance(e, PermanentJobError)
+                status = self._finish(job, worker, self.queue.fail, e, permanent=permanent)
+                if status is not None:
+                    print(f"Job {job['id']} ({job['kind']}) attempt {job['attempt']} failed ({status}): {e}")
+            else:
+                self._finish(job, worker, self.queue.complete, result)
+            finally:
+                done.set()
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    global _queue
+
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
@@ -0,0 +1,193 @@
+import codecs
+import json
+import re
+
+# Faster decoder of whole documents, optional. Streamed documents are always decoded with
+# json.JSONDecoder.raw_decode: orjson can't stop after a value followed by more text, and
+# finding where each item ends before handing it to orjson costs more than orjson saves
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Size of the chunks read from a streamed response
+STREAM_CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# Characters a number may continue with, e.g. "2." of "2.5" split between chunks
+NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+
+
+class _Reader:
+    def __init__(self, chunks):
+        """
+        Pull reader over a JSON document arriving as UTF-8 chunks, keeping only
+        the text of the value being decoded
+        """
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        # Read at least twice as much text as the unconsumed part of the buffer holds, so a large
+        # value is decoded again a logarithmic number of times. Returns False at the end of the document
+        if self.eof:
+            return False
+
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        wanted = 2 * max(len(self.buffer), 1)
+        parts = [self.buffer]
+        read = 0
+        for chunk in self._chunks:
+            text = self._utf8.decode(chunk)
+            parts.append(text)
+            read += len(text)
+            if read >= wanted:
+                break
+        else:
+            parts.append(self._utf8.decode(b'', final=True))
+            self.eof = True
+
+        self.buffer = ''.join(parts)
+        return True
+
+    def peek(self):
+        # Next character after whitespace, not consumed
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def next(self):
+        char = self.peek()
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Incomplete value, or invalid once the whole document was read
+                if self._fill():
+                    continue
+                raise
+
+            # A number ending the buffer may continue in the next chunk
+            if not self.eof and isinstance(value, (int, float)) and not isinstance(value, bool) and \
+                    NUMBER_TAIL.match(self.buffer, end).end() == len(self.buffer) and self._fill():
+                continue
+
+            self.pos = end
+            return value
+
+
+def _walk(reader, prefix, path):
+    if path == prefix:
+        if reader.peek() != '[':
+            reader.value()
+            return
+
+        reader.next()
+        if reader.peek() == ']':
+            reader.next()
+            return
+        while True:
+            yield path, reader.value()
+            separator = reader.next()
+            if separator == ']':
+                return
+            if separator != ',':
+                raise ValueError(f"Unexpected {separator!r} in array {'.'.join(path)}")
+
+    # Object on the way to the array (or something else where eBay never sends one)
+    if reader.peek() != '{':
+        reader.value()
+        return
+
+    reader.next()
+    if reader.peek() == '}':
+        reader.next()
+        return
+    while True:
+        key = reader.value()
+        if not isinstance(key, str) or reader.next() != ':':
+            raise ValueError(f"Invalid key in object {'.'.join(path)}")
+
+        child = path + (key,)
+        if child == prefix[:len(child)]:
+            yield from _walk(reader, prefix, child)
+        else:
+            yield child, reader.value()
+
+        separator = reader.next()
+        if separator == '}':
+            return
+        if separator != ',':
+            raise ValueError(f"Unexpected {separator!r} in object {'.'.join(path)}")
+
+
+def _walk_value(value, prefix, path):
+    if path == prefix:
+        if isinstance(value, list):
+            for item in value:
+                yield path, item
+        return
+
+    if not isinstance(value, dict):
+        return
+    for key, child_value in value.items():
+        child = path + (key,)
+        if child == prefix[:len(child)]:
+            yield from _walk_value(child_value, prefix, child)
+        else:
+            yield child, child_value
+
+
+def loads(data):
+    """
+    Decode a whole JSON document, with orjson when it is installed (about twice as fast as json)
+    """
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def iter_json(chunks, prefix):
+    """
+    Parse a JSON document arriving in chunks, yielding the items of one of its
+    arrays as soon as each one is complete
+
+    Only one item is decoded at a time, so a large response (e.g. the aspects of a
+    clothing category) never exists as a whole in memory, neither as text nor as objects.
+    The other values met on the way to the array are yielded too, keyed by their path.
+
+    Chunks are decoded with the standard library json module. A body already in
+    memory is decoded at once instead, with orjson when it is installed, see loads.
+
+    Args:
+        chunks (iterable): UTF-8 chunks of the document, e.g. response.iter_content(STREAM_CHUNK_SIZE), or the whole body
+        prefix (tuple): Keys leading to the array, e.g. ('aspects',)
+
+    Yields:
+        tuple: (path, value). Array items have the path prefix, e.g. (('aspects',), {...}),
+        other values the keys leading to them, e.g. (('categoryTreeId',), '0')
+    """
+    prefix = tuple(prefix)
+    if isinstance(chunks, (bytes, bytearray, str)):
+        yield from _walk_value(loads(chunks), prefix, ())
+        return
+
+    reader = _Reader(chunks)
+    yield from _walk(reader, prefix, ())
+    # Only whitespace may follow the document
+    try:
+        char = reader.peek()
+    except ValueError:
+        return
+    raise ValueError(f"Unexpected {char!r} after the JSON document")
@@ -0,0 +1,166 @@
+import csv
+import json
+
+# Currency of each marketplace offered in the listing form
+MARKETPLACE_CURRENCIES = {
+    'EBAY_US': 'USD',
+    'EBAY_CA': 'CAD',
+    'EBAY_GB': 'GBP',
+    'EBAY_AU': 'AUD',
+    'EBAY_DE': 'EUR',
+    'EBAY_FR': 'EUR',
+    'EBAY_IT': 'EUR',
+    'EBAY_ES': 'EUR'
+}
+
+# Conditions of the listing form mapped to eBay condition enums
+CONDITIONS = {
+    'New with box': 'NEW',
+    'New without box': 'NEW_OTHER',
+    'New with defects': 'NEW_WITH_DEFECTS',
+    'Pre-owned': 'USED_EXCELLENT'
+}
+
+# Separator of multiple values in a CSV cell (image URLs, aspect values)
+CSV_VALUE_SEPARATOR = '|'
+# Prefix of CSV columns holding aspects, e.g. "aspect:Brand"
+CSV_ASPECT_PREFIX = 'aspect:'
+
+
+def _as_list(value):
+    if value is None or value == '':
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [item.strip() for item in str(value).split(CSV_VALUE_SEPARATOR) if item.strip()]
+
+
+def normalize_record(row):
+    """
+    Convert a catalog row (CSV or JSONL) to a listing record
+
+    Args:
+        row (dict): Catalog row. Aspects come either as an "aspects" dict or
+            as "aspect:<name>" columns, multiple values are separated by "|"
+
+    Returns:
+        dict: Listing record
+    """
+    aspects = {name: _as_list(values) for name, values in (row.get('aspects') or {}).items()}
+    for column, values in row.items():
+        if column.startswith(CSV_ASPECT_PREFIX) and values:
+            aspects[column[len(CSV_ASPECT_PREFIX):]] = _as_list(values)
+
+    marketplace_id = row.get('marketplace_id') or 'EBAY_US'
+
+    return {
+        'sku': str(row['sku']).strip(),
+        'title': row.get('title', ''),
+        'description': row.get('description', ''),
+        'aspects': aspects,
+        'image_urls': _as_list(row.get('image_urls')),
+        'video_ids': _as_list(row.get('video_ids')),
+        'condition': CONDITIONS.get(row.get('condition'), row.get('condition') or 'NEW'),
+        'quantity': int(row.get('quantity') or 1),
+        'price': float(row.get('price') or 0),
+        'currency': row.get('currency') or MARKETPLACE_CURRENCIES.get(marketplace_id, 'USD'),
+        'category_id': str(row.get('category_id', '')),
+        'marketplace_id': marketplace_id,
+        'merchant_location': row.get('merchant_location', ''),
+        'fulfillment_policy': row.get('fulfillment_policy', ''),
+        'payment_policy': row.get('payment_policy', ''),
+        'return_policy': row.get('return_policy', '')
+    }
+
+
+def read_catalog(path):
+    """
+    Lazily read listing records from a CSV or JSONL catalog
+
+    Args:
+        path (str): Catalog file (.csv or .jsonl)
+
+    Yields:
+        dict: Listing records
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+
+        for row in rows:
+            yield normalize_record(row)
+
+
+def build_inventory_item(record):
+    """
+    Build an inventory item payload (see Sample_listing/sample_inventory_item.json)
+
+    Args:
+        record (dict): Listing record
+
+    Returns:
+        dict: Inventory item
+    """
+    item = {
+        'product': {
+            'title': record['title'],
+            'aspects': record['aspects'],
+            'description': record['description'],
+            'imageUrls': record['image_urls']
+        },
+        'condition': record['condition'],
+        'availability': {
+            'shipToLocationAvailability': {
+                'quantity': record['quantity']
+            }
+        }
+    }
+    if record.get('video_ids'):
+        item['product']['videoIds'] = record['video_ids']
+    return item
+
+
+def build_offer(record, marketplace_id=None, category_id=None, price=None):
+    """
+    Build an offer payload (see Sample_listing/sample_createOffer.json)
+
+    Args:
+        record (dict): Listing record
+        marketplace_id (str): Marketplace of the offer, defaults to the record's marketplace
+        category_id (str): Category in the tree of that marketplace, defaults to the record's category
+        price (float): Price in the currency of that marketplace, defaults to the record's price on
+            the record's marketplace, required on the others
+
+    Returns:
+        dict: Offer
+    """
+    marketplace_id = marketplace_id or record['marketplace_id']
+    currency = record['currency']
+    if marketplace_id != record['marketplace_id']:
+        currency = MARKETPLACE_CURRENCIES.get(marketplace_id, currency)
+        # The record's price is in the record's currency
+        if price is None:
+            raise ValueError(f"A price in {currency} is required for {marketplace_id}")
+
+    return {
+        'sku': record['sku'],
+        'marketplaceId': marketplace_id,
+        'format': 'FIXED_PRICE',
+        'listingDuration': 'GTC',
+        'availableQuantity': record['quantity'],
+        'listingPolicies': {
+            'fulfillmentPolicyId': record['fulfillment_policy'],
+            'paymentPolicyId': record['payment_policy'],
+            'returnPolicyId': record['return_policy']
+        },
+        'pricingSummary': {
+            'price': {
+                'value': record['price'] if price is None else price,
+                'currency': currency
+            }
+        },
+        'categoryId': category_id or record['category_id'],
+        'merchantLocationKey': record['merchant_location']
+    }
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from PIL import Image, ImageOps
+
+# Where uploaded media and their derivatives are stored
+MEDIA_DIR = os.path.join('.cache', 'media')
+
+# Longest edge of the thumbnails shown in the listing form
+THUMBNAIL_SIZE = 200
+# Longest edge of the images uploaded to eBay (eBay recommends 1600px)
+EBAY_IMAGE_SIZE = 1600
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+
+# Number of images uploaded to eBay at the same time
+UPLOAD_WORKERS = 8
+# eBay picture URLs are kept for reuse until shortly before they expire
+UPLOAD_REUSE_MARGIN = 24 * 3600
+
+
+class MediaStore:
+    def __init__(self, root=MEDIA_DIR):
+        """
+        Content-addressed store for uploaded images and videos
+
+        Originals are written once under their SHA-256, so the same file uploaded
+        twice (or by two sessions) is stored once. Resized derivatives are
+        generated on first use and cached next to them.
+
+        Args:
+            root (str): Store directory
+        """
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, kind, name):
+        return os.path.join(self.root, kind, name[:2], name)
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def put(self, data, filename=None):
+        """
+        Store media content
+
+        Args:
+            data (bytes): File content
+            filename (str): Original file name
+
+        Returns:
+            str: SHA-256 digest identifying the content
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+
+        if not os.path.exists(path):
+            self._write(path, data)
+            self.update_metadata(digest, filename=filename, size=len(data))
+        return digest
+
+    def path(self, digest):
+        """
+        Returns:
+            str: Path of the original content
+        """
+        return self._path('originals', digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def metadata(self, digest):
+        try:
+            with open(f"{self.path(digest)}.json", encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def update_metadata(self, digest, **fields):
+        with self._lock:
+            metadata = {**self.metadata(digest), **fields}
+            self._write(f"{self.path(digest)}.json", json.dumps(metadata).encode())
+        return metadata
+
+    def derivative(self, digest, max_edge=EBAY_IMAGE_SIZE, image_format='JPEG'):
+        """
+        Get a resized and compressed copy of an image, generating it on first use
+
+        Args:
+            digest (str): Digest of the original image
+            max_edge (int): Longest edge in pixels, smaller images aren't upscaled
+            image_format (str): JPEG or WEBP
+
+        Returns:
+            str: Path of the derivative
+        """
+        extension = 'webp' if image_format == 'WEBP' else 'jpg'
+        path = self._path('derivatives', f"{digest}_{max_edge}.{extension}")
+        if os.path.exists(path):
+            return path
+
+        with Image.open(self.path(digest)) as image:
+            # Apply the camera orientation before EXIF data is dropped
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            if image_format == 'WEBP':
+                image.save(tmp_path, 'WEBP', quality=WEBP_QUALITY, method=4)
+            else:
+                image.save(tmp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            os.replace(tmp_path, path)
+
+        return path
+
+    def thumbnail(self, digest):
+        """
+        Returns:
+            str: Path of the thumbnail shown in the listing form
+        """
+        return self.derivative(digest, max_edge=THUMBNAIL_SIZE, image_format='WEBP')
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_media_store():
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MediaStore()
+    return _store
+
+
+def upload_image(client, store, digest):
+    """
+    Upload the eBay-sized derivative of an image, reusing an earlier upload that hasn't expired
+
+    Args:
+        client (EbayAPI): Client with a valid user token
+        store (MediaStore): Store holding the image
+        digest (str): Digest of the original image
+
+    Returns:
+        str: eBay picture URL
+    """
+    # Picture URLs and video IDs belong to one eBay environment
+    url_key, expiry_key = f"{client.env}_image_url", f"{client.env}_image_expires_at"
+
+    metadata = store.metadata(digest)
+    if metadata.get(url_key) and metadata.get(expiry_key, 0) > time.time() + UPLOAD_REUSE_MARGIN:
+        return metadata[url_key]
+
+    image = client.upload_image(store.derivative(digest))
+
+    expires_at = 0
+    if image.get('expirationDate'):
+        expires_at = datetime.fromisoformat(image['expirationDate'].replace('Z', '+00:00')).timestamp()
+
+    store.update_metadata(digest, **{url_key: image['imageUrl'], expiry_key: expires_at})
+    return image['imageUrl']
+
+
+def upload_images(client, store, digests, max_workers=UPLOAD_WORKERS):
+    """
+    Upload images to eBay in parallel
+
+    Args:
+        client (EbayAPI): Client with a valid user token
+        store (MediaStore): Store holding the images
+        digests (list): Digests of the images, in listing order
+        max_workers (int): Number of concurrent uploads
+
+    Returns:
+        list: eBay picture URLs, in the same order
+    """
+    if not digests:
+        return []
+
+    # The same image listed twice is uploaded once
+    unique = list(dict.fromkeys(digests))
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique))) as executor:
+        urls = dict(zip(unique, executor.map(lambda digest: upload_image(client, store, digest), unique)))
+    return [urls[digest] for digest in digests]
+
+
+def upload_video(client, store, digest, title):
+    """
+    Create an eBay video and upload its content from the store in chunks. The
+    video ID and the bytes acknowledged are saved as the upload goes, so a
+    failed upload (e.g. a retried job) resumes where it stopped.
+
+    Args:
+        client (EbayAPI): Client with a valid user token
+        store (MediaStore): Store holding the video
+        digest (str): Digest of the video
+        title (str): Video title
+
+    Returns:
+        str: eBay video ID
+    """
+    video_key, upload_key = f"{client.env}_video_id", f"{client.env}_video_upload"
+
+    metadata = store.metadata(digest)
+    if metadata.get(video_key):
+        return metadata[video_key]
+
+    path = store.path(digest)
+    upload = metadata.get(upload_key)
+    if not upload:
+        upload = {'video_id': client.create_video(title, os.path.getsize(path)), 'offset': 0}
+        store.update_metadata(digest, **{upload_key: upload})
+
+    video_id = upload['video_id']
+    client.upload_video(video_id, path, offset=upload['offset'],
+                        on_chunk=lambda offset: store.update_metadata(
+                            digest, **{upload_key: {'video_id': video_id, 'offset': offset}}))
+
+    store.update_metadata(digest, **{video_key: video_id, upload_key: None})
+    return video_id
@@ -0,0 +1,298 @@
+import bisect
+import json
+import threading
+import time
+from collections import deque
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Finished traces (root spans with their children) kept for the performance panel
+TRACE_HISTORY = 50
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Counts of observed values per bucket, with their sum
+
+        Args:
+            buckets (tuple): Sorted bucket upper bounds
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Estimate a quantile, interpolating linearly inside its bucket
+
+        Returns:
+            float: The estimate, None without observations
+        """
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                # Values over the last bound are reported as the last bound
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Span:
+    def __init__(self, metrics, name, labels, root):
+        """
+        Timed operation, recorded in the {name}_seconds histogram when it ends
+
+        Spans started on the same thread while another one is open are its
+        children: the trace of a root span shows where its time went.
+        """
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.root = root
+        self.children = []
+        self.started_at = None
+        self.duration = None
+
+    def set(self, **labels):
+        # Labels only known once the operation ran, e.g. the response status
+        self.labels.update(labels)
+        return self
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.metrics._push(self)
+        return self
+
+    def end(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.started_at
+            self.metrics._pop(self)
+        return self
+
+    def trace(self):
+        """
+        Returns:
+            list: (depth, name, labels, start offset, duration) of this span and its descendants, in start order
+        """
+        rows = []
+
+        def walk(span, depth):
+            rows.append((depth, span.name, dict(span.labels), span.started_at - self.started_at, span.duration))
+            for child in span.children:
+                walk(child, depth + 1)
+
+        walk(self, 0)
+        return rows
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and 'error' not in self.labels:
+            self.labels['error'] = exc_type.__name__
+        self.end()
+
+
+class Metrics:
+    def __init__(self, buckets=LATENCY_BUCKETS, trace_history=TRACE_HISTORY):
+        """
+        Process-wide latency histograms, counters and gauges, exported as
+        Prometheus text or JSON
+
+        Args:
+            buckets (tuple): Histogram bucket upper bounds in seconds
+            trace_history (int): Number of finished traces kept
+        """
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = []
+        self.traces = deque(maxlen=trace_history)
+
+    def _push(self, span):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None or span.root:
+            # A root span drops the spans an interrupted run (e.g. st.rerun) left open on this thread
+            stack = self._local.stack = []
+        if stack:
+            stack[-1].children.append(span)
+        stack.append(span)
+
+    def _pop(self, span):
+        stack = getattr(self._local, 'stack', [])
+        # Generators may end their span after the spans started by their consumer
+        if span in stack:
+            del stack[stack.index(span):]
+        self.observe(f"{span.name}_seconds", span.duration, **span.labels)
+        if not stack:
+            self.traces.append(span)
+
+    def span(self, name, root=False, **labels):
+        """
+        Time an operation: use as a context manager, or call start() and end()
+
+        Args:
+            name (str): Metric name, without the _seconds suffix
+            root (bool): Start a new trace even if spans are open on this thread
+            **labels: Label values of the series
+
+        Returns:
+            Span: The span, not started yet
+        """
+        return Span(self, name, labels, root)
+
+    def observe(self, name, value, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def register_collector(self, name, collect, **labels):
+        """
+        Export the numeric values returned by a stats function as {name}_{key} gauges
+
+        Args:
+            name (str): Gauge name prefix
+            collect (callable): Returns a dict of current values, e.g. TTLCache.stats
+            **labels: Label values of the gauges
+        """
+        with self._lock:
+            self._collectors.append((name, collect, label_key(labels)))
+
+    def histogram(self, name, **labels):
+        with self._lock:
+            return self._histograms.get((name, label_key(labels)))
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, label_key(labels)), 0)
+
+    def _gauges(self):
+        with self._lock:
+            collectors = list(self._collectors)
+
+        gauges = {}
+        for prefix, collect, labels in collectors:
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"Metrics collector {prefix} failed: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges[(f"{prefix}_{key}", labels)] = value
+        return gauges
+
+    def to_json(self):
+        """
+        Returns:
+            dict: Histograms (count, sum, p50, p95, p99, buckets), counters and gauges
+        """
+        with self._lock:
+            histograms = [{
+                'name': name,
+                'labels': dict(labels),
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'p50': histogram.quantile(0.5),
+                'p95': histogram.quantile(0.95),
+                'p99': histogram.quantile(0.99),
+                'buckets': dict(zip([*map(str, histogram.buckets), '+Inf'], histogram.counts))
+            } for (name, labels), histogram in sorted(self._histograms.items())]
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+
+        gauges = [{'name': name, 'labels': dict(labels), 'value': value}
+                  for (name, labels), value in sorted(self._gauges().items())]
+        return {'histograms': histograms, 'counters': counters, 'gauges': gauges}
+
+    def to_prometheus(self):
+        """
+        Returns:
+            str: All metrics in the Prometheus text exposition format
+        """
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                declare(name, 'histogram')
+                cumulative = 0
+                for bound, count in zip([*map(str, histogram.buckets), '+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+            for (name, labels), value in sorted(self._counters.items()):
+                declare(name, 'counter')
+                lines.append(f"{name}{format_labels(labels)} {value}")
+
+        for (name, labels), value in sorted(self._gauges().items()):
+            declare(name, 'gauge')
+            lines.append(f"{name}{format_labels(labels)} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+    def dumps(self):
+        return json.dumps(self.to_json(), indent=2)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self.traces.clear()
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    global _metrics
+
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = Metrics()
+    return _metrics
@@ -0,0 +1,157 @@
+import json
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class PartialJSONParser:
+    def __init__(self):
+        """
+        Incremental parser for a JSON object arriving in chunks (e.g. streamed LLM output)
+
+        String values are readable while they are still being received, so a
+        partially received response still yields its complete fields and the
+        beginning of the field it stopped in. Text before the opening brace
+        (such as a markdown code fence) is ignored.
+        """
+        # Fields whose value was completely received
+        self.values = {}
+        # Key and text received so far of the string value being read
+        self.partial_key = None
+        self.partial_text = []
+        # True once the closing brace of the object was received
+        self.done = False
+
+        self._state = 'start'
+        self._key = []
+        self._escape = None
+        # Raw text of a non-string value, with its nesting depth and whether it is inside a string
+        self._raw = []
+        self._raw_depth = 0
+        self._raw_in_string = False
+        self._raw_escape = False
+
+    def result(self):
+        """
+        Returns:
+            dict: Complete fields, plus the partially received string field if any
+        """
+        if self.partial_key is None:
+            return dict(self.values)
+        return {**self.values, self.partial_key: ''.join(self.partial_text)}
+
+    def missing(self, keys):
+        """
+        Returns:
+            list: The keys that weren't completely received
+        """
+        return [key for key in keys if key not in self.values]
+
+    def feed(self, chunk):
+        """
+        Parse the next chunk
+
+        Args:
+            chunk (str): Text following the previous chunk
+
+        Returns:
+            dict: Fields received so far, see result()
+        """
+        for char in chunk:
+            if self.done:
+                break
+            getattr(self, f"_on_{self._state}")(char)
+        return self.result()
+
+    def _on_start(self, char):
+        if char == '{':
+            self._state = 'key_or_end'
+
+    def _on_key_or_end(self, char):
+        if char == '"':
+            self._key = []
+            self._escape = None
+            self._state = 'key'
+        elif char == '}':
+            self.done = True
+        elif not char.isspace() and char != ',':
+            raise ValueError(f"Unexpected {char!r} while expecting a key")
+
+    def _read_string_char(self, char, buffer):
+        # Returns True at the closing quote
+        if self._escape is not None:
+            if self._escape == '':
+                if char == 'u':
+                    self._escape = 'u'
+                else:
+                    buffer.append(_ESCAPES.get(char, char))
+                    self._escape = None
+            else:
+                self._escape += char
+                if len(self._escape) == 5:
+                    buffer.append(chr(int(self._escape[1:], 16)))
+                    self._escape = None
+            return False
+
+        if char == '\\':
+            self._escape = ''
+            return False
+        if char == '"':
+            return True
+        buffer.append(char)
+        return False
+
+    def _on_key(self, char):
+        if self._read_string_char(char, self._key):
+            self._state = 'colon'
+
+    def _on_colon(self, char):
+        if char == ':':
+            self._state = 'value_start'
+        elif not char.isspace():
+            raise ValueError(f"Unexpected {char!r} while expecting ':'")
+
+    def _on_value_start(self, char):
+        if char.isspace():
+            return
+
+        if char == '"':
+            self.partial_key = ''.join(self._key)
+            self.partial_text = []
+            self._escape = None
+            self._state = 'string'
+        else:
+            self._raw = [char]
+            self._raw_depth = 1 if char in '[{' else 0
+            self._raw_in_string = False
+            self._raw_escape = False
+            self._state = 'raw'
+
+    def _on_string(self, char):
+        if self._read_string_char(char, self.partial_text):
+            self.values[self.partial_key] = ''.join(self.partial_text)
+            self.partial_key = None
+            self.partial_text = []
+            self._state = 'key_or_end'
+
+    def _on_raw(self, char):
+        if self._raw_in_string:
+            if self._raw_escape:
+                self._raw_escape = False
+            elif char == '\\':
+                self._raw_escape = True
+            elif char == '"':
+                self._raw_in_string = False
+        elif char == '"':
+            self._raw_in_string = True
+        elif char in '[{':
+            self._raw_depth += 1
+        elif char in ']}' and self._raw_depth:
+            self._raw_depth -= 1
+        elif self._raw_depth == 0 and char in ',}':
+            self.values[''.join(self._key)] = json.loads(''.join(self._raw))
+            self._state = 'key_or_end'
+            if char == '}':
+                self.done = True
+            return
+
+        self._raw.append(char)
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Threads shared by all pipeline runs of the process
+PIPELINE_WORKERS = 16
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+def input_key(*values):
+    """
+    Hash the inputs of a pipeline run, to tell whether a run is stale
+
+    Returns:
+        str: Hex digest of the inputs, ignoring whitespace differences in strings
+    """
+    normalized = [' '.join(value.split()) if isinstance(value, str) else value for value in values]
+    return hashlib.sha256(json.dumps(normalized, default=str).encode()).hexdigest()
+
+
+class Pipeline:
+    def __init__(self, key=None, executor=None):
+        """
+        Run of a small task graph: each task starts as soon as the tasks it
+        depends on finished, independent tasks run concurrently.
+
+        Args:
+            key (str): Inputs the run was started for (see input_key)
+            executor (ThreadPoolExecutor): Threads to run the tasks on, defaults to the shared pool
+        """
+        self.key = key
+        self._executor = executor
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+
+        self.status = {}
+        self.results = {}
+        self.errors = {}
+        # Latest intermediate result reported by running tasks
+        self.progress = {}
+        self.timings = {}
+        self.started_at = None
+        self.finished_at = None
+
+    def add(self, name, fn, deps=()):
+        """
+        Add a task, called with the results of its dependencies as keyword arguments
+
+        Args:
+            name (str): Task name
+            fn (callable): Task function
+            deps (tuple): Names of the tasks it depends on, added before it
+        """
+        for dep in deps:
+            if dep not in self._tasks:
+                raise ValueError(f"Unknown dependency {dep} of {name}")
+
+        self._tasks[name] = (fn, tuple(deps))
+        self.status[name] = PENDING
+        return self
+
+    def start(self):
+        self.started_at = time.monotonic()
+        if not self._tasks:
+            self._finish()
+
+        for name, (_, deps) in self._tasks.items():
+            if not deps:
+                self._submit(name)
+        return self
+
+    def cancel(self):
+        """
+        Stop the run: tasks not started yet never start, results of running ones are dropped
+        """
+        self._cancelled.set()
+        with self._lock:
+            for name, status in self.status.items():
+                if status in (PENDING, RUNNING):
+                    self.status[name] = CANCELLED
+        self._finish()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def done(self):
+        return self._finished.is_set()
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def report(self, name, value):
+        """
+        Publish an intermediate result of a running task (e.g. a partially generated text)
+        """
+        if not self.cancelled:
+            self.progress[name] = value
+
+    def _submit(self, name):
+        with self._lock:
+            if self.cancelled or self.status[name] != PENDING:
+                return
+            self.status[name] = RUNNING
+        (self._executor or get_executor()).submit(self._run, name)
+
+    def _run(self, name):
+        # Cancelled while waiting for a thread, e.g. superseded by a run for newer inputs
+        if self.cancelled:
+            return
+
+        fn, deps = self._tasks[name]
+        started = time.monotonic()
+        try:
+            result = fn(**{dep: self.results[dep] for dep in deps})
+        except Exception as e:
+            print(f"Pipeline task {name} failed: {e}")
+            outcome, result = FAILED, e
+        else:
+            outcome = DONE
+        self.timings[name] = time.monotonic() - started
+
+        with self._lock:
+            if self.cancelled:
+                return
+            self.status[name] = outcome
+            if outcome == DONE:
+                self.results[name] = result
+            else:
+                self.errors[name] = result
+
+            # Tasks depending on a failed one can never run
+            changed = True
+            while changed:
+                changed = False
+                for other, (_, other_deps) in self._tasks.items():
+                    if self.status[other] == PENDING and any(self.status[dep] == FAILED for dep in other_deps):
+                        self.status[other] = FAILED
+                        self.errors[other] = ValueError(f"A dependency of {other} failed")
+                        changed = True
+
+            ready = [other for other, (_, other_deps) in self._tasks.items()
+                     if self.status[other] == PENDING and name in other_deps
+                     and all(self.status[dep] == DONE for dep in other_deps)]
+            finished = all(status in (DONE, FAILED) for status in self.status.values())
+
+        for other in ready:
+            self._submit(other)
+        if finished:
+            self._finish()
+
+    def _finish(self):
+        if not self._finished.is_set():
+            self.finished_at = time.monotonic()
+            self._finished.set()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix='pipeline')
+    return _executor
@@ -0,0 +1,213 @@
+import asyncio
+import inspect
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.metrics import get_metrics
+
+# Number of suggested categories whose aspects are prefetched
+PREFETCH_TOP_N = 3
+# Prefetch requests allowed per window, across all sessions
+PREFETCH_BUDGET = 300
+PREFETCH_WINDOW = 3600
+PREFETCH_WORKERS = 4
+# Prefetched keys remembered to tell hits from misses
+PREFETCH_MEMORY = 4096
+
+
+class AspectPrefetcher:
+    def __init__(self, top_n=PREFETCH_TOP_N, budget=PREFETCH_BUDGET, window=PREFETCH_WINDOW,
+                 max_workers=PREFETCH_WORKERS):
+        """
+        Speculatively load the aspects of the categories a user is likely to pick next
+
+        Args:
+            top_n (int): Number of candidates prefetched per call, in ranking order
+            budget (int): Prefetch requests allowed per window
+            window (float): Budget window in seconds
+            max_workers (int): Concurrent prefetch requests of blocking fetch functions, coroutine
+                functions run on the prefetcher's event loop and are bounded by their own client
+        """
+        self.top_n = top_n
+        self.budget = budget
+        self.window = window
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+        self._loop = None
+        self._lock = threading.Lock()
+        self._requests = deque()
+        self._in_flight = {}
+        self._prefetched = OrderedDict()
+
+        self.scheduled = 0
+        self.skipped_cached = 0
+        self.over_budget = 0
+        self.failed = 0
+        self.hits = 0
+        self.late_hits = 0
+        self.already_cached = 0
+        self.misses = 0
+
+    def _take_budget(self):
+        now = time.monotonic()
+        while self._requests and self._requests[0] <= now - self.window:
+            self._requests.popleft()
+        if len(self._requests) >= self.budget:
+            return False
+        self._requests.append(now)
+        return True
+
+    def prefetch(self, keys, fetch, is_cached=None):
+        """
+        Load the top candidates in the background
+
+        Args:
+            keys (list): Candidate keys, most likely first
+            fetch (callable): Loads (and caches) the value of a key, a coroutine function (e.g. of
+                AsyncEbayAPI) fans out on the event loop instead of taking a thread per key
+            is_cached (callable): Tells whether a key is already cached, those aren't fetched again
+
+        Returns:
+            list: Keys scheduled for prefetching
+        """
+        scheduled = []
+        for key in keys[:self.top_n]:
+            if is_cached is not None and is_cached(key):
+                with self._lock:
+                    self.skipped_cached += 1
+                continue
+
+            with self._lock:
+                if key in self._in_flight:
+                    continue
+                if not self._take_budget():
+                    self.over_budget += 1
+                    break
+                self.scheduled += 1
+                if inspect.iscoroutinefunction(fetch):
+                    self._in_flight[key] = asyncio.run_coroutine_threadsafe(self._fetch_async(key, fetch),
+                                                                            self.event_loop())
+                else:
+                    self._in_flight[key] = self._executor.submit(self._fetch, key, fetch)
+            scheduled.append(key)
+
+        return scheduled
+
+    def event_loop(self):
+        """
+        Returns:
+            asyncio.AbstractEventLoop: Loop running the coroutine fetches in a background thread,
+            the async clients they use must be created and used on it only
+        """
+        if self._loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='prefetch-loop', daemon=True).start()
+            self._loop = loop
+        return self._loop
+
+    def _fetch(self, key, fetch):
+        try:
+            fetch(key)
+        except Exception as e:
+            self._done(key, e)
+        else:
+            self._done(key)
+
+    async def _fetch_async(self, key, fetch):
+        try:
+            await fetch(key)
+        except Exception as e:
+            self._done(key, e)
+        else:
+            self._done(key)
+
+    def _done(self, key, error=None):
+        with self._lock:
+            if error is not None:
+                print(f"Prefetching {key} failed: {error}")
+                self.failed += 1
+            else:
+                self._prefetched[key] = True
+                self._prefetched.move_to_end(key)
+                while len(self._prefetched) > PREFETCH_MEMORY:
+                    self._prefetched.popitem(last=False)
+            self._in_flight.pop(key, None)
+
+    def record_use(self, key, cached=False, timeout=None):
+        """
+        Record that a key is needed now, waiting for its prefetch if it is still running
+        so the value isn't requested twice
+
+        Args:
+            key: Key about to be read from the cache
+            cached (bool): The value was already cached without being prefetched (e.g. loaded earlier)
+            timeout (float): Maximum seconds to wait for a running prefetch
+
+        Returns:
+            str: hit, late (prefetch still running), cached or miss
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+
+        outcome = 'late' if future is not None else None
+        if future is not None:
+            try:
+                future.result(timeout)
+            except Exception:
+                pass
+
+        with self._lock:
+            if self._prefetched.pop(key, None):
+                outcome = outcome or 'hit'
+            else:
+                outcome = 'cached' if cached else 'miss'
+
+            if outcome == 'hit':
+                self.hits += 1
+            elif outcome == 'late':
+                self.late_hits += 1
+            elif outcome == 'cached':
+                self.already_cached += 1
+            else:
+                self.misses += 1
+        return outcome
+
+    def stats(self):
+        """
+        Returns:
+            dict: Prefetch counts and hit rate (share of the uses not already cached that a prefetch served)
+        """
+        with self._lock:
+            uses = self.hits + self.late_hits + self.misses
+            return {
+                'top_n': self.top_n,
+                'scheduled': self.scheduled,
+                'skipped_cached': self.skipped_cached,
+                'over_budget': self.over_budget,
+                'failed': self.failed,
+                'hits': self.hits,
+                'late_hits': self.late_hits,
+                'already_cached': self.already_cached,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.late_hits) / uses if uses else 0.0,
+                # Share of the prefetches that were used
+                'precision': (self.hits + self.late_hits) / self.scheduled if self.scheduled else 0.0,
+                'budget_remaining': max(0, self.budget - len(self._requests))
+            }
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_aspect_prefetcher():
+    global _prefetcher
+
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                _prefetcher = AspectPrefetcher()
+                get_metrics().register_collector('aspect_prefetch', _prefetcher.stats)
+    return _prefetcher
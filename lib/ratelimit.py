@@ -0,0 +1,271 @@
+import random
+import threading
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from zoneinfo import ZoneInfo
+
+# Call budgets per API family: calls per day, burst size and sustained calls per second
+DEFAULT_BUDGETS = {
+    'identity': {'daily': 50000, 'burst': 10, 'rate': 2},
+    'taxonomy': {'daily': 5000, 'burst': 20, 'rate': 5},
+    'inventory': {'daily': 2000000, 'burst': 50, 'rate': 25},
+    'media': {'daily': 100000, 'burst': 20, 'rate': 10}
+}
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+# Share of the burst and of the daily budget bulk jobs leave for interactive calls
+BULK_RESERVE = 0.2
+
+# eBay resets daily call limits at midnight Pacific time
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+
+# Responses worth retrying, and the retry policy. Throttled calls were not
+# processed, server errors may have been after a write: they are only retried
+# for idempotent methods, a retried POST could create a second offer or listing
+THROTTLED_STATUSES = {429}
+SERVER_ERROR_STATUSES = {500, 502, 503, 504}
+RETRY_STATUSES = THROTTLED_STATUSES | SERVER_ERROR_STATUSES
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30
+# Longest Retry-After waited for, a call asked to wait longer fails instead (e.g. daily limit reached)
+MAX_RETRY_AFTER = 120
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class FamilyBudget:
+    def __init__(self, daily, burst, rate):
+        """
+        Token bucket for bursts plus a daily call counter for one API family
+
+        Args:
+            daily (int): Calls per day
+            burst (int): Bucket capacity
+            rate (float): Tokens added per second
+        """
+        self.daily = daily
+        self.burst = burst
+        self.rate = rate
+
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.day = None
+        self.used_today = 0
+
+        self.granted = {INTERACTIVE: 0, BULK: 0}
+        self.throttled = 0
+        self.wait_time = 0.0
+        self.retries = 0
+        self.statuses = {}
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        today = datetime.now(QUOTA_TIMEZONE).date()
+        if today != self.day:
+            self.day = today
+            self.used_today = 0
+
+    def try_take(self, priority):
+        """
+        Returns:
+            float: 0 if a call was granted, otherwise seconds to wait before trying again
+        """
+        self._refill()
+
+        reserve = BULK_RESERVE if priority == BULK else 0
+        if self.used_today >= self.daily * (1 - reserve):
+            raise QuotaExceeded(f"Daily budget of {self.daily} calls used up for {priority} calls")
+
+        # Bulk calls leave part of the bucket to interactive ones
+        floor = self.burst * reserve
+        if self.tokens - 1 >= floor:
+            self.tokens -= 1
+            self.used_today += 1
+            self.granted[priority] = self.granted.get(priority, 0) + 1
+            return 0
+
+        return (floor + 1 - self.tokens) / self.rate
+
+    def metrics(self):
+        return {
+            'daily_budget': self.daily,
+            'used_today': self.used_today,
+            'remaining_today': max(0, self.daily - self.used_today),
+            'tokens': round(self.tokens, 2),
+            'burst': self.burst,
+            'granted': dict(self.granted),
+            'throttled': self.throttled,
+            'wait_seconds': round(self.wait_time, 3),
+            'retries': self.retries,
+            'statuses': dict(self.statuses)
+        }
+
+
+class RateLimiter:
+    def __init__(self, budgets=None):
+        """
+        Per API family call scheduler shared by the whole process
+
+        Args:
+            budgets (dict): Budgets per family, merged over DEFAULT_BUDGETS
+        """
+        self._lock = threading.Lock()
+        self._budgets = {}
+        self.configure({**DEFAULT_BUDGETS, **(budgets or {})})
+
+    def configure(self, budgets):
+        """
+        Set the budget of one or more API families
+
+        Args:
+            budgets (dict): {family: {'daily': ..., 'burst': ..., 'rate': ...}}
+        """
+        with self._lock:
+            for family, budget in budgets.items():
+                self._budgets[family] = FamilyBudget(**budget)
+
+    def _budget(self, family):
+        budget = self._budgets.get(family)
+        if budget is None:
+            raise ValueError(f"Unknown API family: {family}")
+        return budget
+
+    def try_acquire(self, family, priority=INTERACTIVE):
+        """
+        Take a call from the family budget without blocking
+
+        Args:
+            family (str): API family
+            priority (str): INTERACTIVE or BULK
+
+        Returns:
+            float: 0 if the call may go ahead, otherwise seconds to wait before trying again
+        """
+        with self._lock:
+            return self._budget(family).try_take(priority)
+
+    def acquire(self, family, priority=INTERACTIVE):
+        """
+        Block until the family budget allows a call
+        """
+        waited = False
+        while True:
+            delay = self.try_acquire(family, priority)
+            if not delay:
+                return
+            if not waited:
+                waited = True
+                with self._lock:
+                    self._budget(family).throttled += 1
+            with self._lock:
+                self._budget(family).wait_time += delay
+            time.sleep(delay)
+
+    def record(self, family, status, retried=False):
+        """
+        Count a response status, and whether the call will be retried
+        """
+        with self._lock:
+            budget = self._budget(family)
+            budget.statuses[status] = budget.statuses.get(status, 0) + 1
+            if retried:
+                budget.retries += 1
+
+    def record_wait(self, family, delay):
+        with self._lock:
+            self._budget(family).wait_time += delay
+
+    def metrics(self):
+        """
+        Returns:
+            dict: Budget usage, throttling and retries per API family
+        """
+        with self._lock:
+            for budget in self._budgets.values():
+                budget._refill()
+            return {family: budget.metrics() for family, budget in self._budgets.items()}
+
+
+def retry_statuses(method):
+    """
+    Returns:
+        set: Response statuses retried for calls of an HTTP method
+    """
+    return RETRY_STATUSES if method.upper() in IDEMPOTENT_METHODS else THROTTLED_STATUSES
+
+
+def retry_delay(attempt, headers=None):
+    """
+    Delay before retrying a call, honoring Retry-After in full, otherwise exponential backoff with full jitter
+
+    Args:
+        attempt (int): Number of attempts made so far (1 for the first retry)
+        headers (dict): Response headers
+
+    Returns:
+        float: Seconds to wait, more than MAX_RETRY_AFTER if the server asks for it
+    """
+    retry_after = (headers or {}).get('Retry-After')
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def send_with_retry(send, limiter, family, priority=INTERACTIVE, max_retries=MAX_RETRIES, retry_errors=(),
+                    statuses=RETRY_STATUSES):
+    """
+    Send a call within the family budget, retrying throttled and failed calls
+
+    Args:
+        send (callable): Sends the request and returns the response
+        limiter (RateLimiter): Scheduler holding the budgets
+        family (str): API family
+        priority (str): INTERACTIVE or BULK
+        max_retries (int): Maximum number of retries
+        retry_errors (tuple): Exception types (e.g. connection errors) that are retried too
+        statuses (set): Response statuses that are retried, see retry_statuses
+
+    Returns:
+        The last response
+    """
+    attempt = 0
+    while True:
+        limiter.acquire(family, priority)
+
+        try:
+            response = send()
+        except retry_errors:
+            if attempt >= max_retries:
+                raise
+            limiter.record(family, 'error', retried=True)
+            attempt += 1
+            delay = retry_delay(attempt)
+        else:
+            delay = retry_delay(attempt + 1, response.headers)
+            retry = response.status_code in statuses and attempt < max_retries and delay <= MAX_RETRY_AFTER
+            limiter.record(family, response.status_code, retried=retry)
+            if not retry:
+                return response
+            attempt += 1
+            # The body of a discarded response is never read, its pooled connection is released now
+            response.close()
+
+        limiter.record_wait(family, delay)
+        time.sleep(delay)
@@ -0,0 +1,443 @@
+import json
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import uuid
+from array import array
+
+# Where category schemas are stored
+SCHEMA_DIR = os.path.join('.cache', 'schemas')
+
+# Schema file layout:
+#   magic (4 bytes) | header length (uint32) | JSON header | aspect table | value offsets (uint32) | UTF-8 value blob
+# The values of aspect i are values first[i] .. first[i + 1] - 1, value j is blob[offsets[j]:offsets[j + 1]]
+SCHEMA_MAGIC = b'EBAS'
+SCHEMA_VERSION = 1
+SCHEMA_PREFIX = struct.Struct('<4sI')
+# flags, data type index, max length (0 if unlimited), first value index
+ASPECT = struct.Struct('<BBxxII')
+
+REQUIRED_FLAG = 1
+RECOMMENDED_FLAG = 2
+MULTI_FLAG = 4
+FREE_TEXT_FLAG = 8
+VARIATIONS_FLAG = 16
+
+NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize_name(text):
+    """
+    Returns:
+        str: Aspect name or value compared without case, punctuation and spacing differences
+    """
+    return ' '.join(NON_WORD.sub(' ', text.casefold()).split())
+
+
+def _to_little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(data):
+    values = array('I')
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class CategorySchema:
+    __slots__ = ('category_id', 'names', 'data_types', '_flags', '_types', '_max_lengths', '_first', '_offsets',
+                 '_blob', '_name_ids', '_values', '_positions', '_required_aspects', '_lock')
+
+    def __init__(self, category_id, names, data_types, flags, types, max_lengths, first, offsets, blob):
+        """
+        Compact schema of the aspects of a category: the required and recommended
+        aspects with their data type, mode, cardinality, maximum length and values
+
+        Aspect attributes live in byte strings and arrays, values in a single
+        UTF-8 blob. The values of an aspect, and its value to ID map, are only
+        decoded when first asked for. Build it with from_response or from_bytes.
+        """
+        self.category_id = category_id
+        self.names = names
+        self.data_types = data_types
+        self._flags = flags
+        self._types = types
+        self._max_lengths = max_lengths
+        self._first = first
+        self._offsets = offsets
+        self._blob = blob
+
+        self._name_ids = {name: aspect_id for aspect_id, name in enumerate(names)}
+        self._values = [None] * len(names)
+        self._positions = [None] * len(names)
+        self._required_aspects = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_response(cls, category_id, aspects_data):
+        """
+        Build the schema of a getItemAspectsForCategory response, keeping the required and recommended aspects
+
+        Args:
+            category_id (str): Category ID
+            aspects_data (dict): Response body
+
+        Returns:
+            CategorySchema: The schema
+        """
+        return cls.from_aspects(category_id, aspects_data.get('aspects', []))
+
+    @classmethod
+    def from_aspects(cls, category_id, aspects):
+        """
+        Build the schema of the aspects of a category, keeping the required and recommended ones
+
+        Args:
+            category_id (str): Category ID
+            aspects (iterable): Aspects of a getItemAspectsForCategory response, e.g. from lib.taxonomy.iter_aspects
+
+        Returns:
+            CategorySchema: The schema
+        """
+        names = []
+        data_types = []
+        flags = bytearray()
+        types = bytearray()
+        max_lengths = array('I')
+        first = array('I', [0])
+        offsets = array('I', [0])
+        blob = bytearray()
+
+        for aspect in aspects:
+            constraint = aspect.get('aspectConstraint', {})
+            aspect_flags = (REQUIRED_FLAG if constraint.get('aspectRequired') else 0) | \
+                (RECOMMENDED_FLAG if constraint.get('aspectUsage') == 'RECOMMENDED' else 0)
+            if not aspect_flags:
+                continue
+
+            aspect_flags |= (MULTI_FLAG if constraint.get('itemToAspectCardinality') == 'MULTI' else 0) | \
+                (FREE_TEXT_FLAG if constraint.get('aspectMode') == 'FREE_TEXT' else 0) | \
+                (VARIATIONS_FLAG if constraint.get('aspectEnabledForVariations') else 0)
+
+            data_type = constraint.get('aspectDataType', 'STRING')
+            if data_type not in data_types:
+                data_types.append(data_type)
+
+            names.append(aspect.get('localizedAspectName'))
+            flags.append(aspect_flags)
+            types.append(data_types.index(data_type))
+            max_lengths.append(constraint.get('aspectMaxLength') or 0)
+            for value in aspect.get('aspectValues', []):
+                blob += value.get('localizedValue', '').encode()
+                offsets.append(len(blob))
+            first.append(len(offsets) - 1)
+
+        return cls(category_id, tuple(names), tuple(data_types), bytes(flags), bytes(types), max_lengths, first,
+                   offsets, bytes(blob))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Load a schema serialized by to_bytes
+
+        Returns:
+            tuple: The schema and its header (category ID, ETag...)
+        """
+        magic, header_length = SCHEMA_PREFIX.unpack_from(data, 0)
+        if magic != SCHEMA_MAGIC:
+            raise ValueError("Not a category schema")
+
+        position = SCHEMA_PREFIX.size
+        header = json.loads(data[position:position + header_length])
+        if header['version'] != SCHEMA_VERSION:
+            raise ValueError(f"Unsupported category schema version {header['version']}")
+        position += header_length
+
+        aspect_count = len(header['names'])
+        flags = bytearray()
+        types = bytearray()
+        max_lengths = array('I')
+        first = array('I')
+        for aspect_flags, data_type, max_length, first_value in ASPECT.iter_unpack(
+                data[position:position + aspect_count * ASPECT.size]):
+            flags.append(aspect_flags)
+            types.append(data_type)
+            max_lengths.append(max_length)
+            first.append(first_value)
+        first.append(header['valueCount'])
+        position += aspect_count * ASPECT.size
+
+        offsets_size = (header['valueCount'] + 1) * 4
+        offsets = _from_little_endian(data[position:position + offsets_size])
+        blob = bytes(data[position + offsets_size:])
+
+        schema = cls(header['categoryId'], tuple(header['names']), tuple(header['dataTypes']), bytes(flags),
+                     bytes(types), max_lengths, first, offsets, blob)
+        return schema, header
+
+    def to_bytes(self, **header):
+        """
+        Serialize the schema
+
+        Args:
+            **header: Extra header fields (e.g. etag)
+
+        Returns:
+            bytes: The schema file content
+        """
+        header = json.dumps({
+            **header,
+            'version': SCHEMA_VERSION,
+            'categoryId': self.category_id,
+            'names': self.names,
+            'dataTypes': self.data_types,
+            'valueCount': len(self._offsets) - 1
+        }).encode()
+
+        table = b''.join(ASPECT.pack(self._flags[i], self._types[i], self._max_lengths[i], self._first[i])
+                         for i in range(len(self.names)))
+        return b''.join([SCHEMA_PREFIX.pack(SCHEMA_MAGIC, len(header)), header, table,
+                         _to_little_endian(self._offsets), self._blob])
+
+    def __len__(self):
+        return len(self.names)
+
+    def aspect_id(self, name):
+        """
+        Returns:
+            int: ID of the aspect, or None if the category has no such required or recommended aspect
+        """
+        return self._name_ids.get(name)
+
+    def is_required(self, aspect_id):
+        return bool(self._flags[aspect_id] & REQUIRED_FLAG)
+
+    def is_recommended(self, aspect_id):
+        return bool(self._flags[aspect_id] & RECOMMENDED_FLAG)
+
+    def is_multi(self, aspect_id):
+        return bool(self._flags[aspect_id] & MULTI_FLAG)
+
+    def is_free_text(self, aspect_id):
+        return bool(self._flags[aspect_id] & FREE_TEXT_FLAG)
+
+    def mode(self, aspect_id):
+        return 'FREE_TEXT' if self.is_free_text(aspect_id) else 'SELECTION_ONLY'
+
+    def data_type(self, aspect_id):
+        return self.data_types[self._types[aspect_id]]
+
+    def max_length(self, aspect_id):
+        """
+        Returns:
+            int: Maximum length of a value, or None if unlimited
+        """
+        return self._max_lengths[aspect_id] or None
+
+    @property
+    def required(self):
+        return [aspect_id for aspect_id in range(len(self.names)) if self._flags[aspect_id] & REQUIRED_FLAG]
+
+    @property
+    def recommended(self):
+        return [aspect_id for aspect_id in range(len(self.names)) if not self._flags[aspect_id] & REQUIRED_FLAG]
+
+    def value_count(self, aspect_id):
+        return self._first[aspect_id + 1] - self._first[aspect_id]
+
+    def values(self, aspect_id):
+        """
+        Returns:
+            tuple: Values of the aspect in eBay order, decoded on first use
+        """
+        values = self._values[aspect_id]
+        if values is None:
+            offsets = self._offsets
+            blob = self._blob
+            values = tuple(blob[offsets[j]:offsets[j + 1]].decode()
+                           for j in range(self._first[aspect_id], self._first[aspect_id + 1]))
+            self._values[aspect_id] = values
+        return values
+
+    def value_id(self, aspect_id, value):
+        """
+        Returns:
+            int: Position of the value in the values of the aspect, or None if it isn't one of them
+        """
+        positions = self._positions[aspect_id]
+        if positions is None:
+            with self._lock:
+                positions = self._positions[aspect_id]
+                if positions is None:
+                    positions = {}
+                    for position, known in enumerate(self.values(aspect_id)):
+                        positions.setdefault(known, position)
+                    self._positions[aspect_id] = positions
+        return positions.get(value)
+
+    def validate(self, aspects):
+        """
+        Check the aspects of a listing: required aspects set, values allowed by the
+        mode, single values where the cardinality is SINGLE, maximum lengths
+
+        Args:
+            aspects (dict): Aspect name -> list of values
+
+        Returns:
+            list: Problems found, empty if the aspects are valid
+        """
+        problems = []
+        for aspect_id in self.required:
+            if not [value for value in aspects.get(self.names[aspect_id]) or [] if value]:
+                problems.append(f"{self.names[aspect_id]} is required")
+
+        for name, values in aspects.items():
+            aspect_id = self._name_ids.get(name)
+            if aspect_id is None:
+                continue
+
+            values = [value for value in values or [] if value]
+            if len(values) > 1 and not self.is_multi(aspect_id):
+                problems.append(f"{name} accepts a single value")
+
+            max_length = self.max_length(aspect_id)
+            for value in values:
+                if max_length and len(value) > max_length:
+                    problems.append(f"{name} values are limited to {max_length} characters")
+                elif not self.is_free_text(aspect_id) and self.value_count(aspect_id) and \
+                        self.value_id(aspect_id, value) is None:
+                    problems.append(f"{value} is not a valid {name}")
+        return problems
+
+    def map_aspects(self, aspects, source):
+        """
+        Map the aspects of a listing chosen from another schema (e.g. the same category
+        on another marketplace) to this one
+
+        Aspects and values are only matched by their exact or normalized name (case,
+        punctuation and spacing ignored), never guessed: a localized aspect or value
+        ("Marke" for "Brand") is left for the seller to choose.
+
+        Args:
+            aspects (dict): Aspect name -> list of values
+            source (CategorySchema): Schema the aspects were chosen from
+
+        Returns:
+            dict: Aspect name -> list of values. Values that couldn't be mapped are left out,
+            aspects this schema doesn't know are left out too unless the source doesn't know them either
+        """
+        mapped = {}
+        for name, values in aspects.items():
+            aspect_id = self._match_aspect(name)
+            if aspect_id is None:
+                # Custom aspects of the seller travel as they are, localized ones of the source don't
+                if source.aspect_id(name) is None:
+                    mapped.setdefault(name, list(values or []))
+                continue
+
+            mapped_values = [self._map_value(aspect_id, value) for value in values or [] if value]
+            mapped[self.names[aspect_id]] = [value for value in mapped_values if value is not None]
+        return mapped
+
+    def _match_aspect(self, name):
+        aspect_id = self.aspect_id(name)
+        if aspect_id is None:
+            normalized = normalize_name(name)
+            aspect_id = next((i for i, known in enumerate(self.names) if normalize_name(known) == normalized), None)
+        return aspect_id
+
+    def _map_value(self, aspect_id, value):
+        if not self.value_count(aspect_id) or self.value_id(aspect_id, value) is not None:
+            return value
+
+        normalized = normalize_name(value)
+        for known in self.values(aspect_id):
+            if normalize_name(known) == normalized:
+                return known
+
+        return value if self.is_free_text(aspect_id) else None
+
+    def required_aspects(self):
+        """
+        Returns:
+            list: Required aspects as dicts (name, data_type, mode, values), built once
+        """
+        if self._required_aspects is None:
+            self._required_aspects = [{
+                'name': self.names[aspect_id],
+                'data_type': self.data_type(aspect_id),
+                'mode': self.mode(aspect_id),
+                'values': list(self.values(aspect_id))
+            } for aspect_id in self.required]
+        return self._required_aspects
+
+
+class SchemaStore:
+    def __init__(self, root=SCHEMA_DIR):
+        """
+        Category schemas on disk, shared by the processes of the app and the service
+
+        The file modification time is when the schema was last fetched or revalidated.
+
+        Args:
+            root (str): Store directory
+        """
+        self.root = root
+
+    def path(self, env, marketplace_id, category_id):
+        return os.path.join(self.root, f"{env}_{marketplace_id}_{category_id}.ebas")
+
+    def load(self, env, marketplace_id, category_id):
+        """
+        Returns:
+            tuple: (schema, ETag, age in seconds), or None if it isn't stored
+        """
+        path = self.path(env, marketplace_id, category_id)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            age = time.time() - os.path.getmtime(path)
+            schema, header = CategorySchema.from_bytes(data)
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, struct.error) as e:
+            print(f"Ignoring unreadable category schema {path}: {e}")
+            return None
+        return schema, header.get('etag'), age
+
+    def save(self, env, marketplace_id, category_id, schema, etag=None):
+        path = self.path(env, marketplace_id, category_id)
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(schema.to_bytes(etag=etag))
+        os.replace(tmp_path, path)
+
+    def touch(self, env, marketplace_id, category_id):
+        # The server confirmed the stored schema is unchanged
+        try:
+            os.utime(self.path(env, marketplace_id, category_id))
+        except FileNotFoundError:
+            pass
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_schema_store():
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SchemaStore()
+    return _store
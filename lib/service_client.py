@@ -0,0 +1,179 @@
+import json
+import os
+from urllib.parse import quote
+
+from lib.cache import TTLCache
+from lib.schema import CategorySchema
+from lib.transport import get_transport
+
+# Set to the URL of the listing service (src/api_server.py) to use it instead of calling eBay and Gemini directly
+SERVICE_URL_VARIABLE = 'LISTING_SERVICE_URL'
+# Shared secret sent to the service, the LISTING_SERVICE_KEY it was started with
+SERVICE_KEY_VARIABLE = 'LISTING_SERVICE_KEY'
+
+
+class ServiceError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ListingServiceClient:
+    def __init__(self, base_url, api_key):
+        """
+        Client of the headless listing service
+
+        Args:
+            base_url (str): Service URL, e.g. http://127.0.0.1:8000
+            api_key (str): Shared secret of the service
+        """
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        # Aspects change rarely, keep them here too instead of asking the service on every rerun
+        self.aspects_cache = TTLCache(maxsize=256, ttl=6 * 3600)
+
+    def _request(self, method, path, headers=None, **kwargs):
+        headers = {**(headers or {}), 'X-Api-Key': self.api_key}
+        response = get_transport().request(method, f"{self.base_url}{path}", headers=headers, **kwargs)
+        if response.status_code == 400:
+            raise ValueError(response.json().get('detail'))
+        if response.status_code >= 300:
+            raise ServiceError(f"{method} {path} failed: {response.status_code}: {response.text}", response.status_code)
+        return response
+
+    def get_category_suggestions(self, query, marketplace_id="EBAY_US"):
+        """
+        Returns:
+            dict: getCategorySuggestions response
+        """
+        return self._request('GET', '/suggestions', params={'q': query, 'marketplace_id': marketplace_id}).json()
+
+    def is_category_aspects_cached(self, category_id, marketplace_id="EBAY_US", env='production'):
+        return (env, marketplace_id, category_id) in self.aspects_cache
+
+    def get_category_schema(self, category_id, marketplace_id="EBAY_US", env='production'):
+        """
+        Returns:
+            CategorySchema: Schema of the required and recommended aspects
+        """
+        cache_key = (env, marketplace_id, category_id)
+        schema = self.aspects_cache.get(cache_key)
+        if schema is None:
+            # The binary schema is a fraction of the JSON aspects and loads without parsing every value
+            response = self._request('GET', f'/aspects/{category_id}/schema',
+                                     params={'marketplace_id': marketplace_id, 'env': env})
+            schema, _ = CategorySchema.from_bytes(response.content)
+            self.aspects_cache.set(cache_key, schema)
+        return schema
+
+    def get_category_aspects(self, category_id, marketplace_id="EBAY_US", env='production'):
+        """
+        Returns:
+            list: Required aspects (name, data_type, mode, values)
+        """
+        return self.get_category_schema(category_id, marketplace_id, env).required_aspects()
+
+    def compose_listing(self, title, manufacturer, summary):
+        """
+        Returns:
+            dict: Listing with the keys "title" and "description"
+        """
+        return self._request('POST', '/compose', json={
+            'title': title, 'manufacturer': manufacturer, 'summary': summary}).json()
+
+    def compose_listing_stream(self, title, manufacturer, summary):
+        """
+        Yields:
+            dict: Listing received so far, the last one is complete
+        """
+        response = self._request('POST', '/compose/stream', stream=True, json={
+            'title': title, 'manufacturer': manufacturer, 'summary': summary})
+        with response:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def submit_listings(self, records, refresh_token, env='sandbox', publish=True):
+        """
+        Queue the creation of listings
+
+        Returns:
+            str: Job ID
+        """
+        return self._request('POST', '/listings', headers={'X-Ebay-Refresh-Token': refresh_token}, json={
+            'records': records, 'env': env, 'publish': publish}).json()['job_id']
+
+    def upload_media(self, store, digest):
+        """
+        Send an image or video of the media store to the service, unless it already has it
+
+        Args:
+            store (MediaStore): Local media store
+            digest (str): Digest of the media
+        """
+        if self._request('GET', f'/media/{digest}').json()['exists']:
+            return
+        with open(store.path(digest), 'rb') as f:
+            self._request('PUT', f'/media/{digest}', data=f,
+                          headers={'X-Filename': quote(store.metadata(digest).get('filename') or digest)})
+
+    def submit_listing(self, record, refresh_token, env='sandbox', publish=True, marketplaces=None, prices=None,
+                       marketplace_listings=None, images=None, video=None):
+        """
+        Queue the publishing of one listing, its media must be uploaded first (see upload_media)
+
+        Args:
+            record (dict): Listing record
+            refresh_token (str): Seller's refresh token
+            env (str): sandbox or production
+            publish (bool): Publish the offers
+            marketplaces (list): Other marketplaces to publish on
+            prices (dict): Price per other marketplace
+            marketplace_listings (dict): Category and aspects per other marketplace
+            images (list): Image digests
+            video (str): Video digest
+
+        Returns:
+            str: Job ID
+        """
+        return self._request('POST', '/listing', headers={'X-Ebay-Refresh-Token': refresh_token}, json={
+            'record': record, 'env': env, 'publish': publish, 'marketplaces': marketplaces or [],
+            'prices': prices or {}, 'marketplace_listings': marketplace_listings or {}, 'images': images or [],
+            'video': video}).json()['job_id']
+
+    def requeue_job(self, job_id, refresh_token):
+        # Dead-lettered jobs no longer hold the seller's refresh token
+        self._request('POST', f'/jobs/{job_id}/requeue', headers={'X-Ebay-Refresh-Token': refresh_token})
+
+    def get_job(self, job_id):
+        """
+        Returns:
+            dict: Job status, result and error, None if the job doesn't exist
+        """
+        try:
+            return self._request('GET', f'/jobs/{job_id}').json()
+        except ServiceError as e:
+            if e.status_code == 404:
+                return None
+            raise
+
+
+_client = None
+
+
+def get_service_client():
+    """
+    Returns:
+        ListingServiceClient: Client of the service at LISTING_SERVICE_URL, or None if it isn't set
+    """
+    global _client
+
+    base_url = os.environ.get(SERVICE_URL_VARIABLE)
+    if not base_url:
+        return None
+    api_key = os.environ.get(SERVICE_KEY_VARIABLE)
+    if not api_key:
+        raise RuntimeError(f"{SERVICE_URL_VARIABLE} is set without {SERVICE_KEY_VARIABLE}")
+    if _client is None or _client.base_url != base_url.rstrip('/') or _client.api_key != api_key:
+        _client = ListingServiceClient(base_url, api_key)
+    return _client
@@ -1,31 +1,452 @@
 import streamlit as st
-import pickle
+import streamlit.components.v1 as components
+import hashlib
+import hmac
 import os
+import pickle
+import re
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+
+from lib.metrics import get_metrics
+
+# Where session state is persisted
+SESSION_DIR = os.path.join('.cache', 'sessions')
+# Pickled values larger than this are kept out of the database, in content-addressed blob files
+BLOB_THRESHOLD = 64 * 1024
+# Sessions not saved for this many seconds are deleted, with the blobs only they referred to
+SESSION_TTL = 30 * 24 * 3600
+# Seconds between two clean-ups of expired sessions and unreferenced blobs
+CLEANUP_INTERVAL = 3600
+
+# Cookie holding the session ID. The ID gives access to the saved eBay tokens, so it is
+# never put in the URL, where it would end up in the history, logs and Referer headers
+SESSION_COOKIE = 'ebay_listing_sid'
+SESSION_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{32,64}')
+
+_MISSING = object()
+
+
+def is_persistent_key(key):
+    # Form submit buttons, the selected category and private keys (e.g. "_session_id") are not saved
+    return not key.startswith('FormSubmitter') and key != 'selected_category' and not key.startswith('_')
+
+
+class SessionStore:
+    def __init__(self, root=SESSION_DIR):
+        """
+        Per-session state store writing only the keys that were assigned or marked dirty
+        since the last save, and reading only the keys asked for
+
+        Values live in a SQLite database in WAL mode (one row per session and key),
+        large values are written once to blob files named after their SHA-256.
+
+        Args:
+            root (str): Directory of the database and the blobs
+        """
+        self.root = root
+        self.blob_dir = os.path.join(root, 'blobs')
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+        self._db_path = os.path.join(root, 'sessions.db')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Digest of each key as last written, per session
+        self._digests = {}
+        # Values as last written or loaded, per session: saving the same object again needs no pickling
+        self._values = {}
+        self._cleaned_at = time.time()
+
+        connection = self._connection()
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS state (
+                session_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                value BLOB,
+                PRIMARY KEY (session_id, key)
+            )''')
+        columns = {row[1] for row in connection.execute('PRAGMA table_info(state)')}
+        if 'saved_at' not in columns:
+            connection.execute('ALTER TABLE state ADD COLUMN saved_at REAL NOT NULL DEFAULT 0')
+
+    def _connection(self):
+        # SQLite connections can't be shared between threads, Streamlit runs each session in its own
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self._db_path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _write_blob(self, digest, data):
+        path = self._blob_path(digest)
+        if os.path.exists(path):
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _known_digests(self, session_id):
+        with self._lock:
+            digests = self._digests.get(session_id)
+        if digests is None:
+            rows = self._connection().execute(
+                'SELECT key, digest FROM state WHERE session_id = ?', (session_id,)).fetchall()
+            digests = dict(rows)
+            with self._lock:
+                self._digests[session_id] = digests
+        return digests
+
+    def keys(self, session_id):
+        """
+        Returns:
+            list: Keys saved for the session, without reading their values
+        """
+        return list(self._known_digests(session_id))
+
+    def save(self, session_id, state, dirty=(), keep=()):
+        """
+        Save the keys whose value changed and delete the keys that were removed
+
+        A key holding the same object as when it was last saved or loaded is taken as
+        unchanged, values changed in place must be listed in dirty.
+
+        Args:
+            session_id (str): Session ID
+            state (dict): Session state
+            dirty (set): Keys whose value was changed in place
+            keep (set): Saved keys missing from state because they weren't loaded yet
+
+        Returns:
+            int: Number of keys written or deleted
+        """
+        with get_metrics().span('session_save') as span:
+            written = self._save(session_id, state, dirty, keep)
+            span.set(changed='yes' if written else 'no')
+
+        if time.time() - self._cleaned_at > CLEANUP_INTERVAL:
+            self._cleaned_at = time.time()
+            threading.Thread(target=self.cleanup, daemon=True).start()
+        return written
+
+    def _save(self, session_id, state, dirty, keep):
+        known = self._known_digests(session_id)
+        with self._lock:
+            saved_values = self._values.setdefault(session_id, {})
+        changed = []
+        pickled = []
+        current = set()
+
+        for key, value in state.items():
+            if not is_persistent_key(key):
+                continue
+
+            # Images, eBay clients and other values are only pickled and hashed when they are replaced
+            if key in known and key not in dirty and saved_values.get(key, _MISSING) is value:
+                current.add(key)
+                continue
+
+            try:
+                data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                print(f"Session state key {key} can't be saved: {e}")
+                continue
+
+            current.add(key)
+            pickled.append(key)
+            digest = hashlib.sha256(data).hexdigest()
+            if known.get(key) != digest:
+                changed.append((key, digest, data))
+
+        removed = [key for key in known if key not in current and key not in keep]
+        if not changed and not removed:
+            with self._lock:
+                saved_values.update((key, state[key]) for key in pickled)
+            return 0
+
+        rows = []
+        now = time.time()
+        for key, digest, data in changed:
+            if len(data) > BLOB_THRESHOLD:
+                self._write_blob(digest, data)
+                data = None
+            rows.append((session_id, key, digest, data, now))
+
+        get_metrics().inc('session_bytes_written_total', sum(len(data) for _, _, data in changed))
+
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(
+                'INSERT OR REPLACE INTO state (session_id, key, digest, value, saved_at) VALUES (?, ?, ?, ?, ?)', rows)
+            # The other keys of the session are still current, the session is kept as long as it is used
+            connection.execute('UPDATE state SET saved_at = ? WHERE session_id = ?', (now, session_id))
+            connection.executemany(
+                'DELETE FROM state WHERE session_id = ? AND key = ?', [(session_id, key) for key in removed])
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+        with self._lock:
+            for key, digest, _ in changed:
+                known[key] = digest
+            for key in removed:
+                known.pop(key, None)
+                saved_values.pop(key, None)
+            saved_values.update((key, state[key]) for key in pickled)
+
+        return len(changed) + len(removed)
+
+    def load(self, session_id, keys=None):
+        """
+        Load the saved state of a session
+
+        Args:
+            session_id (str): Session ID
+            keys (list): Only read and unpickle these keys, None for all keys
+
+        Returns:
+            dict: Saved values
+        """
+        with get_metrics().span('session_load'):
+            return self._load(session_id, keys)
+
+    def _load(self, session_id, keys):
+        metrics = get_metrics()
+        known = self._known_digests(session_id)
+        keys = list(known if keys is None else keys)
+        rows = []
+        # SQLite limits the number of query parameters
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            query = f"SELECT key, digest, value FROM state WHERE session_id = ? AND key IN ({','.join('?' * len(batch))})"
+            rows += self._connection().execute(query, (session_id, *batch)).fetchall()
+
+        state = {}
+        digests = {}
+        for key, digest, data in rows:
+            digests[key] = digest
+            if data is None:
+                try:
+                    with open(self._blob_path(digest), 'rb') as f:
+                        data = f.read()
+                except FileNotFoundError:
+                    print(f"Session state blob of {key} is missing")
+                    continue
+
+            metrics.inc('session_bytes_read_total', len(data))
+            try:
+                state[key] = pickle.loads(data)
+            except Exception as e:
+                print(f"Session state key {key} can't be loaded: {e}")
+
+        with self._lock:
+            known.update(digests)
+            self._values.setdefault(session_id, {}).update(state)
+        return state
+
+    def delete(self, session_id):
+        self._connection().execute('DELETE FROM state WHERE session_id = ?', (session_id,))
+        with self._lock:
+            self._digests.pop(session_id, None)
+            self._values.pop(session_id, None)
+
+    def cleanup(self, ttl=SESSION_TTL):
+        """
+        Delete the sessions not saved for ttl seconds, then the blobs no session refers to anymore
+
+        Returns:
+            tuple: Numbers of deleted sessions and blobs
+        """
+        connection = self._connection()
+        expired = [session_id for (session_id,) in connection.execute(
+            'SELECT session_id FROM state GROUP BY session_id HAVING MAX(saved_at) < ?', (time.time() - ttl,))]
+        for session_id in expired:
+            self.delete(session_id)
+        return len(expired), self.collect_blobs()
+
+    def collect_blobs(self):
+        """
+        Delete blob files no session refers to anymore
+
+        Returns:
+            int: Number of deleted blobs
+        """
+        # Blobs written after the query started may not be referenced yet
+        started = time.time() - 60
+        referenced = {digest for (digest,) in self._connection().execute(
+            'SELECT digest FROM state WHERE value IS NULL')}
+
+        deleted = 0
+        for directory, _, files in os.walk(self.blob_dir):
+            for name in files:
+                path = os.path.join(directory, name)
+                if name not in referenced and not name.endswith('.tmp') and os.path.getmtime(path) < started:
+                    os.remove(path)
+                    deleted += 1
+        return deleted
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore()
+    return _store
+
+
+def new_session_id():
+    return secrets.token_urlsafe(32)
+
+
+def get_session_id():
+    """
+    Get the ID under which the state of this browser session is saved.
+
+    The ID is kept in a cookie (see write_session_cookie), so it survives page
+    reloads and the OAuth consent redirect without ever appearing in the URL.
+    IDs are only created by the server, never taken from the URL.
+
+    Returns:
+        str: Session ID
+    """
+    if '_session_id' not in st.session_state:
+        session_id = st.context.cookies.get(SESSION_COOKIE)
+        if not session_id or not SESSION_ID_PATTERN.fullmatch(session_id):
+            session_id = new_session_id()
+        st.session_state._session_id = session_id
+
+    # Links of earlier versions carried the ID in the URL
+    if 'sid' in st.query_params:
+        del st.query_params['sid']
+
+    return st.session_state._session_id
+
+
+def rotate_session_id():
+    """
+    Move the state of this browser session to a new ID, e.g. once the user
+    logged in, so an ID known before can't be used to reach the new tokens
+    """
+    old_session_id = get_session_id()
+    # The keys not loaded yet would be lost with the old ID
+    load_session_state()
+    st.session_state._session_id = new_session_id()
+    get_store().delete(old_session_id)
+
+
+def write_session_cookie():
+    """
+    Store the session ID in a cookie of the browser, when it doesn't hold it yet.
+    Call it after st.set_page_config.
+    """
+    session_id = get_session_id()
+    if st.context.cookies.get(SESSION_COOKIE) == session_id or st.session_state.get('_session_cookie') == session_id:
+        return
+
+    # Streamlit can't set cookies, the component runs in an iframe of the app origin
+    components.html(f"""<script>
+        const secure = window.parent.location.protocol === 'https:' ? '; Secure' : '';
+        window.parent.document.cookie = '{SESSION_COOKIE}={session_id}; Path=/; Max-Age={SESSION_TTL}; SameSite=Lax' + secure;
+        </script>""", height=0)
+    st.session_state._session_cookie = session_id
+
+
+def new_oauth_state():
+    """
+    Create the OAuth "state" of an authorization request, saved with the session
+    and checked when eBay redirects back (see verify_oauth_state)
+
+    Returns:
+        str: Random state
+    """
+    st.session_state.oauth_state = secrets.token_urlsafe(32)
+    return st.session_state.oauth_state
+
+
+def verify_oauth_state(state):
+    """
+    Check that an authorization code answers the request this session started,
+    so a code of someone else's eBay account can't be slipped into it (login CSRF).
+    A state is only accepted once.
+
+    Args:
+        state (str): "state" query parameter of the redirect
+
+    Returns:
+        bool: Whether the state is the one of this session
+    """
+    expected = st.session_state.pop('oauth_state', None)
+    return bool(expected and state) and hmac.compare_digest(expected, state)
+
+
+def mark_dirty(*keys):
+    """
+    Save these keys on the next save, for values changed in place
+    (a key assigned a new object is always saved)
+    """
+    st.session_state.setdefault('_session_dirty', set()).update(keys)
+
 
 def save_session_state():
-    with open('session_state.pkl', 'wb') as f:
-        # Dump session state to a file excluding all form submit buttons (e.g. suggest_category_btn)
-        state_to_save = {k: v for k, v in st.session_state.items() if not k.startswith('FormSubmitter') and k != 'selected_category'}
-        pickle.dump(state_to_save, f)
-        
-    print('Session state saved')
+    dirty = st.session_state.get('_session_dirty', set())
+    written = get_store().save(get_session_id(), dict(st.session_state.items()), dirty=dirty,
+                               keep=st.session_state.get('_session_pending', set()))
+    dirty.clear()
+
+    print(f'Session state saved ({written} keys changed)')
+
+
+def load_session_state(keys=None):
+    """
+    Load the saved keys of this browser session a page uses, the first time it needs them.
+
+    Keys no page asked for yet stay unread in the store, and are kept there when saving.
+    State persists in memory for the rest of the browser session, each key is only loaded once.
+
+    Args:
+        keys (list): Keys to load, None for all the saved keys not loaded yet
+    """
+    if '_session_pending' not in st.session_state:
+        st.session_state._session_pending = set(get_store().keys(get_session_id()))
 
+    pending = st.session_state._session_pending
+    wanted = pending if keys is None else pending.intersection(keys)
+    if not wanted:
+        return
 
-def load_session_state():
-    if os.path.exists('session_state.pkl'):
-        with open('session_state.pkl', 'rb') as f:
-            saved_state = pickle.load(f)
-            for key, value in saved_state.items():
-                st.session_state[key] = value
+    saved_state = get_store().load(get_session_id(), wanted)
+    for key, value in saved_state.items():
+        # A value set in this run, before the page needed the key, is newer
+        if key not in st.session_state:
+            st.session_state[key] = value
+    pending -= set(wanted)
 
 def logout():
     # st.session_state.clear()
     st.session_state.pop('callback_auth_code', None)
-    st.session_state.pop('auth_state', None) 
+    st.session_state.pop('auth_state', None)
     st.session_state.pop('ebay_client', None)
     st.session_state.pop('ebay_production', None)
     st.session_state.pop('ebay_sandbox', None)
 
     save_session_state()
-    # os.remove('session_state.pkl')
-    st.rerun()
\ No newline at end of file
+    st.rerun()
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Where the sync state of each environment is kept
+SYNC_DIR = os.path.join('.cache', 'sync')
+
+# Product fields of an inventory item compared by the sync, as built by lib.listing.build_inventory_item
+ITEM_PRODUCT_FIELDS = ('title', 'aspects', 'description', 'imageUrls', 'videoIds')
+# Offer fields that change with every price or quantity update, left out of the offer digest
+PRICE_QUANTITY_FIELDS = ('pricingSummary', 'availableQuantity')
+# Fields eBay adds to the offers it returns
+OFFER_STATE_FIELDS = ('offerId', 'status', 'listing')
+
+# What a record needs pushed, from the most to the least expensive
+NEW = 'new'
+ITEM = 'item'
+OFFER = 'offer'
+PRICE_QUANTITY = 'price_quantity'
+
+STATE_COLUMNS = ('sku', 'marketplace_id', 'item_digest', 'offer_digest', 'price', 'quantity', 'offer_id',
+                 'listing_id', 'synced_at')
+
+
+def payload_digest(payload):
+    """
+    Returns:
+        str: SHA-256 of the canonical JSON of the payload (sorted keys, no whitespace)
+    """
+    data = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def item_digest(item):
+    """
+    Digest of an inventory item without its quantity, the same for the payload we
+    send and the item getInventoryItems returns for it
+
+    Args:
+        item (dict): Inventory item (see Sample_listing/sample_inventory_item.json)
+
+    Returns:
+        str: Digest
+    """
+    product = item.get('product', {})
+    return payload_digest({
+        'product': {field: product[field] for field in ITEM_PRODUCT_FIELDS if product.get(field)},
+        'condition': item.get('condition')
+    })
+
+
+def item_quantity(item):
+    return item.get('availability', {}).get('shipToLocationAvailability', {}).get('quantity', 0)
+
+
+def offer_digest(offer):
+    """
+    Digest of an offer without its price and quantity
+
+    Args:
+        offer (dict): Offer (see Sample_listing/sample_createOffer.json)
+
+    Returns:
+        str: Digest
+    """
+    return payload_digest({key: value for key, value in offer.items()
+                           if key not in PRICE_QUANTITY_FIELDS and key not in OFFER_STATE_FIELDS})
+
+
+def record_state(record, item, offer):
+    """
+    Returns:
+        dict: The state row of a record once its item and offer are pushed (offer and listing IDs aside)
+    """
+    return {
+        'sku': record['sku'],
+        'marketplace_id': record['marketplace_id'],
+        'item_digest': item_digest(item),
+        'offer_digest': offer_digest(offer),
+        'price': record['price'],
+        'quantity': record['quantity']
+    }
+
+
+def classify(state, pushed):
+    """
+    Compare the state of a record with the state last pushed to eBay
+
+    Args:
+        state (dict): State of the catalog record, see record_state
+        pushed (dict): State saved by the last sync, None if the SKU was never synced
+
+    Returns:
+        str: NEW, ITEM, OFFER or PRICE_QUANTITY, the most expensive change needed, or None if it is unchanged
+    """
+    if pushed is None:
+        return NEW
+    if pushed['item_digest'] != state['item_digest']:
+        return ITEM
+    # A marketplace change needs an offer on the new marketplace
+    if pushed['offer_digest'] != state['offer_digest'] or pushed['marketplace_id'] != state['marketplace_id'] or \
+            not pushed['offer_id']:
+        return OFFER
+    if pushed['price'] != state['price'] or pushed['quantity'] != state['quantity']:
+        return PRICE_QUANTITY
+    return None
+
+
+class SyncIndex:
+    def __init__(self, path):
+        """
+        What was last pushed to eBay per SKU: payload digests, price, quantity, offer and listing IDs
+
+        A SQLite database in WAL mode, one row per SKU.
+
+        Args:
+            path (str): Database file
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._local = threading.local()
+
+        self._connection().execute('''
+            CREATE TABLE IF NOT EXISTS state (
+                sku TEXT PRIMARY KEY,
+                marketplace_id TEXT,
+                item_digest TEXT,
+                offer_digest TEXT,
+                price REAL,
+                quantity INTEGER,
+                offer_id TEXT,
+                listing_id TEXT,
+                synced_at REAL NOT NULL
+            )''')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get_many(self, skus):
+        """
+        Args:
+            skus (list): SKUs, at most a few hundred
+
+        Returns:
+            dict: SKU -> state row, for the SKUs in the index
+        """
+        if not skus:
+            return {}
+        rows = self._connection().execute(
+            f"SELECT * FROM state WHERE sku IN ({', '.join('?' * len(skus))})", list(skus)).fetchall()
+        return {row['sku']: dict(row) for row in rows}
+
+    def put_many(self, states):
+        """
+        Save state rows. Fields missing from a row keep their saved value.
+
+        Args:
+            states (list): State rows, each with its sku
+        """
+        if not states:
+            return
+
+        connection = self._connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for state in states:
+                fields = [column for column in STATE_COLUMNS if column in state and column != 'sku']
+                values = [state[column] for column in fields]
+                connection.execute(
+                    f"INSERT INTO state (sku, {', '.join(fields)}, synced_at) "
+                    f"VALUES (?, {', '.join('?' * len(fields))}, ?) "
+                    f"ON CONFLICT (sku) DO UPDATE SET "
+                    f"{', '.join(f'{column} = excluded.{column}' for column in fields)}, synced_at = excluded.synced_at",
+                    [state['sku'], *values, now])
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def delete_many(self, skus):
+        self._connection().executemany('DELETE FROM state WHERE sku = ?', [(sku,) for sku in skus])
+
+    def skus(self):
+        """
+        Yields:
+            str: SKUs in the index
+        """
+        for (sku,) in self._connection().execute('SELECT sku FROM state'):
+            yield sku
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM state').fetchone()[0]
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
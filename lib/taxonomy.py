@@ -0,0 +1,477 @@
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+from collections import defaultdict
+
+from lib.json_stream import iter_json
+
+# Where category tree snapshots are stored
+SNAPSHOT_DIR = os.path.join('.cache', 'taxonomy')
+
+# Snapshot file layout:
+#   magic (4 bytes) | header length (uint32) | JSON header | node table | UTF-8 name blob
+# Nodes are stored in depth-first pre-order, so the subtree of node i is i + 1 .. subtree_end - 1
+SNAPSHOT_MAGIC = b'EBTX'
+SNAPSHOT_PREFIX = struct.Struct('<4sI')
+# category_id, parent index (-1 for the root), level, flags, name offset, name length, subtree end
+NODE = struct.Struct('<IiHBxIII')
+LEAF_FLAG = 1
+
+# Score weights of a query token found in the category name vs in one of its ancestors
+NAME_WEIGHT = 2.0
+PATH_WEIGHT = 1.0
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+# Opened snapshots, keyed by path
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def tokenize(text):
+    """
+    Split text into normalized search tokens (case folded, naive plural stripping)
+
+    Args:
+        text (str): Text to tokenize
+
+    Returns:
+        list: Tokens
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.casefold()):
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def snapshot_path(env, marketplace_id, snapshot_dir=SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, f"{env}_{marketplace_id}.ebtx")
+
+
+def _append_subtree(nodes, names, tree_node, parent):
+    # Iterative depth-first walk, the subtree end of a node is known once its children are written
+    stack = [(tree_node, parent, False)]
+    while stack:
+        tree_node, parent, visited = stack.pop()
+
+        if visited:
+            nodes[tree_node][6] = len(nodes)
+            continue
+
+        index = len(nodes)
+        nodes.append(_node(tree_node, parent, names))
+
+        stack.append((index, None, True))
+        for child in reversed(tree_node.get('childCategoryTreeNodes', [])):
+            stack.append((child, index, False))
+
+
+def _node(tree_node, parent, names):
+    category = tree_node['category']
+    name = category['categoryName'].encode()
+    flags = LEAF_FLAG if tree_node.get('leafCategoryTreeNode') else 0
+    node = [int(category['categoryId']), parent, tree_node.get('categoryTreeNodeLevel', 0),
+            flags, len(names), len(name), 0]
+    names += name
+    return node
+
+
+def _write_snapshot_file(path, header, nodes, names):
+    header = json.dumps(header).encode()
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, len(header)))
+        f.write(header)
+        for node in nodes:
+            f.write(NODE.pack(*node))
+        f.write(names)
+    os.replace(tmp_path, path)
+
+
+def write_snapshot(category_tree, path, marketplace_id=None):
+    """
+    Write a compact snapshot of a full category tree
+
+    Args:
+        category_tree (dict): Response of the getCategoryTree call
+        path (str): Destination file, replaced atomically
+        marketplace_id (str): Marketplace the tree belongs to
+
+    Returns:
+        int: Number of categories written
+    """
+    nodes = []
+    names = bytearray()
+    _append_subtree(nodes, names, category_tree['rootCategoryNode'], -1)
+
+    _write_snapshot_file(path, {
+        'categoryTreeId': category_tree.get('categoryTreeId'),
+        'categoryTreeVersion': category_tree.get('categoryTreeVersion'),
+        'marketplaceId': marketplace_id,
+        'nodeCount': len(nodes)
+    }, nodes, names)
+
+    return len(nodes)
+
+
+def write_snapshot_stream(chunks, path, marketplace_id=None):
+    """
+    Write a compact snapshot of a full category tree while it is downloaded, holding
+    one top level category subtree at a time instead of the whole response
+
+    Args:
+        chunks (iterable): Chunks of the getCategoryTree response body
+        path (str): Destination file, replaced atomically
+        marketplace_id (str): Marketplace the tree belongs to
+
+    Returns:
+        int: Number of categories written
+    """
+    # The root comes first in the file, it is filled in once its fields were read
+    root = {'category': {'categoryId': '0', 'categoryName': ''}}
+    nodes = [None]
+    names = bytearray()
+    header = {'categoryTreeId': None, 'categoryTreeVersion': None}
+
+    for path_keys, value in iter_json(chunks, ('rootCategoryNode', 'childCategoryTreeNodes')):
+        if path_keys == ('rootCategoryNode', 'childCategoryTreeNodes'):
+            _append_subtree(nodes, names, value, 0)
+        elif path_keys[0] == 'rootCategoryNode':
+            root[path_keys[1]] = value
+        elif path_keys[0] in header:
+            header[path_keys[0]] = value
+
+    nodes[0] = _node(root, -1, names)
+    nodes[0][6] = len(nodes)
+
+    _write_snapshot_file(path, {**header, 'marketplaceId': marketplace_id, 'nodeCount': len(nodes)}, nodes, names)
+
+    return len(nodes)
+
+
+def iter_aspects(chunks):
+    """
+    Parse a getItemAspectsForCategory response while it is downloaded
+
+    Args:
+        chunks (iterable): Chunks of the response body
+
+    Yields:
+        dict: The required and recommended aspects, the others are dropped as soon as they are parsed
+    """
+    for _, aspect in iter_json(chunks, ('aspects',)):
+        constraint = aspect.get('aspectConstraint', {})
+        if constraint.get('aspectRequired') or constraint.get('aspectUsage') == 'RECOMMENDED':
+            yield aspect
+
+
+def _suggestion_category(category):
+    return {key: category[key] for key in ('categoryId', 'categoryName', 'categoryTreeNodeLevel') if key in category}
+
+
+def read_suggestions(chunks):
+    """
+    Parse a getCategorySuggestions response while it is downloaded, keeping the
+    fields the app uses (no subtree links)
+
+    Args:
+        chunks (iterable): Chunks of the response body
+
+    Returns:
+        dict: Same shape as the getCategorySuggestions response
+    """
+    suggestions = {'categorySuggestions': []}
+    for path_keys, value in iter_json(chunks, ('categorySuggestions',)):
+        if path_keys == ('categorySuggestions',):
+            suggestions['categorySuggestions'].append({
+                'category': _suggestion_category(value['category']),
+                'categoryTreeNodeLevel': value.get('categoryTreeNodeLevel'),
+                'categoryTreeNodeAncestors': [_suggestion_category(ancestor)
+                                              for ancestor in value.get('categoryTreeNodeAncestors', [])]
+            })
+        elif path_keys in (('categoryTreeId',), ('categoryTreeVersion',)):
+            suggestions[path_keys[0]] = value
+    return suggestions
+
+
+class CategoryTreeSnapshot:
+    def __init__(self, path):
+        """
+        Read-only, memory-mapped category tree snapshot
+
+        Args:
+            path (str): Snapshot file written by write_snapshot
+        """
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, header_length = SNAPSHOT_PREFIX.unpack_from(self._mmap, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"Not a category tree snapshot: {path}")
+
+        header = json.loads(self._mmap[SNAPSHOT_PREFIX.size:SNAPSHOT_PREFIX.size + header_length])
+        self.category_tree_id = header['categoryTreeId']
+        self.category_tree_version = header['categoryTreeVersion']
+        self.marketplace_id = header['marketplaceId']
+        self.node_count = header['nodeCount']
+
+        self._nodes_offset = SNAPSHOT_PREFIX.size + header_length
+        self._names_offset = self._nodes_offset + self.node_count * NODE.size
+
+        # Built on first use
+        self._index = None
+        self._ids = None
+        self._index_lock = threading.Lock()
+
+    def __len__(self):
+        return self.node_count
+
+    def node(self, index):
+        """
+        Returns:
+            tuple: (category_id, parent, level, flags, name_offset, name_length, subtree_end)
+        """
+        return NODE.unpack_from(self._mmap, self._nodes_offset + index * NODE.size)
+
+    def name(self, index):
+        node = self.node(index)
+        start = self._names_offset + node[4]
+        return self._mmap[start:start + node[5]].decode()
+
+    def is_leaf(self, index):
+        return bool(self.node(index)[3] & LEAF_FLAG)
+
+    def ancestors(self, index):
+        """
+        Get the ancestors of a node, nearest first, excluding the tree root
+
+        Returns:
+            list: Node indices
+        """
+        ancestors = []
+        parent = self.node(index)[1]
+        while parent > 0:
+            ancestors.append(parent)
+            parent = self.node(parent)[1]
+        return ancestors
+
+    def children(self, index):
+        """
+        Returns:
+            list: Node indices of the direct children of a node
+        """
+        children = []
+        child, end = index + 1, self.node(index)[6]
+        # Pre-order: the next sibling of a child starts where its subtree ends
+        while child < end:
+            children.append(child)
+            child = self.node(child)[6]
+        return children
+
+    def category_path(self, index):
+        """
+        Returns:
+            list: Category names from the top level category down to the node
+        """
+        return [self.name(ancestor) for ancestor in reversed(self.ancestors(index))] + [self.name(index)]
+
+    def find(self, category_id):
+        """
+        Returns:
+            int: Node index of a category, or None if the tree doesn't have it
+        """
+        if self._ids is None:
+            with self._index_lock:
+                if self._ids is None:
+                    self._ids = {self.node(index)[0]: index for index in range(self.node_count)}
+        try:
+            return self._ids.get(int(category_id))
+        except (TypeError, ValueError):
+            return None
+
+    def breadcrumb(self, category_id, separator=' > '):
+        """
+        Returns:
+            str: Path of a category, e.g. "Clothing, Shoes & Accessories > Men > Men's Clothing > Shirts > T-Shirts",
+            or None if the tree doesn't have it
+        """
+        index = self.find(category_id)
+        return None if index is None else separator.join(self.category_path(index))
+
+    def check_category(self, category_id):
+        """
+        Check that listings can use a category: it exists and is a leaf
+
+        Returns:
+            str: Why they can't, or None if they can
+        """
+        index = self.find(category_id)
+        if index is None or index == 0:
+            return (f"Category {category_id} doesn't exist in the {self.marketplace_id} category tree "
+                    f"(version {self.category_tree_version})")
+        if not self.is_leaf(index):
+            return f"Category {category_id} ({self.breadcrumb(category_id)}) isn't a leaf category"
+        return None
+
+    def _build_index(self):
+        postings = defaultdict(list)
+        name_tokens = []
+        parents = []
+        leaves = []
+
+        for index in range(self.node_count):
+            node = self.node(index)
+            parents.append(node[1])
+            leaves.append(bool(node[3] & LEAF_FLAG))
+
+            tokens = frozenset(tokenize(self.name(index)))
+            name_tokens.append(tokens)
+            for token in tokens:
+                postings[token].append(index)
+
+        return postings, name_tokens, parents, leaves
+
+    def _get_index(self):
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    self._index = self._build_index()
+        return self._index
+
+    def _category(self, index):
+        node = self.node(index)
+        return {
+            'categoryId': str(node[0]),
+            'categoryName': self.name(index),
+            'categoryTreeNodeLevel': node[2]
+        }
+
+    def search(self, query, limit=20):
+        """
+        Find the categories whose name holds every token of a query
+
+        Args:
+            query (str): Search query
+            limit (int): Maximum number of categories
+
+        Returns:
+            list: Node indices, top level categories first
+        """
+        postings = self._get_index()[0]
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or any(token not in postings for token in tokens):
+            return []
+
+        # Intersect from the rarest token
+        tokens.sort(key=lambda token: len(postings[token]))
+        matches = set(postings[tokens[0]])
+        for token in tokens[1:]:
+            matches.intersection_update(postings[token])
+
+        return sorted(matches, key=lambda index: (self.node(index)[2], self.name(index)))[:limit]
+
+    def suggest(self, query, limit=10):
+        """
+        Rank leaf categories for a query using their names and ancestor paths
+
+        Args:
+            query (str): Search query (e.g. title and manufacturer)
+            limit (int): Maximum number of suggestions
+
+        Returns:
+            dict: Same shape as the getCategorySuggestions response
+        """
+        postings, name_tokens, parents, leaves = self._get_index()
+        tokens = [token for token in dict.fromkeys(tokenize(query)) if token in postings]
+
+        idf = {token: math.log(1 + self.node_count / len(postings[token])) for token in tokens}
+
+        # Leaves matching a token directly, and leaves below matching parent categories
+        candidates = set()
+        matched_parents = []
+        for token in tokens:
+            for index in postings[token]:
+                if leaves[index]:
+                    candidates.add(index)
+                else:
+                    matched_parents.append(index)
+
+        # Fall back to the leaves of the matched parent categories when no leaf name matches
+        if not candidates:
+            for parent in matched_parents:
+                for index in range(parent + 1, self.node(parent)[6]):
+                    if leaves[index]:
+                        candidates.add(index)
+                        if len(candidates) >= limit * 10:
+                            break
+
+        scored = []
+        for index in candidates:
+            path_tokens = set()
+            ancestor = parents[index]
+            while ancestor > 0:
+                path_tokens |= name_tokens[ancestor]
+                ancestor = parents[ancestor]
+
+            score = 0.0
+            for token in tokens:
+                if token in name_tokens[index]:
+                    score += NAME_WEIGHT * idf[token]
+                elif token in path_tokens:
+                    score += PATH_WEIGHT * idf[token]
+            scored.append((-score, index))
+
+        scored.sort()
+
+        suggestions = []
+        for _, index in scored[:limit]:
+            category = self._category(index)
+            suggestions.append({
+                'category': {
+                    'categoryId': category['categoryId'],
+                    'categoryName': category['categoryName']
+                },
+                'categoryTreeNodeLevel': category['categoryTreeNodeLevel'],
+                'categoryTreeNodeAncestors': [self._category(ancestor) for ancestor in self.ancestors(index)]
+            })
+
+        return {
+            'categorySuggestions': suggestions,
+            'categoryTreeId': self.category_tree_id,
+            'categoryTreeVersion': self.category_tree_version
+        }
+
+    def close(self):
+        self._mmap.close()
+
+
+def load_snapshot(path):
+    """
+    Get an opened snapshot, shared by the whole process and reopened when the file changes
+
+    Args:
+        path (str): Snapshot file
+
+    Returns:
+        CategoryTreeSnapshot: The snapshot, or None if the file doesn't exist
+    """
+    if not os.path.exists(path):
+        return None
+
+    with _snapshots_lock:
+        snapshot = _snapshots.get(path)
+        if snapshot is None or snapshot.mtime != os.path.getmtime(path):
+            snapshot = CategoryTreeSnapshot(path)
+            _snapshots[path] = snapshot
+        return snapshot
@@ -0,0 +1,194 @@
+import threading
+import time
+
+# Renew tokens this many seconds before they enter the expiry margin
+RENEW_AHEAD = 60
+# Wait before retrying a failed background renewal
+RENEW_RETRY_DELAY = 30
+# Stop renewing tokens nobody used for this long (e.g. sessions that went away)
+IDLE_TIMEOUT = 24 * 3600
+
+
+class TokenEntry:
+    __slots__ = ('token', 'fetch', 'lock', 'last_used', 'retry_at')
+
+    def __init__(self):
+        self.token = None
+        self.fetch = None
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+        self.retry_at = 0
+
+
+class TokenManager:
+    def __init__(self, margin=300, renew_ahead=RENEW_AHEAD, idle_timeout=IDLE_TIMEOUT):
+        """
+        Process-wide OAuth token cache with single-flight refresh and background renewal
+
+        Tokens are dicts as returned by eBay's token endpoint. An "expires_at" timestamp
+        is added when they are stored, so validity checks never need the network.
+
+        Args:
+            margin (float): Tokens are considered expired this many seconds before they really are
+            renew_ahead (float): Background renewal starts this many seconds before the margin
+            idle_timeout (float): Tokens unused for this long are dropped instead of renewed
+        """
+        self.margin = margin
+        self.renew_ahead = renew_ahead
+        self.idle_timeout = idle_timeout
+
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def _entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = TokenEntry()
+            return entry
+
+    def _is_valid(self, token):
+        return token is not None and time.time() < token.get('expires_at', 0) - self.margin
+
+    def _store(self, entry, token, fetch):
+        if 'expires_at' not in token:
+            token = {**token, 'expires_at': time.time() + token.get('expires_in', 0)}
+
+        # Never replace a token by one expiring earlier (e.g. restored from an older session)
+        if entry.token is None or token['expires_at'] >= entry.token.get('expires_at', 0):
+            entry.token = token
+
+        if fetch is not None:
+            entry.fetch = fetch
+            self._start_renewal()
+        return entry.token
+
+    def current(self, key):
+        """
+        Get the stored token if it hasn't expired yet, without refreshing it
+
+        Args:
+            key (tuple): Token key
+
+        Returns:
+            dict: The token or None
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry.token is None:
+            return None
+
+        entry.last_used = time.time()
+        return entry.token if time.time() < entry.token.get('expires_at', 0) else None
+
+    def is_valid(self, key):
+        """
+        Local expiry check, True if the token is stored and outside the expiry margin
+        """
+        entry = self._entries.get(key)
+        return entry is not None and self._is_valid(entry.token)
+
+    def put(self, key, token, fetch=None):
+        """
+        Store a token obtained elsewhere
+
+        Args:
+            key (tuple): Token key
+            token (dict): Token response
+            fetch (callable): Returns a new token, used for background renewal
+
+        Returns:
+            dict: The stored token
+        """
+        entry = self._entry(key)
+        with entry.lock:
+            return self._store(entry, token, fetch)
+
+    def get(self, key, fetch):
+        """
+        Get a valid token, fetching it if needed. Concurrent callers wait for
+        a single fetch instead of each starting their own.
+
+        Args:
+            key (tuple): Token key
+            fetch (callable): Returns a new token dict, or None on failure
+
+        Returns:
+            dict: The token, or None if fetching failed
+        """
+        entry = self._entry(key)
+        entry.last_used = time.time()
+
+        if self._is_valid(entry.token):
+            return entry.token
+
+        with entry.lock:
+            # Another caller may have fetched it while we were waiting
+            if self._is_valid(entry.token):
+                return entry.token
+
+            token = fetch()
+            if not token:
+                return None
+            return self._store(entry, token, fetch)
+
+    def refresh(self, key, fetch=None):
+        """
+        Force a new token. Callers arriving while a refresh is in flight get its result.
+
+        Args:
+            key (tuple): Token key
+            fetch (callable): Returns a new token dict, defaults to the registered one
+
+        Returns:
+            dict: The new token, or None if fetching failed
+        """
+        entry = self._entry(key)
+        seen = entry.token
+
+        with entry.lock:
+            if entry.token is not seen and self._is_valid(entry.token):
+                return entry.token
+
+            fetch = fetch or entry.fetch
+            token = fetch()
+            if not token:
+                return None
+            return self._store(entry, token, fetch)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _start_renewal(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._renew_loop, name='token-renewal', daemon=True)
+                    self._thread.start()
+        self._wakeup.set()
+
+    def _due_at(self, entry):
+        return max(entry.token.get('expires_at', 0) - self.margin - self.renew_ahead, entry.retry_at)
+
+    def _renew_loop(self):
+        while True:
+            now = time.time()
+            with self._lock:
+                for key in [key for key, entry in self._entries.items() if now - entry.last_used > self.idle_timeout]:
+                    del self._entries[key]
+                renewable = [(key, entry) for key, entry in self._entries.items() if entry.fetch and entry.token]
+
+            for key, entry in renewable:
+                if self._due_at(entry) <= now:
+                    try:
+                        token = self.refresh(key)
+                    except Exception as e:
+                        print(f"Error renewing token: {e}")
+                        token = None
+                    entry.retry_at = 0 if token else now + RENEW_RETRY_DELAY
+
+            next_due = min((self._due_at(entry) for _, entry in renewable), default=now + 3600)
+            self._wakeup.clear()
+            self._wakeup.wait(max(1, min(next_due - time.time(), 3600)))
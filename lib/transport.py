@@ -0,0 +1,111 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Default (connect, read) timeouts in seconds applied to every request
+DEFAULT_TIMEOUT = (5, 30)
+# Number of per-host connection pools kept alive
+DEFAULT_POOL_CONNECTIONS = 10
+# Number of keep-alive connections kept per host
+DEFAULT_POOL_MAXSIZE = 20
+
+# Shared transport for the whole process (all Streamlit sessions use the same pools)
+_transport = None
+_transport_lock = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter that applies a default timeout when the caller doesn't pass one
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+class Transport:
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 timeout=DEFAULT_TIMEOUT, pool_block=False, host_pool_sizes=None):
+        """
+        Pooled keep-alive HTTP transport
+
+        Args:
+            pool_connections (int): Number of per-host connection pools to cache
+            pool_maxsize (int): Maximum keep-alive connections per host
+            timeout (tuple): Default (connect, read) timeout in seconds
+            pool_block (bool): Block when a host pool is exhausted instead of opening extra connections
+            host_pool_sizes (dict): Per-host overrides of pool_maxsize, e.g. {'https://apiz.ebay.com': 4}
+        """
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive'
+        })
+
+        adapter = TimeoutHTTPAdapter(timeout=timeout, pool_connections=pool_connections,
+                                     pool_maxsize=pool_maxsize, pool_block=pool_block, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # Longer prefixes win, so host specific adapters take precedence over the defaults
+        for host, maxsize in (host_pool_sizes or {}).items():
+            self.session.mount(host, TimeoutHTTPAdapter(timeout=timeout, pool_connections=1,
+                                                        pool_maxsize=maxsize, pool_block=pool_block,
+                                                        max_retries=0))
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def get_transport():
+    """
+    Get the process-wide transport, creating it with default settings on first use
+
+    Returns:
+        Transport: The shared transport
+    """
+    global _transport
+
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = Transport()
+    return _transport
+
+
+def configure_transport(**kwargs):
+    """
+    Replace the process-wide transport with one built from the given settings
+
+    Args:
+        **kwargs: Arguments passed to Transport
+
+    Returns:
+        Transport: The new shared transport
+    """
+    global _transport
+
+    with _transport_lock:
+        old_transport = _transport
+        _transport = Transport(**kwargs)
+
+    if old_transport is not None:
+        old_transport.close()
+    return _transport
@@ -0,0 +1,346 @@
+"""
+Headless listing service.
+
+Exposes category suggestions, aspects, AI composition and listing publishing
+over HTTP, so other systems (and the Streamlit app, with LISTING_SERVICE_URL
+set) can create listings. Images and videos are uploaded to /media first.
+Publishing runs as a background job, polled through /jobs/<id>.
+
+Every endpoint but /health and /metrics(.json) needs the shared secret of
+LISTING_SERVICE_KEY in the X-Api-Key header.
+
+Each worker process has its own API clients, token renewal, rate limiter,
+in-memory caches and metrics (/metrics, /metrics.json). The LLM response cache, the category tree snapshots and the
+job queue are on disk and shared by all workers.
+
+Usage:
+    python src/api_server.py [--host 0.0.0.0] [--port 8000] [--workers 4] [--job-workers 4]
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from urllib.parse import unquote
+
+import uvicorn
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel
+
+from eBay import EbayAPI
+from bulk_lister import CHECKPOINT_DIR
+from publisher import JOB_HANDLERS
+
+# Add the project root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from lib.ai import compose_listing, compose_listing_stream, compose_listings, MAX_CONCURRENCY
+from lib.jobqueue import DEAD, WorkerPool, get_job_queue
+from lib.listing import normalize_record
+from lib.media import get_media_store
+from lib.metrics import get_metrics
+from lib.ratelimit import QuotaExceeded
+
+# Job threads per worker process, overridden by --job-workers
+JOB_WORKERS = int(os.environ.get('LISTING_SERVICE_JOB_WORKERS', 4))
+# Shared secret of the callers, the service refuses requests while it isn't set
+API_KEY_VARIABLE = 'LISTING_SERVICE_KEY'
+
+ENVIRONMENTS = ('sandbox', 'production')
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(env):
+    """
+    Application-authorized client of an environment, shared by the requests of this process
+
+    Args:
+        env (str): sandbox or production
+
+    Returns:
+        EbayAPI: Client with an app token
+    """
+    if env not in ENVIRONMENTS:
+        raise ValueError(f"Unknown environment: {env}")
+
+    client = _clients.get(env)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(env)
+            if client is None:
+                client = EbayAPI(**EbayAPI.load_credentials(env=env), env=env)
+                _clients[env] = client
+
+    if not client.get_app_token():
+        raise RuntimeError(f"Failed to get {env} app token.")
+    return client
+
+
+def require_api_key(x_api_key: Optional[str] = Header(None)):
+    # The endpoints spend Gemini quota, use the app tokens and return job results
+    api_key = os.environ.get(API_KEY_VARIABLE)
+    if not api_key:
+        raise HTTPException(status_code=503, detail=f"{API_KEY_VARIABLE} is not set")
+    if not x_api_key or not hmac.compare_digest(x_api_key.encode(), api_key.encode()):
+        raise HTTPException(status_code=401, detail="Invalid API key")
+
+
+class ComposeRequest(BaseModel):
+    title: str
+    manufacturer: str
+    summary: str
+
+
+class ComposeBatchRequest(BaseModel):
+    products: List[ComposeRequest]
+    max_concurrency: int = MAX_CONCURRENCY
+
+
+class ListingJobRequest(BaseModel):
+    records: List[dict]
+    env: str = 'sandbox'
+    publish: bool = True
+
+
+class SingleListingRequest(BaseModel):
+    record: dict
+    env: str = 'sandbox'
+    publish: bool = True
+    # Other marketplaces to publish on, with their prices, categories and aspects (see publisher.publish_marketplaces)
+    marketplaces: List[str] = []
+    prices: dict = {}
+    marketplace_listings: dict = {}
+    # Digests of media uploaded to /media
+    images: List[str] = []
+    video: Optional[str] = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    workers = WorkerPool(get_job_queue(), JOB_HANDLERS, workers=JOB_WORKERS)
+    workers.start()
+    try:
+        yield
+    finally:
+        workers.stop(timeout=5)
+
+
+app = FastAPI(title="eBay Listing Service", lifespan=lifespan)
+# Endpoints of the callers holding the API key, /health and the metrics stay open to the load balancer and the scraper
+router = APIRouter(dependencies=[Depends(require_api_key)])
+
+
+@app.middleware('http')
+async def record_latency(request: Request, call_next):
+    # Requests are served concurrently on the event loop thread, they are timed without spans
+    started_at = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get('route')
+    get_metrics().observe('http_request_seconds', time.perf_counter() - started_at, method=request.method,
+                          route=route.path if route else 'unmatched', status=response.status_code)
+    return response
+
+
+@app.exception_handler(ValueError)
+async def value_error_handler(request: Request, e: ValueError):
+    return JSONResponse(status_code=400, content={'detail': str(e)})
+
+
+@app.exception_handler(QuotaExceeded)
+async def quota_exceeded_handler(request: Request, e: QuotaExceeded):
+    return JSONResponse(status_code=429, content={'detail': str(e)})
+
+
+@app.exception_handler(Exception)
+async def upstream_error_handler(request: Request, e: Exception):
+    print(f"{request.url.path} failed: {e}")
+    return JSONResponse(status_code=502, content={'detail': str(e)})
+
+
+# The eBay and Gemini clients are blocking, they run on the thread pool so the event loop keeps serving
+
+@app.get('/health')
+async def health():
+    return {'status': 'ok', 'pid': os.getpid()}
+
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text format, of this worker process only
+    return PlainTextResponse(get_metrics().to_prometheus(), media_type='text/plain; version=0.0.4')
+
+
+@app.get('/metrics.json')
+async def metrics_json():
+    return get_metrics().to_json()
+
+
+@router.get('/suggestions')
+async def suggestions(q: str, marketplace_id: str = 'EBAY_US', offline: Optional[bool] = None):
+    # Suggestions only exist in production
+    client = await run_in_threadpool(get_client, 'production')
+    return await run_in_threadpool(client.get_category_suggestions, q, marketplace_id, offline)
+
+
+@router.get('/aspects/{category_id}')
+async def aspects(category_id: str, marketplace_id: str = 'EBAY_US', env: str = 'production'):
+    client = await run_in_threadpool(get_client, env)
+    return await run_in_threadpool(client.get_category_aspects, category_id, marketplace_id)
+
+
+@router.get('/aspects/{category_id}/schema')
+async def aspects_schema(category_id: str, marketplace_id: str = 'EBAY_US', env: str = 'production'):
+    # Binary CategorySchema (lib/schema.py) with the required and recommended aspects
+    client = await run_in_threadpool(get_client, env)
+    schema = await run_in_threadpool(client.get_category_schema, category_id, marketplace_id)
+    return Response(schema.to_bytes(), media_type='application/octet-stream')
+
+
+@router.post('/compose')
+async def compose(request: ComposeRequest):
+    return await run_in_threadpool(compose_listing, request.title, request.manufacturer, request.summary)
+
+
+@router.post('/compose/stream')
+async def compose_stream(request: ComposeRequest):
+    """
+    Listing as it is generated, one JSON object per line
+    """
+    def lines():
+        for listing in compose_listing_stream(request.title, request.manufacturer, request.summary):
+            yield json.dumps(listing) + '\n'
+
+    # Sync generators are iterated on the thread pool by Starlette
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+
+@router.post('/compose/batch')
+async def compose_batch(request: ComposeBatchRequest):
+    products = [product.model_dump() for product in request.products]
+    # Each product is an LLM call, callers can ask for less concurrency than the process allows, not more
+    max_concurrency = min(max(request.max_concurrency, 1), MAX_CONCURRENCY)
+    listings = await run_in_threadpool(compose_listings, products, max_concurrency)
+    return [{'error': str(listing)} if isinstance(listing, Exception) else listing for listing in listings]
+
+
+@router.post('/listings', status_code=202)
+async def create_listings(request: ListingJobRequest, x_ebay_refresh_token: str = Header(...)):
+    """
+    Queue the creation (and publishing) of listings, authorized with the seller's refresh token
+    """
+    if request.env not in ENVIRONMENTS:
+        raise ValueError(f"Unknown environment: {request.env}")
+
+    records = [normalize_record(record) for record in request.records]
+    job_id = get_job_queue().submit('publish_listings', {
+        'env': request.env,
+        'publish': request.publish,
+        'refresh_token': x_ebay_refresh_token,
+        'records': records,
+        'checkpoint': os.path.join(CHECKPOINT_DIR, f"job-{uuid.uuid4().hex}.checkpoint.jsonl")
+    })
+    return {'job_id': job_id}
+
+
+@router.put('/media/{digest}')
+async def put_media(digest: str, request: Request, x_filename: Optional[str] = Header(None)):
+    """
+    Store an image or video under its SHA-256 digest, for the listings referencing it
+    """
+    data = await request.body()
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f"Content doesn't match digest {digest}")
+    await run_in_threadpool(get_media_store().put, data, unquote(x_filename) if x_filename else None)
+    return {'digest': digest}
+
+
+@router.get('/media/{digest}')
+async def media(digest: str):
+    return {'digest': digest, 'exists': await run_in_threadpool(get_media_store().exists, digest)}
+
+
+@router.post('/listing', status_code=202)
+async def create_listing(request: SingleListingRequest, x_ebay_refresh_token: str = Header(...)):
+    """
+    Queue the creation and publishing of one listing with its media, on one or more marketplaces.
+    While a job for the same SKU is queued or running, its ID is returned instead.
+    """
+    if request.env not in ENVIRONMENTS:
+        raise ValueError(f"Unknown environment: {request.env}")
+
+    record = normalize_record(request.record)
+    store = get_media_store()
+    media = [*request.images, *([request.video] if request.video else [])]
+    missing = [digest for digest in media if not await run_in_threadpool(store.exists, digest)]
+    if missing:
+        raise ValueError(f"Media not uploaded: {', '.join(missing)}")
+
+    job_id = get_job_queue().submit('publish_listing', {
+        'env': request.env,
+        'refresh_token': x_ebay_refresh_token,
+        'publish': request.publish,
+        'record': record,
+        'marketplaces': [record['marketplace_id'],
+                         *[marketplace_id for marketplace_id in request.marketplaces
+                           if marketplace_id != record['marketplace_id']]],
+        'prices': request.prices,
+        'marketplace_listings': request.marketplace_listings,
+        'images': request.images,
+        'video': request.video
+    }, dedupe_key=f"{request.env}:{record['sku']}")
+    return {'job_id': job_id}
+
+
+@router.get('/jobs/dead')
+async def dead_jobs(limit: int = 100):
+    return await run_in_threadpool(get_job_queue().dead_letters, limit)
+
+
+@router.get('/jobs/{job_id}')
+async def job(job_id: str):
+    job = await run_in_threadpool(get_job_queue().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@router.post('/jobs/{job_id}/requeue')
+async def requeue_job(job_id: str, x_ebay_refresh_token: Optional[str] = Header(None)):
+    # The refresh token was removed from the job when it was dead-lettered, the caller sends it again
+    credentials = {'refresh_token': x_ebay_refresh_token} if x_ebay_refresh_token else None
+    if not await run_in_threadpool(get_job_queue().requeue, job_id, credentials):
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is not {DEAD}")
+    return {'job_id': job_id}
+
+
+app.include_router(router)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=4, help='Server processes')
+    parser.add_argument('--job-workers', type=int, default=JOB_WORKERS, help='Job threads per process')
+    args = parser.parse_args()
+    if not os.environ.get(API_KEY_VARIABLE):
+        parser.error(f"Set {API_KEY_VARIABLE} to the shared secret of the callers")
+
+    # Worker processes import this module again, they get the setting from the environment
+    os.environ['LISTING_SERVICE_JOB_WORKERS'] = str(args.job_workers)
+
+    uvicorn.run('api_server:app', host=args.host, port=args.port, workers=args.workers,
+                app_dir=os.path.dirname(os.path.abspath(__file__)))
+
+
+if __name__ == '__main__':
+    main()
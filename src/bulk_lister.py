@@ -0,0 +1,290 @@
+"""
+Headless bulk listing pipeline.
+
+Reads a CSV/JSONL catalog and creates inventory items, offers and listings in
+batches through the Inventory API bulk calls. Progress is journaled per SKU so
+an interrupted run resumes where it stopped. Category IDs are checked against
+the local category tree first, records with an unknown or non-leaf category
+fail without any API call.
+
+Usage:
+    EBAY_REFRESH_TOKEN=... python src/bulk_lister.py catalog.csv [--env sandbox] [--no-publish]
+"""
+import argparse
+import json
+import os
+import sys
+from itertools import islice
+
+from eBay import EbayAPI, BULK_BATCH_SIZE, rate_limiter
+
+# Add the project root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from lib.listing import read_catalog, build_inventory_item, build_offer
+from lib.ratelimit import BULK
+
+CHECKPOINT_DIR = os.path.join('.cache', 'bulk')
+
+# Pipeline stages in order, a SKU only moves to the next stage once the previous succeeded
+STAGES = ('item', 'offer', 'published')
+
+# createOffer error returned when an offer already exists for the SKU and marketplace
+OFFER_EXISTS_ERROR_ID = 25002
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def format_errors(errors):
+    return [f"{error.get('errorId')}: {error.get('message')}" for error in errors or []]
+
+
+class Checkpoint:
+    def __init__(self, path):
+        """
+        Append-only journal of the stage reached by each SKU
+
+        Args:
+            path (str): Journal file (JSON lines), replayed on load
+        """
+        self.path = path
+        self.state = {}
+
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.state.setdefault(entry.pop('sku'), {}).update(entry)
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def stage(self, sku):
+        """
+        Returns:
+            int: Number of stages completed by the SKU
+        """
+        stage = self.state.get(sku, {}).get('stage')
+        return STAGES.index(stage) + 1 if stage else 0
+
+    def get(self, sku, key):
+        return self.state.get(sku, {}).get(key)
+
+    def update(self, sku, **fields):
+        self.state.setdefault(sku, {}).update(fields)
+        self._file.write(json.dumps({'sku': sku, **fields}) + '\n')
+
+    def reset(self, sku):
+        # Listed again from the start, e.g. once its item was deleted on eBay
+        self.update(sku, stage=None, offerId=None, listingId=None, errors=[])
+
+    def commit(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self.commit()
+        self._file.close()
+
+
+class BulkListingPipeline:
+    def __init__(self, client, checkpoint, batch_size=BULK_BATCH_SIZE, publish=True, locale='en_US',
+                 category_tree=None):
+        """
+        Create listings for a catalog in batches
+
+        Args:
+            client (EbayAPI): Client with a valid user token
+            checkpoint (Checkpoint): Journal used to skip completed stages
+            batch_size (int): Requests per bulk call (at most BULK_BATCH_SIZE)
+            publish (bool): Publish the offers once they are created
+            locale (str): Locale of the inventory items
+            category_tree (callable): Returns the CategoryTreeSnapshot of a marketplace to check
+                category IDs against, e.g. EbayAPI.get_category_tree. Categories aren't checked without it
+        """
+        self.client = client
+        self.checkpoint = checkpoint
+        self.batch_size = min(batch_size, BULK_BATCH_SIZE)
+        self.publish = publish
+        self.locale = locale
+        self.category_tree = category_tree
+        self._category_trees = {}
+
+        self.counts = {stage: 0 for stage in STAGES}
+        self.skipped = 0
+        self.failures = {}
+
+    def run(self, records):
+        """
+        Args:
+            records (iterable): Listing records, consumed lazily one batch at a time
+
+        Returns:
+            dict: Counts per stage, skipped SKUs and errors per failed SKU
+        """
+        for batch in batched(records, self.batch_size):
+            self.process_batch(batch)
+
+        return {
+            'counts': self.counts,
+            'skipped': self.skipped,
+            'failures': self.failures
+        }
+
+    def process_batch(self, batch):
+        records = {record['sku']: record for record in batch}
+        last_stage = len(STAGES) if self.publish else STAGES.index('offer') + 1
+        self.skipped += sum(1 for sku in records if self.checkpoint.stage(sku) >= last_stage)
+        self._check_categories(records)
+
+        self._create_items([record for sku, record in records.items() if self.checkpoint.stage(sku) < 1])
+        self._create_offers([record for sku, record in records.items() if self.checkpoint.stage(sku) == 1])
+        if self.publish:
+            self._publish_offers([sku for sku in records if self.checkpoint.stage(sku) == 2])
+
+        self.checkpoint.commit()
+
+    def _check_categories(self, records):
+        # Offers not created yet need a category listings can use, the others are dropped from the batch
+        if self.category_tree is None:
+            return
+
+        for sku, record in list(records.items()):
+            if self.checkpoint.stage(sku) >= STAGES.index('offer') + 1:
+                continue
+
+            marketplace_id = record['marketplace_id']
+            if marketplace_id not in self._category_trees:
+                self._category_trees[marketplace_id] = self.category_tree(marketplace_id)
+            problem = self._category_trees[marketplace_id].check_category(record['category_id'])
+            if problem:
+                self._fail(sku, 'offer', [{'errorId': 'category', 'message': problem}])
+                del records[sku]
+
+    def _fail(self, sku, stage, errors):
+        self.failures[sku] = {'stage': stage, 'errors': format_errors(errors)}
+        self.checkpoint.update(sku, errors=self.failures[sku]['errors'])
+
+    def _create_items(self, records):
+        if not records:
+            return
+
+        items = [{'sku': record['sku'], 'locale': self.locale, **build_inventory_item(record)} for record in records]
+        for response in self.client.bulk_create_or_replace_inventory_item(items):
+            sku = response.get('sku')
+            if response.get('statusCode') in (200, 201, 204):
+                self.checkpoint.update(sku, stage='item', errors=[])
+                self.counts['item'] += 1
+            else:
+                self._fail(sku, 'item', response.get('errors'))
+
+    def _create_offers(self, records):
+        if not records:
+            return
+
+        for response in self.client.bulk_create_offer([build_offer(record) for record in records]):
+            sku = response.get('sku')
+            offer_id = response.get('offerId')
+
+            # An offer created by an earlier, interrupted run counts as created
+            if not offer_id:
+                for error in response.get('errors') or []:
+                    if error.get('errorId') == OFFER_EXISTS_ERROR_ID:
+                        offer_id = next((parameter['value'] for parameter in error.get('parameters', [])
+                                         if parameter.get('name') == 'offerId'), None)
+
+            if offer_id:
+                self.checkpoint.update(sku, stage='offer', offerId=offer_id, errors=[])
+                self.counts['offer'] += 1
+            else:
+                self._fail(sku, 'offer', response.get('errors'))
+
+    def _publish_offers(self, skus):
+        if not skus:
+            return
+
+        skus_by_offer = {self.checkpoint.get(sku, 'offerId'): sku for sku in skus}
+        for response in self.client.bulk_publish_offer(list(skus_by_offer)):
+            sku = skus_by_offer.get(response.get('offerId'))
+            if response.get('listingId'):
+                self.checkpoint.update(sku, stage='published', listingId=response['listingId'], errors=[])
+                self.counts['published'] += 1
+            else:
+                self._fail(sku, 'published', response.get('errors'))
+
+
+def headless_client(env, refresh_token=None):
+    """
+    Create a client outside the Streamlit app, authorized with a refresh token
+
+    Args:
+        env (str): sandbox or production
+        refresh_token (str): User refresh token, defaults to the EBAY_REFRESH_TOKEN environment variable
+
+    Returns:
+        EbayAPI: Client with a valid user token
+    """
+    refresh_token = refresh_token or os.environ.get('EBAY_REFRESH_TOKEN')
+    if not refresh_token:
+        raise ValueError("EBAY_REFRESH_TOKEN is required.")
+
+    client = EbayAPI(**EbayAPI.load_credentials(env=env), env=env)
+    # Leave part of the call budget to interactive sessions
+    client.priority = BULK
+    client.user_token = {'refresh_token': refresh_token}
+    # An access token refreshed earlier in this process for the same refresh token is reused
+    if not client.user_token.get('access_token') or client.is_user_token_expired():
+        client.refresh_token()
+
+    if not client.user_token.get('access_token'):
+        raise ValueError(f"Failed to get {env} user token.")
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('catalog', help='CSV or JSONL catalog')
+    parser.add_argument('--env', default='sandbox', choices=['sandbox', 'production'])
+    parser.add_argument('--checkpoint', help='Progress journal, defaults to .cache/bulk/<catalog>.checkpoint.jsonl')
+    parser.add_argument('--batch-size', type=int, default=BULK_BATCH_SIZE)
+    parser.add_argument('--no-publish', action='store_true', help='Create offers without publishing them')
+    parser.add_argument('--no-category-check', action='store_true',
+                        help="Don't check category IDs against the local category tree")
+    args = parser.parse_args()
+
+    checkpoint_path = args.checkpoint or os.path.join(
+        CHECKPOINT_DIR, f"{os.path.basename(args.catalog)}.checkpoint.jsonl")
+    checkpoint = Checkpoint(checkpoint_path)
+
+    client = headless_client(args.env)
+    if not args.no_category_check and not client.app_token:
+        # The category tree calls use the application token
+        client.get_app_token()
+    pipeline = BulkListingPipeline(client, checkpoint, batch_size=args.batch_size, publish=not args.no_publish,
+                                   category_tree=None if args.no_category_check else client.get_category_tree)
+    try:
+        report = pipeline.run(read_catalog(args.catalog))
+    finally:
+        checkpoint.close()
+
+    for sku, failure in report['failures'].items():
+        print(f"{sku} failed at {failure['stage']}: {'; '.join(failure['errors'])}")
+
+    print(f"Items: {report['counts']['item']}, offers: {report['counts']['offer']}, "
+          f"published: {report['counts']['published']}, already done: {report['skipped']}, "
+          f"failed: {len(report['failures'])}")
+    print(f"Checkpoint: {checkpoint_path}")
+
+    inventory_usage = rate_limiter.metrics()['inventory']
+    print(f"Inventory API calls today: {inventory_usage['used_today']}/{inventory_usage['daily_budget']}, "
+          f"retries: {inventory_usage['retries']}, throttled: {inventory_usage['throttled']}")
+
+    sys.exit(1 if report['failures'] else 0)
+
+
+if __name__ == '__main__':
+    main()
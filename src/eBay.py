@@ -4,14 +4,171 @@ import xml.etree.ElementTree as ET
 import base64
 import requests
 import webbrowser
+import threading
 import time
 import xml.etree.ElementTree as ET
-from urllib.parse import urlencode, unquote
+from urllib.parse import urlencode, unquote, urlsplit, quote
+
+import sys
+import os
+
+# Add the project root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from lib.transport import get_transport
+from lib.cache import TTLCache
+from lib.taxonomy import iter_aspects, load_snapshot, read_suggestions, snapshot_path, write_snapshot_stream
+from lib.json_stream import STREAM_CHUNK_SIZE
+from lib.tokens import TokenManager
+from lib.ratelimit import RateLimiter, INTERACTIVE, retry_statuses, send_with_retry
+from lib.metrics import get_metrics
+from lib.schema import CategorySchema, get_schema_store
 
 # Invalidate a token if it is about to expire
 TOKEN_TIMEOUT_MARGIN = 300
 
+# Process-wide OAuth tokens, app tokens are shared by every session of the same env
+token_manager = TokenManager(margin=TOKEN_TIMEOUT_MARGIN)
+
+# Process-wide call budgets per API family
+rate_limiter = RateLimiter()
+
+# API family of each path prefix, used to pick the call budget
+API_FAMILIES = (
+    ('/identity/', 'identity'),
+    ('/commerce/identity/', 'identity'),
+    ('/commerce/taxonomy/', 'taxonomy'),
+    ('/sell/inventory/', 'inventory'),
+    ('/commerce/media/', 'media')
+)
+
+# Maximum number of requests accepted by the Inventory API bulk calls
+BULK_BATCH_SIZE = 25
+# Inventory items per getInventoryItems page (the API maximum), offers per getOffers page
+INVENTORY_PAGE_SIZE = 200
+OFFER_PAGE_SIZE = 100
+# Bytes of a video sent per upload call, a failed upload resumes from the last chunk eBay acknowledged
+VIDEO_CHUNK_SIZE = 8 * 1024 * 1024
+
+# eBay API hosts per environment
+ENDPOINTS = {
+    'production': {
+        'api': 'https://api.ebay.com',
+        'auth': 'https://auth.ebay.com',
+        'identity': 'https://apiz.ebay.com',
+        'media': 'https://apim.ebay.com'
+    },
+    'sandbox': {
+        'api': 'https://api.sandbox.ebay.com',
+        'auth': 'https://auth.sandbox.ebay.com',
+        'identity': 'https://apiz.sandbox.ebay.com',
+        'media': 'https://apim.sandbox.ebay.com'
+    }
+}
+
+# Set to the URL of a local stand-in (tools/mock_ebay.py) to send every call of both environments to it
+EBAY_MOCK_URL = os.environ.get('EBAY_MOCK_URL')
+if EBAY_MOCK_URL:
+    ENDPOINTS = {env: {host: EBAY_MOCK_URL.rstrip('/') for host in hosts} for env, hosts in ENDPOINTS.items()}
+
+# Process-wide taxonomy caches shared by all sessions.
+# Tree IDs are keyed by (env, marketplace_id), category schemas (aspects) by (env, marketplace_id, category_id)
+category_tree_id_cache = TTLCache(maxsize=64, ttl=24 * 3600)
+# Current version of each tree, a local snapshot of another version is downloaded again
+category_tree_version_cache = TTLCache(maxsize=64, ttl=24 * 3600)
+category_aspects_cache = TTLCache(maxsize=256, ttl=6 * 3600)
+get_metrics().register_collector('ttl_cache', category_tree_id_cache.stats, cache='category_tree_id')
+get_metrics().register_collector('ttl_cache', category_aspects_cache.stats, cache='category_aspects')
+
+# Serializes category tree downloads, the sessions needing a tree wait for the one being downloaded
+category_tree_lock = threading.Lock()
+
+
+class EbayAPIError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def api_family(url):
+    """
+    Args:
+        url (str): eBay API URL
+        
+    Returns:
+        str: API family of the URL, or None if it isn't rate limited
+    """
+    path = urlsplit(url).path
+    for prefix, family in API_FAMILIES:
+        if path.startswith(prefix):
+            return family
+    return None
+
+
+def cached_category_schema(cache_key):
+    """
+    Get the schema of a category from memory, or from disk where another process
+    (or this one before a restart) stored it
+
+    Args:
+        cache_key (tuple): (env, marketplace_id, category_id)
+
+    Returns:
+        tuple: The schema if it is fresh (or None), and the ETag to revalidate a stale one with (or None)
+    """
+    schema = category_aspects_cache.get(cache_key)
+    if schema is not None:
+        return schema, None
+
+    stale_entry = category_aspects_cache.get_stale(cache_key)
+    if stale_entry is not None:
+        return None, stale_entry.etag
+
+    stored = get_schema_store().load(*cache_key)
+    if stored is None:
+        return None, None
+
+    schema, etag, age = stored
+    # A schema older than the TTL is cached as expired, ready for revalidation
+    category_aspects_cache.set(cache_key, schema, etag=etag, ttl=category_aspects_cache.ttl - age)
+    if age < category_aspects_cache.ttl:
+        return schema, None
+    return None, etag
+
+
+def revalidated_category_schema(cache_key):
+    """
+    Returns:
+        CategorySchema: The cached schema the server confirmed unchanged (304), or None if it was evicted meanwhile
+    """
+    schema = category_aspects_cache.revalidated(cache_key)
+    if schema is not None:
+        get_schema_store().touch(*cache_key)
+    return schema
+
+
+def store_category_schema(cache_key, aspects, etag=None):
+    """
+    Build the schema of the aspects of a getItemAspectsForCategory response and cache it in memory and on disk
+
+    Args:
+        cache_key (tuple): (env, marketplace_id, category_id)
+        aspects (iterable): Aspects of the response, e.g. from lib.taxonomy.iter_aspects
+        etag (str): ETag of the response
+
+    Returns:
+        CategorySchema: The schema
+    """
+    schema = CategorySchema.from_aspects(cache_key[2], aspects)
+    get_schema_store().save(*cache_key, schema, etag=etag)
+    category_aspects_cache.set(cache_key, schema, etag=etag)
+    return schema
+
 class EbayAPI:
+    # Answer category suggestions from a local category tree snapshot instead of the API
+    offline_suggestions = False
+    # Scheduling priority of this client's calls (interactive UI calls go before bulk jobs)
+    priority = INTERACTIVE
+
     def __init__(self, client_id, client_secret, dev_id, ru_name, env):
         """
         Initialize eBay OAuth authentication utility
@@ -25,34 +182,81 @@ class EbayAPI:
         self.client_secret = client_secret
         self.dev_id = dev_id
         self.ru_name = ru_name
-        self.user_token = None
-        self.app_token = None
         self.env = env
+        self.user_token = None
         
         # eBay OAuth endpoints
-        self.endpoints = {
-            'production': {
-                'api': 'https://api.ebay.com',
-                'auth': 'https://auth.ebay.com',
-                'identity': 'https://apiz.ebay.com'
-            },
-            'sandbox': {
-                'api': 'https://api.sandbox.ebay.com',
-                'auth': 'https://auth.sandbox.ebay.com',
-                'identity': 'https://apiz.sandbox.ebay.com'
-            }
-        }
+        self.endpoints = ENDPOINTS
 
-    def get_app_token(self):
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Persist the latest user token, it may have been renewed in the background
+        state['_user_token'] = self.user_token
+        return state
+
+    def __setstate__(self, state):
+        # Clients pickled before tokens were managed per process
+        state.pop('app_token', None)
+        state.setdefault('_user_token', state.pop('user_token', None))
+
+        # Tokens pickled without an absolute expiry are renewed right away
+        token = state['_user_token']
+        if token and 'expires_at' not in token:
+            token = {**token, 'expires_at': 0}
+
+        self.__dict__.update(state)
+        self.user_token = token
+
+    def _request(self, method, url, **kwargs):
         """
-        Get application OAuth token using client credentials grant
+        Send a request over the shared pooled transport, within the call
+        budget of its API family. Throttled (429) calls are retried with
+        backoff, failed (5xx) calls only for idempotent methods, connection
+        errors only for GET requests.
+
+        Args:
+            method (str): HTTP method
+            url (str): Request URL
+            **kwargs: Arguments passed to requests (headers, params, data, timeout...)
+
+        Returns:
+            requests.Response: The response
+        """
+        family = api_family(url)
+        if family is None:
+            return get_transport().request(method, url, **kwargs)
+
+        def send():
+            # Rewind file bodies (media uploads) that a failed attempt already read
+            for body in [kwargs.get('data'), *(kwargs.get('files') or {}).values()]:
+                body = body[1] if isinstance(body, tuple) else body
+                if hasattr(body, 'seek'):
+                    body.seek(0)
+            return get_transport().request(method, url, **kwargs)
+
+        retry_errors = (requests.ConnectionError, requests.Timeout) if method == 'GET' else ()
+        metrics = get_metrics()
+        with metrics.span('ebay_request', family=family, method=method) as span:
+            response = send_with_retry(send, rate_limiter, family, priority=self.priority, retry_errors=retry_errors,
+                                       statuses=retry_statuses(method))
+            span.set(status=response.status_code)
+
+        # Streamed bodies aren't read here, they are not counted
+        if not kwargs.get('stream'):
+            metrics.inc('ebay_response_bytes_total', len(response.content), family=family)
+        return response
+
+    def _token_request(self, data):
+        """
+        Call the OAuth token endpoint
+        
+        Args:
+            data (dict): Grant parameters
             
         Returns:
-            dict: Response containing access token and expiration
+            dict: Token response, or None if it holds no token
         """
-
         endpoint = f"{self.endpoints[self.env]['api']}/identity/v1/oauth2/token"
-        print(f'endpoint: {endpoint}')
         
         # Encode credentials
         credentials = base64.b64encode(
@@ -62,32 +266,94 @@ class EbayAPI:
             'Content-Type': 'application/x-www-form-urlencoded',
             'Authorization': f'Basic {credentials}'
         }
-        
-        data = {
-            'grant_type': 'client_credentials',
-            'scope': 'https://api.ebay.com/oauth/api_scope'
-        }
-        
-        response = requests.post(endpoint, headers=headers, data=data)
 
-        try:
-            self.app_token = response.json()
+        token = self._request('POST', endpoint, headers=headers, data=data).json()
+        return token if 'access_token' in token else None
 
-            # Store expiration time in session state
-            st.session_state['app_token_expiration'] = self.app_token['expires_in'] + time.time()
+    @property
+    def _app_token_key(self):
+        return ('app', self.env, self.client_id)
+
+    @property
+    def _user_token_key(self):
+        if not self._user_token or 'refresh_token' not in self._user_token:
+            return None
+        return ('user', self.env, self.client_id, self._user_token['refresh_token'])
+
+    @property
+    def app_token(self):
+        """
+        Application token shared by every client of the same application and environment
+
+        Returns:
+            dict: The token, or None if there is none or it has expired
+        """
+        return token_manager.current(self._app_token_key)
+
+    @app_token.setter
+    def app_token(self, token):
+        if token:
+            token_manager.put(self._app_token_key, token, fetch=self._fetch_app_token)
+
+    @property
+    def user_token(self):
+        """
+        User token, including renewals done in the background
 
-            return self.app_token
+        Returns:
+            dict: The token or None
+        """
+        key = self._user_token_key
+        return (token_manager.current(key) if key else None) or self._user_token
+
+    @user_token.setter
+    def user_token(self, token):
+        self._user_token = token
+        key = self._user_token_key
+        if key:
+            token_manager.put(key, token, fetch=self._fetch_refreshed_user_token)
+
+    def _fetch_app_token(self):
+        token = self._token_request({
+            'grant_type': 'client_credentials',
+            'scope': 'https://api.ebay.com/oauth/api_scope'
+        })
 
-        except KeyError as e:
+        if token is None:
             print("Error getting app token")
+        return token
+
+    def _fetch_refreshed_user_token(self):
+        refresh_token = self._user_token['refresh_token']
+        token = self._token_request({
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh_token
+        })
+
+        if token is None:
+            print(f"Error refreshing user token")
             return None
 
-    def get_auth_url(self, scopes):
+        # The refresh grant doesn't return the refresh token again
+        return {**self._user_token, **token, 'refresh_token': refresh_token}
+
+    def get_app_token(self):
+        """
+        Get application OAuth token using client credentials grant.
+        The token is fetched once per process and renewed in the background.
+            
+        Returns:
+            dict: Response containing access token and expiration
+        """
+        return token_manager.get(self._app_token_key, self._fetch_app_token)
+
+    def get_auth_url(self, scopes, state=None):
         """
         Get authorization URL for user consent
         
         Args:
             scopes (list): List of eBay API scopes to request
+            state (str): Value eBay passes back to the redirect URL
             
         Returns:
             str: Authorization URL
@@ -100,6 +366,9 @@ class EbayAPI:
             'redirect_uri': self.ru_name,
             'scope': ' '.join(scopes)
         }
+
+        if state:
+            params['state'] = state
         
         return f"{endpoint}?{urlencode(params)}"
 
@@ -113,73 +382,40 @@ class EbayAPI:
         Returns:
             dict: Response containing access token, refresh token and expiration
         """
-        endpoint = f"{self.endpoints[self.env]['api']}/identity/v1/oauth2/token"
-        
-        # Encode credentials
-        credentials = base64.b64encode(
-            f"{self.client_id}:{self.client_secret}".encode()).decode()
-        
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'Authorization': f'Basic {credentials}'
-        }
-        
-        data = {
+        token = self._token_request({
             'grant_type': 'authorization_code',
             'code': auth_code,
             'redirect_uri': self.ru_name
-        }
-
-        try:
-            self.user_token = requests.post(endpoint, headers=headers, data=data).json()
-        
-            # Store expiration time in session state
-            st.session_state['user_token_expiration'] = self.user_token['expires_in'] + time.time()
+        })
 
-        except KeyError as e:
+        if token is None:
             print("Error getting user token")
             return
+
+        # Renewed in the background from now on
+        self.user_token = token
         return self.user_token
 
     def refresh_token(self):
         """
-        Refresh an OAuth token using refresh token
+        Refresh the user OAuth token using its refresh token. Concurrent
+        refreshes of the same token are merged into one call.
 
         Returns:
             dict: Response containing new access token and expiration
         """
-        endpoint = f"{self.endpoints[self.env]['api']}/identity/v1/oauth2/token"
-
-        # Encode credentials
-        credentials = base64.b64encode(
-            f"{self.client_id}:{self.client_secret}".encode()).decode()
-
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'Authorization': f'Basic {credentials}'
-        }
-
-        data = {
-            'grant_type': 'refresh_token',
-            'refresh_token': self.user_token['refresh_token']
-        }
+        key = self._user_token_key
+        if key is None:
+            raise ValueError("Refresh token is required.")
 
-        response = requests.post(endpoint, headers=headers, data=data)
-
-        try:
-            self.user_token = response.json()
-            # Update expiration time in session state
-            st.session_state['user_token_expiration'] = self.user_token['expires_in'] + time.time()
-            
-        except KeyError as e:
-            print(f"Error refreshing user token")
+        token = token_manager.refresh(key, self._fetch_refreshed_user_token)
+        if token:
+            self._user_token = token
+        return token
 
     def is_app_token_valid(self) -> bool:
         """
-        Validates an eBay app OAuth token by making a test API call
-        
-        Args:
-            env (str): sandbox or production
+        Checks the app OAuth token expiry locally, without calling eBay
             
         Returns:
             bool: True if token is valid, False otherwise
@@ -188,61 +424,52 @@ class EbayAPI:
         if not self.app_token:
             raise ValueError("App token is required.") 
 
-        endpoint = f"{self.endpoints[self.env]['api']}/commerce/taxonomy/v1/get_default_category_tree_id"           
-        
-        headers = {
-            "Authorization": f"Bearer {self.app_token['access_token']}",
-            "Accept": "application/json",
-        }
-        
-        params = {
-            "marketplace_id": "EBAY_US"
-        }
-        
-        response = requests.get(endpoint, headers=headers, params=params)
-
-        return response.status_code == 200
+        return not self.is_app_token_expired()
         
     def is_user_token_valid(self) -> bool:
         """
-        Validates an eBay user OAuth token by making a test API call
-        
-        Args:
-            env (str): sandbox or production
+        Checks the user OAuth token expiry locally, without calling eBay
             
         Returns:
             bool: True if token is valid, False otherwise
         """
 
-        endpoint = f"{self.endpoints[self.env]['identity']}/commerce/identity/v1/user/"
-        
-        headers = {
-            "Authorization": f"Bearer {self.user_token['access_token']}"
-        }
-        
-        response = requests.get(endpoint, headers=headers)
-
-
-        return response.status_code == 200
+        return bool(self.user_token) and not self.is_user_token_expired()
 
     def is_app_token_expired(self):
-        return time.time() > st.session_state['app_token_expiration'] - TOKEN_TIMEOUT_MARGIN
+        return not token_manager.is_valid(self._app_token_key)
 
     def is_user_token_expired(self):
-        return time.time() > st.session_state['user_token_expiration'] - TOKEN_TIMEOUT_MARGIN
+        token = self.user_token
+        # No user logged in: there is no token that could still be used
+        if not token:
+            return True
+        return time.time() > token.get('expires_at', 0) - TOKEN_TIMEOUT_MARGIN
 
-    def get_category_suggestions(self, query, marketplace_id="EBAY_US"):
+    def get_category_suggestions(self, query, marketplace_id="EBAY_US", offline=None):
         """
         Get category suggestions for a given query
         
         Args:
             query (str): Search query for category suggestions
             marketplace_id (str): Target marketplace ID
+            offline (bool): Use the local category tree snapshot, defaults to offline_suggestions
+
+        Returns:
+            dict: Response containing the category suggestions
         """
-        endpoint = "https://api.ebay.com/commerce/taxonomy/v1/category_tree/0/get_category_suggestions"
+        if offline is None:
+            offline = self.offline_suggestions
+
+        if offline:
+            return self.get_category_tree(marketplace_id=marketplace_id).suggest(query)
 
         if not self.app_token:
             raise ValueError("Production app token is required.")    
+
+        # Category suggestions aren't supported by the sandbox, they always come from production
+        category_tree_id = self.get_category_tree_id(marketplace_id=marketplace_id)
+        endpoint = f"{self.endpoints['production']['api']}/commerce/taxonomy/v1/category_tree/{category_tree_id}/get_category_suggestions"
         
         headers = {
             "Authorization": f"Bearer {self.app_token['access_token']}",
@@ -253,8 +480,89 @@ class EbayAPI:
             "q": query
         }
         
-        response = requests.get(endpoint, headers=headers, params=params)
-        return response.json()
+        # Parsed while it is downloaded, keeping only the fields the app uses
+        with self._request('GET', endpoint, headers=headers, params=params, stream=True) as response:
+            if response.status_code != 200:
+                return response.json()
+            return read_suggestions(response.iter_content(STREAM_CHUNK_SIZE))
+
+    def download_category_tree(self, marketplace_id="EBAY_US"):
+        """
+        Download the full category tree of a marketplace and store it as a local snapshot
+        
+        Args:
+            marketplace_id (str): Target marketplace ID
+            
+        Returns:
+            str: Path of the snapshot file
+        """
+        if not self.app_token:
+            raise ValueError("App token is required.")
+
+        category_tree_id = self.get_category_tree_id(marketplace_id=marketplace_id)
+
+        endpoint = f"{self.endpoints[self.env]['api']}/commerce/taxonomy/v1/category_tree/{category_tree_id}"
+
+        headers = {
+            "Authorization": f"Bearer {self.app_token['access_token']}",
+            "Accept": "application/json",
+        }
+
+        path = snapshot_path(self.env, marketplace_id)
+        # The full tree is tens of megabytes, it is written while it is downloaded
+        with self._request('GET', endpoint, headers=headers, timeout=(5, 300), stream=True) as response:
+            if response.status_code != 200:
+                raise Exception(f"Failed to get category tree: {response.status_code}: {response.text}")
+
+            node_count = write_snapshot_stream(response.iter_content(STREAM_CHUNK_SIZE), path,
+                                               marketplace_id=marketplace_id)
+        print(f"Saved {node_count} categories of {marketplace_id} to {path}")
+
+        return path
+
+    def get_category_tree(self, marketplace_id="EBAY_US"):
+        """
+        Get the local category tree of a marketplace, downloaded when there is none
+        or eBay published another version than the stored one
+        
+        Args:
+            marketplace_id (str): Target marketplace ID
+            
+        Returns:
+            CategoryTreeSnapshot: The tree
+        """
+        path = snapshot_path(self.env, marketplace_id)
+        snapshot = load_snapshot(path)
+        if snapshot is not None and not self.app_token:
+            # The version can't be checked, the stored tree is better than none
+            return snapshot
+
+        version = self.get_category_tree_version(marketplace_id=marketplace_id)
+        if snapshot is None or snapshot.category_tree_version != version:
+            with category_tree_lock:
+                snapshot = load_snapshot(path)
+                if snapshot is None or snapshot.category_tree_version != version:
+                    self.download_category_tree(marketplace_id=marketplace_id)
+                    snapshot = load_snapshot(path)
+        return snapshot
+
+    def get_category_tree_version(self, marketplace_id='EBAY_US'):
+        """
+        Get the current version of the category tree of a marketplace
+        
+        Args:
+            marketplace_id (str): Target marketplace ID
+            
+        Returns:
+            str: The version
+        """
+        version = category_tree_version_cache.get((self.env, marketplace_id))
+        if version is None:
+            # Both are returned by the same call
+            category_tree_id_cache.pop((self.env, marketplace_id))
+            self.get_category_tree_id(marketplace_id=marketplace_id)
+            version = category_tree_version_cache.get((self.env, marketplace_id))
+        return version
 
     def get_category_tree_id(self, marketplace_id='EBAY_US'):
         """
@@ -270,6 +578,11 @@ class EbayAPI:
         if not self.app_token:
             raise ValueError("App token is required.") 
 
+        cache_key = (self.env, marketplace_id)
+        category_tree_id = category_tree_id_cache.get(cache_key)
+        if category_tree_id is not None:
+            return category_tree_id
+
         endpoint = f"{self.endpoints[self.env]['api']}/commerce/taxonomy/v1/get_default_category_tree_id"           
         
         headers = {
@@ -281,24 +594,41 @@ class EbayAPI:
             "marketplace_id": marketplace_id
         }
         
-        response = requests.get(endpoint, headers=headers, params=params)
-        return response.json()['categoryTreeId']
+        response = self._request('GET', endpoint, headers=headers, params=params)
+        category_tree = response.json()
+        category_tree_id = category_tree['categoryTreeId']
 
-    def get_category_aspects(self, category_id, marketplace_id="EBAY_US"):
+        category_tree_id_cache.set(cache_key, category_tree_id)
+        category_tree_version_cache.set(cache_key, category_tree.get('categoryTreeVersion'))
+        return category_tree_id
+
+    def is_category_aspects_cached(self, category_id, marketplace_id="EBAY_US"):
         """
-        Get required aspects for a specific category
+        Returns:
+            bool: True if get_category_schema would answer from memory
+        """
+        return (self.env, marketplace_id, category_id) in category_aspects_cache
+
+    def get_category_schema(self, category_id, marketplace_id="EBAY_US"):
+        """
+        Get the schema of the required and recommended aspects of a category
         
         Args:
             category_id (str): The category ID to get aspects for
             marketplace_id (str): Target marketplace ID
             
         Returns:
-            list: List of dictionaries containing aspect details (name, type, values)
+            CategorySchema: The schema
         """
 
         if not self.app_token:
             raise ValueError("App token is required.")
 
+        cache_key = (self.env, marketplace_id, category_id)
+        schema, etag = cached_category_schema(cache_key)
+        if schema is not None:
+            return schema
+
         category_tree_id = self.get_category_tree_id(marketplace_id=marketplace_id)
 
         endpoint = f"{self.endpoints[self.env]['api']}/commerce/taxonomy/v1/category_tree/{category_tree_id}/get_item_aspects_for_category"         
@@ -311,27 +641,313 @@ class EbayAPI:
         params = {
             "category_id": category_id
         }
+
+        # Revalidate an expired schema instead of downloading the whole payload again
+        if etag:
+            headers["If-None-Match"] = etag
+        
+        response = self._request('GET', endpoint, headers=headers, params=params, stream=True)
+
+        if response.status_code == 304:
+            response.close()
+            schema = revalidated_category_schema(cache_key)
+            if schema is not None:
+                return schema
+            # Entry was evicted meanwhile, fetch it unconditionally
+            headers.pop("If-None-Match")
+            response = self._request('GET', endpoint, headers=headers, params=params, stream=True)
+
+        # Clothing categories return megabytes of aspects, the schema is built while they are downloaded
+        with response:
+            if response.status_code != 200:
+                raise Exception(f"Failed to get aspects: {response.status_code}: {response.text}")
+
+            return store_category_schema(cache_key, iter_aspects(response.iter_content(STREAM_CHUNK_SIZE)),
+                                         etag=response.headers.get('ETag'))
+
+    def get_category_aspects(self, category_id, marketplace_id="EBAY_US"):
+        """
+        Get required aspects for a specific category
+        
+        Args:
+            category_id (str): The category ID to get aspects for
+            marketplace_id (str): Target marketplace ID
+            
+        Returns:
+            list: List of dictionaries containing aspect details (name, type, mode, values)
+        """
+        return self.get_category_schema(category_id, marketplace_id).required_aspects()
+
+    def _inventory_request(self, method, path, payload=None, params=None, missing_ok=False):
+        """
+        Send a Sell Inventory API request on behalf of the user
+        
+        Args:
+            method (str): HTTP method
+            path (str): Path below /sell/inventory/v1
+            payload (dict): JSON body
+            params (dict): Query parameters
+            missing_ok (bool): Return None instead of failing when the resource doesn't exist
+            
+        Returns:
+            dict: Response body
+        """
+        if not self.user_token:
+            raise ValueError("User token is required.")
+
+        endpoint = f"{self.endpoints[self.env]['api']}/sell/inventory/v1{path}"
+
+        headers = {
+            "Authorization": f"Bearer {self.user_token['access_token']}",
+            "Content-Type": "application/json",
+            "Content-Language": "en-US",
+            "Accept": "application/json"
+        }
+
+        response = self._request(method, endpoint, headers=headers, json=payload, params=params)
+
+        if missing_ok and response.status_code == 404:
+            return None
+
+        # Bulk calls answer 207 when only some of the requests succeeded
+        if response.status_code not in (200, 201, 204, 207):
+            raise EbayAPIError(f"Inventory API call {path} failed: {response.status_code}: {response.text}",
+                               response.status_code)
+
+        return response.json() if response.content else {}
+
+    def bulk_create_or_replace_inventory_item(self, items):
+        """
+        Create or replace up to BULK_BATCH_SIZE inventory items
+        
+        Args:
+            items (list): Inventory items, each with its "sku" and "locale"
+            
+        Returns:
+            list: One response per item (statusCode, sku, errors)
+        """
+        return self._inventory_request('POST', '/bulk_create_or_replace_inventory_item',
+                                       {'requests': items}).get('responses', [])
+
+    def bulk_create_offer(self, offers):
+        """
+        Create up to BULK_BATCH_SIZE offers
+        
+        Args:
+            offers (list): Offers
+            
+        Returns:
+            list: One response per offer (statusCode, sku, offerId, errors)
+        """
+        return self._inventory_request('POST', '/bulk_create_offer', {'requests': offers}).get('responses', [])
+
+    def bulk_publish_offer(self, offer_ids):
+        """
+        Publish up to BULK_BATCH_SIZE offers
+        
+        Args:
+            offer_ids (list): IDs of the offers to publish
+            
+        Returns:
+            list: One response per offer (statusCode, offerId, listingId, errors)
+        """
+        return self._inventory_request('POST', '/bulk_publish_offer',
+                                       {'requests': [{'offerId': offer_id} for offer_id in offer_ids]}).get('responses', [])
+
+    def bulk_update_price_quantity(self, updates):
+        """
+        Update the quantity and the offer prices of up to BULK_BATCH_SIZE inventory items,
+        without sending the rest of their item or offer
         
-        response = requests.get(endpoint, headers=headers, params=params)
+        Args:
+            updates (list): Updates, each with its "sku", "shipToLocationAvailability"
+                and "offers" (offerId, availableQuantity, price)
+            
+        Returns:
+            list: One response per offer (statusCode, sku, offerId, errors)
+        """
+        return self._inventory_request('POST', '/bulk_update_price_quantity',
+                                       {'requests': updates}).get('responses', [])
+
+    def _iter_pages(self, path, field, params, page_size):
+        # Pages are only requested once the items of the previous one are consumed
+        offset = 0
+        while True:
+            page = self._inventory_request('GET', path, params={**params, 'limit': page_size, 'offset': offset},
+                                           missing_ok=True) or {}
+            items = page.get(field, [])
+            yield from items
+
+            # eBay only links the next page when there is one
+            if not items or not page.get('next'):
+                return
+            offset += len(items)
+
+    def iter_inventory_items(self, page_size=INVENTORY_PAGE_SIZE):
+        """
+        Lazily list the inventory items of the seller, one getInventoryItems page at a time
+        
+        Args:
+            page_size (int): Items per page
+            
+        Yields:
+            dict: Inventory items, with their "sku"
+        """
+        yield from self._iter_pages('/inventory_item', 'inventoryItems', {}, page_size)
+
+    def iter_offers(self, sku, marketplace_id=None, page_size=OFFER_PAGE_SIZE):
+        """
+        Lazily list the offers of a SKU, one getOffers page at a time
+        
+        Args:
+            sku (str): Seller SKU
+            marketplace_id (str): Only the offers on this marketplace
+            page_size (int): Offers per page
+            
+        Yields:
+            dict: Offers (offerId, marketplaceId, status, listing...)
+        """
+        params = {'sku': sku}
+        if marketplace_id:
+            params['marketplace_id'] = marketplace_id
+        yield from self._iter_pages('/offer', 'offers', params, page_size)
+
+    def create_or_replace_inventory_item(self, sku, item):
+        """
+        Create or replace an inventory item. Replacing with the same payload has no effect,
+        so it can be retried safely.
+        
+        Args:
+            sku (str): Seller SKU
+            item (dict): Inventory item
+        """
+        self._inventory_request('PUT', f"/inventory_item/{quote(sku, safe='')}", item)
+
+    def get_offers(self, sku, marketplace_id=None):
+        """
+        Get the offers of a SKU
+        
+        Args:
+            sku (str): Seller SKU
+            marketplace_id (str): Only the offer on this marketplace
+            
+        Returns:
+            list: Offers (offerId, marketplaceId, status, listing...)
+        """
+        params = {'sku': sku}
+        if marketplace_id:
+            params['marketplace_id'] = marketplace_id
+
+        response = self._inventory_request('GET', '/offer', params=params, missing_ok=True)
+        return (response or {}).get('offers', [])
+
+    def create_offer(self, offer):
+        """
+        Returns:
+            str: ID of the new offer
+        """
+        return self._inventory_request('POST', '/offer', offer)['offerId']
+
+    def update_offer(self, offer_id, offer):
+        self._inventory_request('PUT', f"/offer/{offer_id}", offer)
+
+    def publish_offer(self, offer_id):
+        """
+        Returns:
+            str: ID of the listing
+        """
+        return self._inventory_request('POST', f"/offer/{offer_id}/publish")['listingId']
+
+    def _media_request(self, method, path, **kwargs):
+        """
+        Send a Commerce Media API request on behalf of the user
         
-        if response.status_code != 200:
-            raise Exception(f"Failed to get aspects: {response.status_code}: {response.text}")
+        Args:
+            method (str): HTTP method
+            path (str): Path below /commerce/media/v1_beta
+            **kwargs: Arguments passed to requests (headers, json, data, files...)
             
-        aspects_data = response.json()
-        
-        # List of required aspects 
-        requied_aspects = []
-        
-        for aspect in aspects_data.get('aspects', []):
-            aspect_info = {
-                'name': aspect.get('localizedAspectName'),
-                'data_type': aspect.get('aspectConstraint').get('aspectDataType'),
-                'values': [value.get('localizedValue') for value in aspect.get('aspectValues', [])]
-            }
-            if aspect.get('aspectConstraint').get('aspectRequired'):
-                requied_aspects.append(aspect_info)
+        Returns:
+            requests.Response: The response
+        """
+        if not self.user_token:
+            raise ValueError("User token is required.")
+
+        endpoint = f"{self.endpoints[self.env]['media']}/commerce/media/v1_beta{path}"
+
+        headers = {
+            "Authorization": f"Bearer {self.user_token['access_token']}",
+            **kwargs.pop('headers', {})
+        }
+
+        response = self._request(method, endpoint, headers=headers, **kwargs)
+
+        if response.status_code not in (200, 201, 202, 204):
+            raise EbayAPIError(f"Media API call {path} failed: {response.status_code}: {response.text}",
+                               response.status_code)
+
+        return response
+
+    def upload_image(self, path):
+        """
+        Upload an image to eBay Picture Services
+        
+        Args:
+            path (str): Image file
             
-        return requied_aspects
+        Returns:
+            dict: Response containing imageUrl and expirationDate
+        """
+        with open(path, 'rb') as f:
+            response = self._media_request('POST', '/image/create_image_from_file',
+                                           files={'image': (os.path.basename(path), f)})
+        return response.json()
+
+    def create_video(self, title, size):
+        """
+        Create a video resource to upload a video into
+        
+        Args:
+            title (str): Video title
+            size (int): Video size in bytes
+            
+        Returns:
+            str: Video ID
+        """
+        response = self._media_request('POST', '/video',
+                                       json={'title': title, 'size': size, 'classification': ['ITEM']})
+        return response.headers['Location'].rstrip('/').rsplit('/', 1)[-1]
+
+    def upload_video(self, video_id, path, offset=0, on_chunk=None, chunk_size=VIDEO_CHUNK_SIZE):
+        """
+        Upload the content of a video in chunks (Content-Range), reading one chunk
+        from disk at a time. A chunk that fails is not resent here: the upload is
+        resumed from the returned offset by calling again with it.
+        
+        Args:
+            video_id (str): ID returned by create_video
+            path (str): Video file
+            offset (int): Bytes eBay already acknowledged, from an earlier upload
+            on_chunk (callable): Called with the new offset after each acknowledged chunk
+            chunk_size (int): Bytes per upload call
+
+        Returns:
+            int: Offset reached, the file size once the upload is complete
+        """
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while offset < size:
+                chunk = f.read(chunk_size)
+                end = offset + len(chunk)
+                self._media_request('POST', f'/video/{video_id}/upload', data=chunk, timeout=(5, 300), headers={
+                    'Content-Type': 'application/octet-stream',
+                    'Content-Range': f"bytes {offset}-{end - 1}/{size}"
+                })
+                offset = end
+                if on_chunk:
+                    on_chunk(offset)
+        return offset
 
     @staticmethod
     def load_credentials(env, config_file='config/ebay_credentials.xml'):
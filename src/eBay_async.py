@@ -0,0 +1,436 @@
+import asyncio
+import time
+
+import httpx
+
+import sys
+import os
+
+# Add the project root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from eBay import (ENDPOINTS, BULK_BATCH_SIZE, EbayAPI, category_tree_id_cache, category_tree_version_cache,
+                  cached_category_schema, revalidated_category_schema, store_category_schema, rate_limiter)
+from lib.ratelimit import INTERACTIVE, MAX_RETRIES, MAX_RETRY_AFTER, retry_delay, retry_statuses
+from lib.metrics import get_metrics
+from lib.taxonomy import iter_aspects
+
+# Maximum number of requests in flight for one client
+MAX_CONCURRENCY = 64
+# Maximum number of requests in flight per API family
+FAMILY_CONCURRENCY = {
+    'identity': 4,
+    'taxonomy': 32,
+    'inventory': 16
+}
+# Default (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = httpx.Timeout(30, connect=5)
+
+
+class AsyncEbayAPI:
+    # Scheduling priority of this client's calls (interactive UI calls go before bulk jobs)
+    priority = INTERACTIVE
+
+    def __init__(self, client_id, client_secret, dev_id, ru_name, env,
+                 max_concurrency=MAX_CONCURRENCY, family_concurrency=None, timeout=DEFAULT_TIMEOUT):
+        """
+        Asynchronous counterpart of EbayAPI for fanning out many requests from one process
+
+        Use it as an async context manager, or call aclose() when done.
+
+        Args:
+            client_id (str): Your eBay application client ID
+            client_secret (str): Your eBay application client secret
+            ru_name (str): RuName value from your eBay application
+            max_concurrency (int): Maximum number of requests in flight
+            family_concurrency (dict): Maximum number of requests in flight per API family
+            timeout (httpx.Timeout): Request timeouts
+        """
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.dev_id = dev_id
+        self.ru_name = ru_name
+        self.env = env
+        self.endpoints = ENDPOINTS
+        # Tokens are kept by the process-wide token manager, through a synchronous client of the same application
+        self._tokens = EbayAPI(client_id, client_secret, dev_id, ru_name, env)
+
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._family_semaphores = {family: asyncio.Semaphore(limit)
+                                   for family, limit in {**FAMILY_CONCURRENCY, **(family_concurrency or {})}.items()}
+
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            headers={'Accept-Encoding': 'gzip, deflate'},
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        )
+
+    @classmethod
+    def from_client(cls, client, **kwargs):
+        """
+        Create an async client sharing the credentials and tokens of an EbayAPI client
+
+        Args:
+            client (EbayAPI): Synchronous client
+            **kwargs: Concurrency and timeout settings
+
+        Returns:
+            AsyncEbayAPI: The async client
+        """
+        async_client = cls(client.client_id, client.client_secret, client.dev_id, client.ru_name, client.env, **kwargs)
+        # The app token is shared through the token manager already
+        async_client.user_token = client.user_token
+        return async_client
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def _request(self, family, method, url, **kwargs):
+        """
+        Send a request once the family call budget and both the global and the
+        family concurrency limits allow it. Throttled (429) calls are retried
+        with backoff, failed (5xx) calls only for idempotent methods.
+        Cancelling the calling task releases its slots.
+
+        Args:
+            family (str): API family (identity, taxonomy, inventory)
+            method (str): HTTP method
+            url (str): Request URL
+            **kwargs: Arguments passed to httpx (headers, params, data, json...)
+
+        Returns:
+            httpx.Response: The response
+        """
+        # Concurrent calls interleave on the event loop thread, they are timed without spans
+        started_at = time.perf_counter()
+        attempt = 0
+        while True:
+            while delay := rate_limiter.try_acquire(family, self.priority):
+                rate_limiter.record_wait(family, delay)
+                await asyncio.sleep(delay)
+
+            async with self._semaphore:
+                async with self._family_semaphores[family]:
+                    response = await self._client.request(method, url, **kwargs)
+
+            delay = retry_delay(attempt + 1, response.headers)
+            retry = response.status_code in retry_statuses(method) and attempt < MAX_RETRIES and \
+                delay <= MAX_RETRY_AFTER
+            rate_limiter.record(family, response.status_code, retried=retry)
+            if not retry:
+                metrics = get_metrics()
+                metrics.observe('ebay_request_seconds', time.perf_counter() - started_at,
+                                family=family, method=method, status=response.status_code)
+                metrics.inc('ebay_response_bytes_total', len(response.content), family=family)
+                return response
+
+            attempt += 1
+            await response.aclose()
+            await asyncio.sleep(delay)
+
+    @property
+    def app_token(self):
+        """
+        Returns:
+            dict: Application token shared by every client of the same application and environment, None if
+                there is none or it has expired
+        """
+        return self._tokens.app_token
+
+    @app_token.setter
+    def app_token(self, token):
+        self._tokens.app_token = token
+
+    @property
+    def user_token(self):
+        """
+        Returns:
+            dict: User token, including renewals done in the background
+        """
+        return self._tokens.user_token
+
+    @user_token.setter
+    def user_token(self, token):
+        self._tokens.user_token = token
+
+    # Token calls are rare and merged across threads by the token manager, they run on a worker thread
+
+    async def get_app_token(self):
+        """
+        Get application OAuth token using client credentials grant.
+        The token is fetched once per process and renewed in the background.
+
+        Returns:
+            dict: Response containing access token and expiration
+        """
+        if not self._tokens.is_app_token_expired():
+            return self.app_token
+        return await asyncio.to_thread(self._tokens.get_app_token)
+
+    async def get_user_token(self, auth_code):
+        """
+        Get user OAuth token using authorization code
+
+        Args:
+            auth_code (str): Authorization code from callback URL
+
+        Returns:
+            dict: Response containing access token, refresh token and expiration
+        """
+        return await asyncio.to_thread(self._tokens.get_user_token, auth_code)
+
+    async def refresh_token(self):
+        """
+        Refresh the user OAuth token using its refresh token. Concurrent
+        refreshes of the same token are merged into one call.
+
+        Returns:
+            dict: Response containing new access token and expiration
+        """
+        return await asyncio.to_thread(self._tokens.refresh_token)
+
+    def is_app_token_expired(self):
+        return self._tokens.is_app_token_expired()
+
+    def is_user_token_expired(self):
+        return self._tokens.is_user_token_expired()
+
+    def is_app_token_valid(self):
+        """
+        Checks the app OAuth token expiry locally, without calling eBay
+
+        Returns:
+            bool: True if token is valid, False otherwise
+        """
+        return self._tokens.is_app_token_valid()
+
+    def is_user_token_valid(self):
+        """
+        Checks the user OAuth token expiry locally, without calling eBay
+
+        Returns:
+            bool: True if token is valid, False otherwise
+        """
+        return self._tokens.is_user_token_valid()
+
+    def _app_headers(self):
+        return {
+            "Authorization": f"Bearer {self.app_token['access_token']}",
+            "Accept": "application/json",
+        }
+
+    async def get_category_suggestions(self, query, marketplace_id="EBAY_US"):
+        """
+        Get category suggestions for a given query
+
+        Args:
+            query (str): Search query for category suggestions
+            marketplace_id (str): Target marketplace ID
+
+        Returns:
+            dict: Response containing the category suggestions
+        """
+        if not self.app_token:
+            raise ValueError("Production app token is required.")
+
+        # Category suggestions aren't supported by the sandbox, they always come from production
+        category_tree_id = await self.get_category_tree_id(marketplace_id=marketplace_id)
+        endpoint = f"{self.endpoints['production']['api']}/commerce/taxonomy/v1/category_tree/{category_tree_id}/get_category_suggestions"
+
+        response = await self._request('taxonomy', 'GET', endpoint, headers=self._app_headers(), params={"q": query})
+        return response.json()
+
+    async def get_category_tree_id(self, marketplace_id='EBAY_US'):
+        """
+        Get category tree ID of a marketplace
+
+        Args:
+            marketplace_id (str): Target marketplace ID
+
+        Returns:
+            str: The category tree ID of the target marketplace
+        """
+        if not self.app_token:
+            raise ValueError("App token is required.")
+
+        cache_key = (self.env, marketplace_id)
+        category_tree_id = category_tree_id_cache.get(cache_key)
+        if category_tree_id is not None:
+            return category_tree_id
+
+        endpoint = f"{self.endpoints[self.env]['api']}/commerce/taxonomy/v1/get_default_category_tree_id"
+        response = await self._request('taxonomy', 'GET', endpoint, headers=self._app_headers(),
+                                       params={"marketplace_id": marketplace_id})
+        category_tree = response.json()
+        category_tree_id = category_tree['categoryTreeId']
+
+        category_tree_id_cache.set(cache_key, category_tree_id)
+        category_tree_version_cache.set(cache_key, category_tree.get('categoryTreeVersion'))
+        return category_tree_id
+
+    async def get_category_schema(self, category_id, marketplace_id="EBAY_US"):
+        """
+        Get the schema of the required and recommended aspects of a category, sharing EbayAPI's caches
+
+        Args:
+            category_id (str): The category ID to get aspects for
+            marketplace_id (str): Target marketplace ID
+
+        Returns:
+            CategorySchema: The schema
+        """
+        if not self.app_token:
+            raise ValueError("App token is required.")
+
+        cache_key = (self.env, marketplace_id, category_id)
+        schema, etag = cached_category_schema(cache_key)
+        if schema is not None:
+            return schema
+
+        category_tree_id = await self.get_category_tree_id(marketplace_id=marketplace_id)
+
+        endpoint = f"{self.endpoints[self.env]['api']}/commerce/taxonomy/v1/category_tree/{category_tree_id}/get_item_aspects_for_category"
+        headers = self._app_headers()
+        params = {"category_id": category_id}
+
+        # Revalidate an expired schema instead of downloading the whole payload again
+        if etag:
+            headers["If-None-Match"] = etag
+
+        response = await self._request('taxonomy', 'GET', endpoint, headers=headers, params=params)
+
+        if response.status_code == 304:
+            schema = revalidated_category_schema(cache_key)
+            if schema is not None:
+                return schema
+            # Entry was evicted meanwhile, fetch it unconditionally
+            headers.pop("If-None-Match")
+            response = await self._request('taxonomy', 'GET', endpoint, headers=headers, params=params)
+
+        if response.status_code != 200:
+            raise Exception(f"Failed to get aspects: {response.status_code}: {response.text}")
+
+        # The body is already in memory here, it is decoded at once (with orjson if installed)
+        return store_category_schema(cache_key, iter_aspects(response.content), etag=response.headers.get('ETag'))
+
+    async def get_category_aspects(self, category_id, marketplace_id="EBAY_US"):
+        """
+        Get required aspects for a specific category
+
+        Args:
+            category_id (str): The category ID to get aspects for
+            marketplace_id (str): Target marketplace ID
+
+        Returns:
+            list: List of dictionaries containing aspect details (name, type, mode, values)
+        """
+        return (await self.get_category_schema(category_id, marketplace_id)).required_aspects()
+
+    async def get_many_category_aspects(self, category_ids, marketplace_id="EBAY_US"):
+        """
+        Get the required aspects of several categories concurrently. If one of
+        the calls fails, the others are cancelled and the error is raised.
+
+        Args:
+            category_ids (list): Category IDs
+            marketplace_id (str): Target marketplace ID
+
+        Returns:
+            dict: Required aspects per category ID
+        """
+        async with asyncio.TaskGroup() as task_group:
+            tasks = {category_id: task_group.create_task(self.get_category_aspects(category_id, marketplace_id))
+                     for category_id in category_ids}
+        return {category_id: task.result() for category_id, task in tasks.items()}
+
+    async def _inventory_request(self, method, path, payload=None):
+        """
+        Send a Sell Inventory API request on behalf of the user
+
+        Args:
+            method (str): HTTP method
+            path (str): Path below /sell/inventory/v1
+            payload (dict): JSON body
+
+        Returns:
+            dict: Response body
+        """
+        if not self.user_token:
+            raise ValueError("User token is required.")
+
+        endpoint = f"{self.endpoints[self.env]['api']}/sell/inventory/v1{path}"
+
+        headers = {
+            "Authorization": f"Bearer {self.user_token['access_token']}",
+            "Content-Type": "application/json",
+            "Content-Language": "en-US",
+            "Accept": "application/json"
+        }
+
+        response = await self._request('inventory', method, endpoint, headers=headers, json=payload)
+
+        # Bulk calls answer 207 when only some of the requests succeeded
+        if response.status_code not in (200, 201, 204, 207):
+            raise Exception(f"Inventory API call {path} failed: {response.status_code}: {response.text}")
+
+        return response.json() if response.content else {}
+
+    async def bulk_create_or_replace_inventory_item(self, items):
+        """
+        Create or replace up to BULK_BATCH_SIZE inventory items
+
+        Args:
+            items (list): Inventory items, each with its "sku" and "locale"
+
+        Returns:
+            list: One response per item (statusCode, sku, errors)
+        """
+        response = await self._inventory_request('POST', '/bulk_create_or_replace_inventory_item', {'requests': items})
+        return response.get('responses', [])
+
+    async def bulk_create_offer(self, offers):
+        """
+        Create up to BULK_BATCH_SIZE offers
+
+        Args:
+            offers (list): Offers
+
+        Returns:
+            list: One response per offer (statusCode, sku, offerId, errors)
+        """
+        response = await self._inventory_request('POST', '/bulk_create_offer', {'requests': offers})
+        return response.get('responses', [])
+
+    async def bulk_publish_offer(self, offer_ids):
+        """
+        Publish up to BULK_BATCH_SIZE offers
+
+        Args:
+            offer_ids (list): IDs of the offers to publish
+
+        Returns:
+            list: One response per offer (statusCode, offerId, listingId, errors)
+        """
+        response = await self._inventory_request(
+            'POST', '/bulk_publish_offer', {'requests': [{'offerId': offer_id} for offer_id in offer_ids]})
+        return response.get('responses', [])
+
+    async def bulk_create_or_replace_all_inventory_items(self, items):
+        """
+        Create or replace any number of inventory items, sending the batches concurrently
+
+        Args:
+            items (list): Inventory items, each with its "sku" and "locale"
+
+        Returns:
+            list: One response per item
+        """
+        batches = [items[i:i + BULK_BATCH_SIZE] for i in range(0, len(items), BULK_BATCH_SIZE)]
+        async with asyncio.TaskGroup() as task_group:
+            tasks = [task_group.create_task(self.bulk_create_or_replace_inventory_item(batch)) for batch in batches]
+        return [response for task in tasks for response in task.result()]
@@ -1,14 +1,9 @@
 import streamlit.components.v1 as components
 
-from fastapi import FastAPI, Request
-from fastapi.responses import RedirectResponse
-from threading import Thread
-import uvicorn
-
 import streamlit as st
 import webbrowser
 from urllib.parse import unquote
-from page_template import header, footer
+from page_template import header, footer, performance_panel
 from listing_creator import create_listing_form
 from eBay import EbayAPI
 
@@ -17,30 +12,38 @@ import os
 
 # Add the project root directory to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from lib.session import save_session_state, load_session_state, logout
+from lib.session import (save_session_state, load_session_state, logout, new_oauth_state, rotate_session_id,
+                         verify_oauth_state, write_session_cookie)
+from lib.metrics import get_metrics
 
 SANDBOX_ENABLE = True
-VISUAL_DEBUG_MODE = False
+# Show the timings of each rerun and the process metrics below the page
+PERFORMANCE_PANEL = os.environ.get('PERFORMANCE_PANEL') == '1'
+# Saved keys this page uses
+SESSION_KEYS = ['ebay_client', 'ebay_production', 'ebay_sandbox', 'auth_state', 'callback_auth_code', 'oauth_state',
+                'page', 'processing', 'last_page', 'navigation_radio']
 
-if VISUAL_DEBUG_MODE:
-    import io
-    # Capture the output of print statements
-    output = io.StringIO()
-    sys.stdout = output
+# Runs cut short by st.rerun() aren't recorded, the next run starts a new trace
+rerun_span = get_metrics().span('rerun', root=True).start()
 
 # Check if navigation_radio is set in session state
 refresh_navigation_radio = st.session_state.navigation_radio if 'navigation_radio' in st.session_state else None
-# Load state (without navigation_radio)
+# Load the state of this page (without navigation_radio), the Listing Creator loads its own
 print("Loading session state")
-load_session_state()
+load_session_state(SESSION_KEYS)
 
 if "code" in st.query_params:
-    st.session_state.callback_auth_code = st.query_params["code"]
-    print('Received callback auth code')
+    # Only a code answering the authorization request of this session is used
+    if verify_oauth_state(st.query_params.get("state")):
+        st.session_state.callback_auth_code = st.query_params["code"]
+        print('Received callback auth code')
+    else:
+        print('Ignoring callback auth code with an unknown state')
 
     # Remove the query parameters from the URL
-    del st.query_params["code"]
-    del st.query_params["expires_in"]
+    for param in ("code", "expires_in", "state"):
+        if param in st.query_params:
+            del st.query_params[param]
 
     save_session_state()
     
@@ -60,6 +63,7 @@ st.set_page_config(
         'About': None
     }
 )
+write_session_cookie()
 
 # Load CSS styles
 with open('static/css/styles.css') as f:
@@ -80,9 +84,7 @@ def navigation_disabled():
 def authorize_client():
     if not ebay_production.app_token:        
         print(f"Getting production application token...")
-        ebay_production.get_app_token()
-
-        if ebay_production.app_token.get('access_token'):
+        if ebay_production.get_app_token():
             print("Production application token obtained successfully.")
         else:
             print("Failed to obtain production application token.")
@@ -91,9 +93,7 @@ def authorize_client():
     if SANDBOX_ENABLE:
         if not ebay_sandbox.app_token:
             print(f"Getting sandbox application token...")
-            ebay_sandbox.get_app_token()
-
-            if ebay_sandbox.app_token.get('access_token'):
+            if ebay_sandbox.get_app_token():
                 print("Sandbox application token obtained successfully.")
             else:
                 print("Failed to obtain sandbox application token.")
@@ -107,7 +107,7 @@ def authorize_client():
             scopes = ["https://api.ebay.com/oauth/api_scope", "https://api.ebay.com/oauth/api_scope/buy.order.readonly", "https://api.ebay.com/oauth/api_scope/buy.guest.order", "https://api.ebay.com/oauth/api_scope/sell.marketing.readonly", "https://api.ebay.com/oauth/api_scope/sell.marketing", "https://api.ebay.com/oauth/api_scope/sell.inventory.readonly", "https://api.ebay.com/oauth/api_scope/sell.inventory", "https://api.ebay.com/oauth/api_scope/sell.account.readonly", "https://api.ebay.com/oauth/api_scope/sell.account", "https://api.ebay.com/oauth/api_scope/sell.fulfillment.readonly", "https://api.ebay.com/oauth/api_scope/sell.fulfillment", "https://api.ebay.com/oauth/api_scope/sell.analytics.readonly", "https://api.ebay.com/oauth/api_scope/sell.marketplace.insights.readonly", "https://api.ebay.com/oauth/api_scope/commerce.catalog.readonly", "https://api.ebay.com/oauth/api_scope/buy.shopping.cart", "https://api.ebay.com/oauth/api_scope/buy.offer.auction", "https://api.ebay.com/oauth/api_scope/commerce.identity.readonly", "https://api.ebay.com/oauth/api_scope/commerce.identity.email.readonly", "https://api.ebay.com/oauth/api_scope/commerce.identity.phone.readonly", "https://api.ebay.com/oauth/api_scope/commerce.identity.address.readonly", "https://api.ebay.com/oauth/api_scope/commerce.identity.name.readonly", "https://api.ebay.com/oauth/api_scope/commerce.identity.status.readonly", "https://api.ebay.com/oauth/api_scope/sell.finances", "https://api.ebay.com/oauth/api_scope/sell.payment.dispute", "https://api.ebay.com/oauth/api_scope/sell.item.draft", "https://api.ebay.com/oauth/api_scope/sell.item", "https://api.ebay.com/oauth/api_scope/sell.reputation", "https://api.ebay.com/oauth/api_scope/sell.reputation.readonly", "https://api.ebay.com/oauth/api_scope/commerce.notification.subscription", "https://api.ebay.com/oauth/api_scope/commerce.notification.subscription.readonly", "https://api.ebay.com/oauth/api_scope/sell.stores", "https://api.ebay.com/oauth/api_scope/sell.stores.readonly"]     
 
         print(f"Getting {env} authorization URL...")
-        auth_url = st.session_state.ebay_client.get_auth_url(scopes)
+        auth_url = st.session_state.ebay_client.get_auth_url(scopes, state=new_oauth_state())
         # Open auth URL
         print('Opening auth URL')
         
@@ -119,12 +119,12 @@ def authorize_client():
     if st.session_state.get('auth_state') != 'authorized':      
         if st.session_state.callback_auth_code:
             print('Getting user token...')
-            st.session_state.ebay_client.get_user_token(st.session_state.callback_auth_code)
-            
-            if st.session_state.ebay_client.user_token['access_token']:
+            if st.session_state.ebay_client.get_user_token(st.session_state.callback_auth_code):
                 print(f"{env}: Authorization successful")
                 st.session_state['auth_state'] = 'authorized'
-                # del st.query_params['code']                
+                st.session_state.callback_auth_code = None
+                # The tokens are saved under an ID nobody could know before the login
+                rotate_session_id()
 
                 save_session_state()
                 st.rerun()
@@ -210,9 +210,7 @@ footer()
 
 save_session_state()
 
-# Reset sys.stdout to its default
-sys.stdout = sys.__stdout__
+rerun_span.end()
 
-if VISUAL_DEBUG_MODE:
-    # Display the captured output in the Streamlit app
-    st.text(output.getvalue())
\ No newline at end of file
+if PERFORMANCE_PANEL:
+    performance_panel(rerun_span)
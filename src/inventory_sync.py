@@ -0,0 +1,317 @@
+"""
+Incremental inventory sync.
+
+Pushes a CSV/JSONL catalog to eBay, sending only what changed since the last
+sync. The payload digests, price, quantity and offer of every SKU pushed are
+kept in a local index (.cache/sync/<env>.db). Each catalog record is compared
+with it:
+
+- new SKUs are listed with the bulk calls of the bulk lister,
+- SKUs whose item changed get their item replaced (and their offer updated if it changed too),
+- SKUs whose offer changed (category, policies...) get their offer updated,
+- SKUs whose price or quantity only changed go through bulkUpdatePriceQuantity,
+- unchanged SKUs cost no API call.
+
+With --reconcile, the index is first checked against the inventory items on
+eBay, read one page at a time: items edited or deleted outside of the sync are
+pushed again.
+
+A bulk call rejected as a whole fails the SKUs of its batch, the others are
+still pushed.
+
+Usage:
+    EBAY_REFRESH_TOKEN=... python src/inventory_sync.py catalog.csv [--env sandbox] [--reconcile] [--dry-run]
+"""
+import argparse
+import os
+import sys
+from collections import defaultdict
+
+from eBay import BULK_BATCH_SIZE, EbayAPIError, rate_limiter
+from bulk_lister import BulkListingPipeline, Checkpoint, batched, format_errors, headless_client
+
+# Add the project root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from lib.listing import read_catalog, build_inventory_item, build_offer
+from lib.sync import (ITEM, NEW, OFFER, PRICE_QUANTITY, SYNC_DIR, SyncIndex, classify, item_digest, item_quantity,
+                      record_state)
+
+# Catalog records compared with the index at a time
+INDEX_CHUNK_SIZE = 500
+
+CHANGES = (NEW, ITEM, OFFER, PRICE_QUANTITY)
+
+
+class InventorySync:
+    def __init__(self, client, index, checkpoint, batch_size=BULK_BATCH_SIZE, publish=True, locale='en_US',
+                 dry_run=False):
+        """
+        Push the changes of a catalog since the last sync
+
+        Args:
+            client (EbayAPI): Client with a valid user token
+            index (SyncIndex): State last pushed per SKU
+            checkpoint (Checkpoint): Journal of the new SKUs being listed, so an interrupted sync resumes
+            batch_size (int): Requests per bulk call (at most BULK_BATCH_SIZE)
+            publish (bool): Publish the offers created
+            locale (str): Locale of the inventory items
+            dry_run (bool): Only count the changes
+        """
+        self.client = client
+        self.index = index
+        self.batch_size = min(batch_size, BULK_BATCH_SIZE)
+        self.publish = publish
+        self.locale = locale
+        self.dry_run = dry_run
+        self.pipeline = BulkListingPipeline(client, checkpoint, batch_size=self.batch_size, publish=publish,
+                                            locale=locale)
+
+        self.counts = {change: 0 for change in CHANGES}
+        self.counts['unchanged'] = 0
+        self.failures = {}
+
+    def reconcile(self):
+        """
+        Bring the index in line with the inventory items on eBay: items whose
+        content or quantity differs get the eBay digest and quantity, so the sync
+        pushes them again, and SKUs no longer on eBay are dropped, so they are
+        listed again. Offers aren't compared, getOffers takes one call per SKU.
+
+        Returns:
+            dict: Numbers of changed and deleted SKUs
+        """
+        seen = set()
+        report = {'changed': 0, 'deleted': 0}
+        remote = []
+        for item in self.client.iter_inventory_items():
+            seen.add(item['sku'])
+            remote.append({'sku': item['sku'], 'item_digest': item_digest(item), 'quantity': item_quantity(item)})
+            if len(remote) == INDEX_CHUNK_SIZE:
+                report['changed'] += self._reconcile_items(remote)
+                remote = []
+        report['changed'] += self._reconcile_items(remote)
+
+        missing = [sku for sku in self.index.skus() if sku not in seen]
+        if not self.dry_run:
+            self.index.delete_many(missing)
+            # Otherwise the journal of an earlier sync would skip them as already listed
+            for sku in missing:
+                self.pipeline.checkpoint.reset(sku)
+            self.pipeline.checkpoint.commit()
+        report['deleted'] = len(missing)
+        return report
+
+    def _reconcile_items(self, remote):
+        pushed = self.index.get_many([state['sku'] for state in remote])
+        changed = [state for state in remote if state['sku'] not in pushed or
+                   pushed[state['sku']]['item_digest'] != state['item_digest'] or
+                   pushed[state['sku']]['quantity'] != state['quantity']]
+        if not self.dry_run:
+            self.index.put_many(changed)
+        return len(changed)
+
+    def run(self, records):
+        """
+        Args:
+            records (iterable): Listing records, consumed lazily
+
+        Returns:
+            dict: Counts per change, and errors per failed SKU
+        """
+        for chunk in batched(records, INDEX_CHUNK_SIZE):
+            self.process_chunk(chunk)
+
+        return {
+            'counts': self.counts,
+            'failures': self.failures
+        }
+
+    def process_chunk(self, records):
+        pushed = self.index.get_many([record['sku'] for record in records])
+
+        changes = defaultdict(list)
+        for record in records:
+            state = record_state(record, build_inventory_item(record), build_offer(record))
+            change = classify(state, pushed.get(record['sku']))
+            self.counts[change or 'unchanged'] += 1
+            if change:
+                changes[change].append((record, state, pushed.get(record['sku'])))
+
+        if self.dry_run:
+            return
+
+        for batch in batched(changes[NEW], self.batch_size):
+            self._create(batch)
+        for batch in batched(changes[ITEM], self.batch_size):
+            self._replace_items(batch)
+        for record, state, pushed_state in changes[OFFER]:
+            self._update_offer(record, state, pushed_state)
+        for batch in batched(changes[PRICE_QUANTITY], self.batch_size):
+            self._update_price_quantity(batch)
+
+    def _fail(self, sku, stage, errors):
+        self.failures[sku] = {'stage': stage, 'errors': errors}
+
+    def _create(self, batch):
+        try:
+            self.pipeline.process_batch([record for record, _, _ in batch])
+        except EbayAPIError as e:
+            # Stages completed before the call failed are in the journal, the next sync resumes from them
+            self.pipeline.checkpoint.commit()
+            for record, _, _ in batch:
+                self.pipeline.failures.pop(record['sku'], None)
+                self._fail(record['sku'], 'create', [str(e)])
+            return
+
+        states = []
+        for record, state, _ in batch:
+            sku = record['sku']
+            failure = self.pipeline.failures.pop(sku, None)
+            if failure:
+                self._fail(sku, failure['stage'], failure['errors'])
+                continue
+            states.append({**state, 'offer_id': self.pipeline.checkpoint.get(sku, 'offerId'),
+                           'listing_id': self.pipeline.checkpoint.get(sku, 'listingId')})
+        self.index.put_many(states)
+
+    def _replace_items(self, batch):
+        items = [{'sku': record['sku'], 'locale': self.locale, **build_inventory_item(record)}
+                 for record, _, _ in batch]
+        try:
+            responses = {response.get('sku'): response
+                         for response in self.client.bulk_create_or_replace_inventory_item(items)}
+        except EbayAPIError as e:
+            for record, _, _ in batch:
+                self._fail(record['sku'], 'item', [str(e)])
+            return
+
+        states = []
+        for record, state, pushed in batch:
+            response = responses.get(record['sku'], {})
+            if response.get('statusCode') not in (200, 201, 204):
+                self._fail(record['sku'], 'item', format_errors(response.get('errors')))
+            elif classify(state, {**pushed, 'item_digest': state['item_digest'],
+                                  'quantity': state['quantity']}) is not None:
+                # The offer changed too, its update saves the state
+                self._update_offer(record, state, pushed)
+            else:
+                states.append(state)
+        self.index.put_many(states)
+
+    def _update_offer(self, record, state, pushed):
+        sku = record['sku']
+        offer = build_offer(record)
+        offer_id = listing_id = None
+        if pushed and pushed['marketplace_id'] == record['marketplace_id']:
+            offer_id, listing_id = pushed['offer_id'], pushed['listing_id']
+
+        try:
+            published = bool(listing_id)
+            if not offer_id:
+                # Not created by the sync, or on another marketplace before
+                existing = next(self.client.iter_offers(sku, record['marketplace_id']), None)
+                if existing:
+                    offer_id = existing['offerId']
+                    listing_id = existing.get('listing', {}).get('listingId')
+                    published = existing.get('status') == 'PUBLISHED'
+
+            if offer_id:
+                self.client.update_offer(offer_id, offer)
+            else:
+                offer_id = self.client.create_offer(offer)
+            if self.publish and not published:
+                listing_id = self.client.publish_offer(offer_id)
+        except EbayAPIError as e:
+            self._fail(sku, 'offer', [str(e)])
+            return
+
+        self.index.put_many([{**state, 'offer_id': offer_id, 'listing_id': listing_id}])
+
+    def _update_price_quantity(self, batch):
+        updates = []
+        for record, _, pushed in batch:
+            updates.append({
+                'sku': record['sku'],
+                'shipToLocationAvailability': {'quantity': record['quantity']},
+                'offers': [{
+                    'offerId': pushed['offer_id'],
+                    'availableQuantity': record['quantity'],
+                    'price': build_offer(record)['pricingSummary']['price']
+                }]
+            })
+
+        try:
+            responses = self.client.bulk_update_price_quantity(updates)
+        except EbayAPIError as e:
+            for record, _, _ in batch:
+                self._fail(record['sku'], PRICE_QUANTITY, [str(e)])
+            return
+
+        errors = defaultdict(list)
+        answered = set()
+        for response in responses:
+            answered.add(response.get('sku'))
+            if response.get('statusCode') != 200:
+                errors[response.get('sku')] += format_errors(response.get('errors'))
+
+        states = []
+        for record, state, _ in batch:
+            sku = record['sku']
+            if errors[sku] or sku not in answered:
+                self._fail(sku, PRICE_QUANTITY, errors[sku] or ['No response'])
+            else:
+                states.append(state)
+        self.index.put_many(states)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('catalog', help='CSV or JSONL catalog')
+    parser.add_argument('--env', default='sandbox', choices=['sandbox', 'production'])
+    parser.add_argument('--index', help='Sync state database, defaults to .cache/sync/<env>.db')
+    parser.add_argument('--batch-size', type=int, default=BULK_BATCH_SIZE)
+    parser.add_argument('--no-publish', action='store_true', help='Create offers without publishing them')
+    parser.add_argument('--reconcile', action='store_true',
+                        help='Check the index against the inventory items on eBay first')
+    parser.add_argument('--dry-run', action='store_true', help='Only count what would be pushed')
+    args = parser.parse_args()
+
+    index_path = args.index or os.path.join(SYNC_DIR, f"{args.env}.db")
+    index = SyncIndex(index_path)
+    checkpoint_path = f"{os.path.splitext(index_path)[0]}.checkpoint.jsonl"
+    checkpoint = Checkpoint(checkpoint_path)
+
+    client = headless_client(args.env)
+    sync = InventorySync(client, index, checkpoint, batch_size=args.batch_size, publish=not args.no_publish,
+                         dry_run=args.dry_run)
+    try:
+        if args.reconcile:
+            reconciled = sync.reconcile()
+            print(f"Reconciled with eBay: {reconciled['changed']} SKUs changed, {reconciled['deleted']} deleted")
+        report = sync.run(read_catalog(args.catalog))
+    finally:
+        checkpoint.close()
+        index.close()
+
+    for sku, failure in report['failures'].items():
+        print(f"{sku} failed at {failure['stage']}: {'; '.join(failure['errors'])}")
+
+    counts = report['counts']
+    print(f"{'Would push' if args.dry_run else 'Pushed'}: new: {counts[NEW]}, items: {counts[ITEM]}, "
+          f"offers: {counts[OFFER]}, price/quantity: {counts[PRICE_QUANTITY]}, unchanged: {counts['unchanged']}, "
+          f"failed: {len(report['failures'])}")
+
+    # The new SKUs are in the index now, the journal only matters to resume an interrupted sync
+    # A dry run leaves the journal of an interrupted sync for the next real one
+    if not report['failures'] and not args.dry_run:
+        os.remove(checkpoint_path)
+
+    inventory_usage = rate_limiter.metrics()['inventory']
+    print(f"Inventory API calls today: {inventory_usage['used_today']}/{inventory_usage['daily_budget']}, "
+          f"retries: {inventory_usage['retries']}, throttled: {inventory_usage['throttled']}")
+
+    sys.exit(1 if report['failures'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,7 @@
-import json
+import functools
+import mimetypes
 import requests
 import streamlit as st
-from itertools import product
-from json.decoder import JSONDecodeError
 
 import sys
 import os
@@ -10,11 +9,32 @@ import os
 # Add the project root directory to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from lib.session import load_session_state, save_session_state
-from lib.ai import compose_listing
+from publisher import PUBLISH_STEPS, start_workers
+from eBay_async import AsyncEbayAPI
+from lib.session import load_session_state, mark_dirty, save_session_state
+from lib.ai import compose_listing_stream
+from lib.service_client import ServiceError, get_service_client
+from lib.aspect_index import get_aspect_index
+from lib.media import get_media_store
+from lib.pipeline import Pipeline, input_key
+from lib.prefetch import get_aspect_prefetcher
+from lib.jobqueue import DEAD, SUCCEEDED, get_job_queue
+from lib.listing import MARKETPLACE_CURRENCIES, normalize_record
+
+# Aspects with more values than this get a search box instead of the full list
+ASPECT_FULL_LIST_LIMIT = 50
+# Maximum number of matches sent to the browser for a searched aspect
+ASPECT_MATCH_LIMIT = 25
+# Seconds between two checks of the listing preparation progress
+LISTING_PREP_POLL_INTERVAL = 0.5
+# Seconds between two checks of the publishing job progress
+LISTING_JOB_POLL_INTERVAL = 1
 
 # Create a Streamlit form for eBay product listing creation
 def create_listing_form():
+    # The saved listing is only read once the page is opened
+    load_session_state()
+
     # Clear previous categories from session state
     with st.expander("**Listing info**", expanded=True):
     # with st.form("Create eBay Listing"):    
@@ -27,20 +47,19 @@ def create_listing_form():
             
         with col2:
             st.session_state.summary = st.text_area("Summary",st.session_state.get('summary') , height=150)
-        
-        # Generate listing button
+
+        # Generate the copy, suggest categories and load the aspects in the background, once asked for
         if st.button("Generate Listing", disabled=st.session_state.get('auth_state') != 'authorized'):
             if st.session_state.title and st.session_state.manufacturer and st.session_state.summary:
-                try:
-                    listing = compose_listing(st.session_state.title, st.session_state.manufacturer, st.session_state.summary)
-                    st.session_state.gen_title = listing.get('title')
-                    st.session_state.gen_description = listing.get('description')
-
-                except JSONDecodeError as e:
-                    st.error(f"Error with GenAI. Please try again.")
+                start_listing_prep(st.session_state.title, st.session_state.manufacturer, st.session_state.summary)
             else:
                 st.error("Please fill in required fields: Title, Manufacturer, and Summary.")
-        
+
+        if st.session_state.get('_listing_prep') is not None:
+            listing_prep_status()
+        if st.session_state.pop('_listing_prep_error', None):
+            st.error("Error with GenAI. Please try again.")
+
         st.session_state.gen_title = st.text_input("Title", value=st.session_state.get('gen_title', ''))
         st.session_state.gen_description = st.text_area("Description", height=150, value=st.session_state.get('gen_description', ''))
 
@@ -58,7 +77,7 @@ def create_listing_form():
             disabled=st.session_state.get('categories', None) is None or st.session_state.get('auth_state') != 'authorized',
             options=st.session_state.get('categories', []),
             index=st.session_state.get('selected_category_index', 0),
-            format_func=lambda x: f"{x[0]} > {x[2]}"
+            format_func=lambda x: f"{x[0]} > {x[2]}" if x[0] else x[2]
         )
 
         st.session_state.selected_category_id = st.session_state.selected_category[1]
@@ -72,7 +91,7 @@ def create_listing_form():
             st.session_state.weight = st.number_input("Weight", value=st.session_state.get('weight', 0.0) , min_value=0.0, step=0.1)
 
             st.session_state.condition_options = ["New with box", "New without box", "New with defects", "Pre-owned"]
-            condition = st.selectbox(
+            st.session_state.condition = st.selectbox(
                 "Condition",
                 options=st.session_state.get('condition_options', []),
                 index=st.session_state.get('condition_options', []).index(st.session_state.get('condition', 'New with box'))
@@ -88,6 +107,23 @@ def create_listing_form():
             index=st.session_state.get('marketplace_options', []).index(st.session_state.get('marketplace', 'EBAY_US'))
             )
 
+            # The same inventory item is offered on the other marketplaces, each in its own currency
+            other_marketplaces = [marketplace_id for marketplace_id in st.session_state.marketplace_options
+                                  if marketplace_id != st.session_state.marketplace]
+            st.session_state.extra_marketplaces = st.multiselect(
+                "Also publish on",
+                options=other_marketplaces,
+                default=[marketplace_id for marketplace_id in st.session_state.get('extra_marketplaces', [])
+                         if marketplace_id in other_marketplaces]
+            )
+            marketplace_prices = st.session_state.get('marketplace_prices', {})
+            st.session_state.marketplace_prices = {
+                marketplace_id: st.number_input(
+                    f"Price on {marketplace_id} ({MARKETPLACE_CURRENCIES[marketplace_id]})",
+                    value=marketplace_prices.get(marketplace_id, st.session_state.price), min_value=0.0, step=0.01)
+                for marketplace_id in st.session_state.extra_marketplaces
+            }
+
             st.session_state.merchant_location = st.text_input("Merchant Location", value=st.session_state.get('merchant_location', ''))
             st.session_state.fulfillment_policy = st.text_input("Fulfillment Policy", value=st.session_state.get('fulfillment_policy', ''))                        
             st.session_state.return_policy = st.text_input("Return Policy", value=st.session_state.get('return_policy', ''))                                             
@@ -96,7 +132,26 @@ def create_listing_form():
         # Dynamic Aspects Section
         if st.session_state.get('selected_category') and st.session_state.get('auth_state') == 'authorized':
             category_id = st.session_state.selected_category[1]
-            aspects = st.session_state.ebay_client.get_category_aspects(category_id)
+            marketplace_id = selected_marketplace()
+            client = st.session_state.ebay_client
+            load_schema, is_aspects_cached = category_aspects_loader(client)
+
+            # Count each category switch once, not every rerun
+            if st.session_state.get('_aspects_category') != (client.env, marketplace_id, category_id):
+                st.session_state._aspects_category = (client.env, marketplace_id, category_id)
+                outcome = get_aspect_prefetcher().record_use(
+                    (client.env, marketplace_id, category_id),
+                    cached=is_aspects_cached(category_id, marketplace_id=marketplace_id))
+                print(f"Aspects of {category_id}: prefetch {outcome}, "
+                      f"hit rate {get_aspect_prefetcher().stats()['hit_rate']:.0%}")
+
+            try:
+                schema = load_schema(category_id, marketplace_id=marketplace_id)
+                aspects = schema.required_aspects()
+            except Exception as e:
+                st.error(f"Failed to load the aspects of category {category_id} on {marketplace_id}: {e}")
+                schema = None
+                aspects = []
             
             st.subheader("Category Aspects")
 
@@ -104,42 +159,55 @@ def create_listing_form():
                 st.session_state.selected_aspects = {}
 
             for aspect in aspects:
-                # Retrieve the selected aspect values from the session state
-                try:
-                    aspects_index = aspect['values'].index(st.session_state.get('selected_aspects', {}).get(aspect['name']))
-                except ValueError:
-                    aspects_index = 0
+                index = get_aspect_index(
+                    (st.session_state.ebay_client.env, marketplace_id, category_id, aspect['name']), aspect['values'])
+                st.session_state.selected_aspects[aspect['name']] = aspect_picker(
+                    aspect, index, st.session_state.selected_aspects.get(aspect['name']))
+            mark_dirty('selected_aspects')
 
-                st.session_state.selected_aspects[aspect['name']] = st.selectbox(
-                    aspect['name'], options=aspect['values'],
-                    index=aspects_index
-                    )
+            # Category trees and aspect names differ between marketplaces, each one gets its own
+            for extra_marketplace_id in st.session_state.get('extra_marketplaces', []):
+                with st.container(border=True):
+                    st.markdown(f"**Listing on {extra_marketplace_id}**")
+                    marketplace_listing_form(extra_marketplace_id, schema)
 
         st.subheader("Images")
         # Media Section
+        # Images are kept in the media store, the session only holds their digests
+        media_store = get_media_store()
+        uploaded_images = [media_store.put(item.getvalue(), item.name) if hasattr(item, 'getvalue') else item
+                           for item in st.session_state.get('uploaded_images', [])]
+        uploaded_images = [digest for digest in uploaded_images if media_store.exists(digest)]
+
         # Display existing images with remove buttons
         i = 0
-        uploaded_images = st.session_state.get('uploaded_images', [])
         while i < len(uploaded_images):
             col1, col2 = st.columns([3, 1])
             
             with col1:
-                if uploaded_images[i]:
-                    st.image(uploaded_images[i], width=200)
+                st.image(media_store.thumbnail(uploaded_images[i]), width=200)
             
             with col2:
                 if st.button(f"Remove Image {i+1}"):
                     uploaded_images.pop(i)
+                    st.session_state['uploaded_images'] = uploaded_images
                     save_session_state()
                     st.rerun()
             i += 1
 
-        uploaded_file = st.file_uploader("Add New Image", type=['png', 'jpg', 'jpeg'])
+        # A new uploader key after each upload clears it, so a removed image isn't added again
+        uploader_count = st.session_state.get('image_uploader_count', 0)
+        uploaded_file = st.file_uploader("Add New Image", type=['png', 'jpg', 'jpeg'],
+                                         key=f"image_uploader_{uploader_count}",
+                                         disabled=len(uploaded_images) >= 24)
         if uploaded_file:
-            if uploaded_file not in uploaded_images:
-                uploaded_images.append(uploaded_file)
-                save_session_state()
-                st.rerun()
+            digest = media_store.put(uploaded_file.getvalue(), uploaded_file.name)
+            if digest not in uploaded_images:
+                uploaded_images.append(digest)
+            st.session_state['uploaded_images'] = uploaded_images
+            st.session_state['image_uploader_count'] = uploader_count + 1
+            save_session_state()
+            st.rerun()
 
         # Show a message if maximum images reached
         if len(uploaded_images) >= 24:
@@ -151,14 +219,27 @@ def create_listing_form():
         # Video upload
         st.subheader("Video")
 
-        if st.session_state.get('video_file') is None:
-            video_file = st.file_uploader("Product Video",  type=['mp4', 'mov', 'avi'])
+        video_file = st.session_state.get('video_file')
+        if hasattr(video_file, 'getvalue'):
+            video_file = st.session_state.video_file = media_store.put(video_file.getvalue(), video_file.name)
 
-            if video_file:
-                st.session_state.video_file = video_file
+        if video_file is None or not media_store.exists(video_file):
+            st.session_state.video_file = None
+            # Like the image uploader, a new key after each upload clears it, so a removed video isn't added again
+            uploader_count = st.session_state.get('video_uploader_count', 0)
+            uploaded_video = st.file_uploader("Product Video", type=['mp4', 'mov', 'avi'],
+                                              key=f"video_uploader_{uploader_count}")
+            if uploaded_video:
+                st.session_state.video_file = media_store.put(uploaded_video.getvalue(), uploaded_video.name)
+                st.session_state['video_uploader_count'] = uploader_count + 1
+                save_session_state()
+                st.rerun()
 
         if st.session_state.video_file:
-            st.video(st.session_state.get('video_file'))
+            # Stored media files have no extension, the format comes from the uploaded file name
+            filename = media_store.metadata(st.session_state.video_file).get('filename') or ''
+            with open(media_store.path(st.session_state.video_file), 'rb') as f:
+                st.video(f.read(), format=mimetypes.guess_type(filename)[0] or 'video/mp4')
             if st.button("Remove Video"):
                 st.session_state.video_file = None
                 save_session_state()
@@ -166,35 +247,548 @@ def create_listing_form():
 
     # Create listing button
     if st.button("Create Listing", disabled=st.session_state.get('auth_state') != 'authorized'):
-        if title and manufacturer and summary:
-            # Here you would integrate with eBay's Inventory API
-            listing_data = {
-                "title": title,
-                "manufacturer": manufacturer,
-                "category": selected_category if 'selected_category' in locals() else None,
-                "has_image": uploaded_image is not None
-            }
-            st.success("Listing created successfully!")
-            st.json(listing_data)
-            save_session_state()
+        required = {
+            'Title': st.session_state.get('gen_title'),
+            'SKU': st.session_state.get('sku'),
+            'Category': st.session_state.get('selected_category_id'),
+            'Price': st.session_state.get('price')
+        }
+        missing = [name for name, value in required.items() if not value]
+        problems = []
+        if not missing:
+            # Catch what eBay would reject (missing required aspects, values it doesn't accept) before queueing
+            load_schema, _ = category_aspects_loader(st.session_state.ebay_client)
+            try:
+                schema = load_schema(st.session_state.selected_category_id, marketplace_id=selected_marketplace())
+                problems = schema.validate(listing_record()['aspects'])
+            except Exception as e:
+                problems = [f"The aspects of the category could not be loaded: {e}"]
+        if missing:
+            st.error(f"Please fill in required fields: {', '.join(missing)}")
+        elif problems:
+            st.error("Please fix the aspects: " + "; ".join(problems))
+        else:
+            # Publishing runs in the background, the form stays responsive and the job survives reruns
+            try:
+                st.session_state.listing_job_id = submit_listing_job()
+                save_session_state()
+            except (ValueError, ServiceError, requests.RequestException) as e:
+                st.error(f"Failed to queue the listing: {e}")
+
+    if st.session_state.get('listing_job_id'):
+        listing_job_status()
+
+
+def selected_marketplace():
+    """
+    Returns:
+        str: Marketplace of the form, the categories and aspects come from its category tree
+    """
+    return st.session_state.get('marketplace', 'EBAY_US')
+
+
+def form_aspects():
+    """
+    Returns:
+        dict: Aspect name -> list of values picked in the form
+    """
+    return {name: [value] for name, value in st.session_state.get('selected_aspects', {}).items() if value}
+
+
+def marketplace_listing_form(marketplace_id, source_schema):
+    """
+    Pick the category and aspects of the listing on another marketplace. Categories
+    are suggested for the product in its category tree, and the aspects start from
+    the form's, mapped to the schema of the category (see CategorySchema.map_aspects)
+
+    Args:
+        marketplace_id (str): Other marketplace
+        source_schema (CategorySchema): Schema of the category of the form, None if it couldn't be loaded
+
+    Returns:
+        dict: category_id and aspects, or None if no category is available
+    """
+    client = st.session_state.ebay_client
+    query = f"{st.session_state.get('title') or ''} {st.session_state.get('manufacturer') or ''}".strip()
+    suggested = st.session_state.setdefault('marketplace_categories', {})
+    if suggested.get(marketplace_id, (None, []))[0] != query:
+        try:
+            suggestions = category_suggester().get_category_suggestions(query, marketplace_id=marketplace_id)
+        except Exception as e:
+            st.error(f"Failed to suggest {marketplace_id} categories: {e}")
+            return None
+        suggested[marketplace_id] = (query, suggestions_to_categories(suggestions))
+        mark_dirty('marketplace_categories')
+
+    categories = suggested[marketplace_id][1]
+    if not categories:
+        st.caption(f"No {marketplace_id} category found for \"{query}\"")
+        return None
+
+    listings = st.session_state.setdefault('marketplace_listings', {})
+    listing = listings.get(marketplace_id, {})
+    category_ids = [category[1] for category in categories]
+    category_id = st.selectbox(
+        f"Category on {marketplace_id}",
+        options=categories,
+        index=category_ids.index(listing['category_id']) if listing.get('category_id') in category_ids else 0,
+        format_func=lambda x: f"{x[0]} > {x[2]}" if x[0] else x[2],
+        key=f"category_{marketplace_id}"
+    )[1]
+
+    load_schema, _ = category_aspects_loader(client)
+    try:
+        schema = load_schema(category_id, marketplace_id=marketplace_id)
+    except Exception as e:
+        st.error(f"Failed to load the aspects of category {category_id} on {marketplace_id}: {e}")
+        return None
+
+    mapped = {name: values for name, values in
+              (schema.map_aspects(form_aspects(), source_schema) if source_schema else {}).items() if values}
+    picked = listing.get('aspects', {}) if listing.get('category_id') == category_id else {}
+    aspects = dict(mapped)
+    for aspect in schema.required_aspects():
+        name = aspect['name']
+        index = get_aspect_index((client.env, marketplace_id, category_id, name), aspect['values'])
+        value = aspect_picker(aspect, index, (picked.get(name) or mapped.get(name) or [None])[0],
+                              key=f"{marketplace_id}_{name}")
+        if value:
+            aspects[name] = [value]
         else:
-            st.error("Please fill in required fields: Title and Manufacturer")    
+            aspects.pop(name, None)
+
+    listings[marketplace_id] = {'category_id': category_id, 'aspects': aspects}
+    mark_dirty('marketplace_listings')
+    return listings[marketplace_id]
+
+
+def listing_record():
+    """
+    Returns:
+        dict: Listing record of the form (see lib.listing.normalize_record)
+    """
+    marketplace_id = selected_marketplace()
+    return normalize_record({
+        'sku': st.session_state.sku,
+        'title': st.session_state.gen_title,
+        'description': st.session_state.get('gen_description', ''),
+        'aspects': form_aspects(),
+        'condition': st.session_state.get('condition'),
+        'quantity': st.session_state.get('quantity', 1),
+        'price': st.session_state.price,
+        'currency': MARKETPLACE_CURRENCIES.get(marketplace_id, 'USD'),
+        'category_id': st.session_state.selected_category_id,
+        'marketplace_id': marketplace_id,
+        'merchant_location': st.session_state.get('merchant_location', ''),
+        'fulfillment_policy': st.session_state.get('fulfillment_policy', ''),
+        'payment_policy': st.session_state.get('payment_policy', ''),
+        'return_policy': st.session_state.get('return_policy', '')
+    })
+
+
+def submit_listing_job():
+    """
+    Queue the publishing of the listing of the form, on the listing service if
+    LISTING_SERVICE_URL is set, otherwise on the local job queue. While a job for
+    the same SKU is queued or running, it is returned instead of queuing another one.
+    
+    Returns:
+        str: Job ID
+    """
+    client = st.session_state.ebay_client
+    record = listing_record()
+    extra_marketplaces = st.session_state.get('extra_marketplaces', [])
+    prices = {marketplace_id: price for marketplace_id, price in
+              st.session_state.get('marketplace_prices', {}).items() if marketplace_id in extra_marketplaces}
+    marketplace_listings = {marketplace_id: listing for marketplace_id, listing in
+                            st.session_state.get('marketplace_listings', {}).items()
+                            if marketplace_id in extra_marketplaces}
+    images = st.session_state.get('uploaded_images', [])
+    video = st.session_state.get('video_file')
+
+    service = get_service_client()
+    if service is not None:
+        store = get_media_store()
+        for digest in [*images, *([video] if video else [])]:
+            service.upload_media(store, digest)
+        return service.submit_listing(record, client.user_token['refresh_token'], env=client.env,
+                                      marketplaces=extra_marketplaces, prices=prices,
+                                      marketplace_listings=marketplace_listings, images=images, video=video)
+
+    start_workers()
+    return get_job_queue().submit('publish_listing', {
+        'env': client.env,
+        'refresh_token': client.user_token['refresh_token'],
+        'publish': True,
+        'record': record,
+        'marketplaces': [record['marketplace_id'], *extra_marketplaces],
+        'prices': prices,
+        'marketplace_listings': marketplace_listings,
+        'images': images,
+        'video': video
+    }, dedupe_key=f"{client.env}:{record['sku']}")
+
+
+def listing_job(job_id):
+    """
+    Returns:
+        dict: Publishing job from the listing service if LISTING_SERVICE_URL is set, otherwise from the local
+            queue, None if it doesn't exist
+    """
+    service = get_service_client()
+    return get_job_queue().get(job_id) if service is None else service.get_job(job_id)
+
+
+def requeue_listing_job(job_id):
+    # Dead-lettered jobs no longer hold the seller's refresh token
+    refresh_token = st.session_state.ebay_client.user_token['refresh_token']
+    service = get_service_client()
+    if service is None:
+        get_job_queue().requeue(job_id, {'refresh_token': refresh_token})
+    else:
+        service.requeue_job(job_id, refresh_token)
+
+
+@st.fragment(run_every=LISTING_JOB_POLL_INTERVAL)
+def listing_job_status():
+    """
+    Show the progress of the publishing job, until it is done
+    """
+    if get_service_client() is None:
+        # Jobs left by an earlier run of the app (e.g. before a restart) are resumed
+        start_workers()
+
+    try:
+        job = listing_job(st.session_state.listing_job_id)
+    except (ServiceError, requests.RequestException) as e:
+        st.caption(f"Failed to get the publishing progress: {e}")
+        return
+    if job is None:
+        st.session_state.listing_job_id = None
+        return
+
+    step = job['progress'].get('step')
+    marketplaces = (job['result'] or {}).get('marketplaces') or job['progress'].get('marketplaces')
+    if job['status'] == SUCCEEDED and not marketplaces:
+        st.success(f"Listing {job['result'].get('listing_id')} published (offer {job['result'].get('offer_id')}).")
+    elif job['status'] == SUCCEEDED:
+        failed = [marketplace_id for marketplace_id, result in marketplaces.items() if 'error' in result]
+        waiting = [marketplace_id for marketplace_id in failed if marketplaces[marketplace_id].get('needs_input')]
+        if failed:
+            st.warning(f"Published on {len(marketplaces) - len(failed)} of {len(marketplaces)} marketplaces.")
+        else:
+            st.success(f"Published on {len(marketplaces)} marketplaces.")
+        if waiting:
+            st.info(f"Pick the category and aspects of {', '.join(waiting)} in the form, then create the listing again.")
+    elif job['status'] == DEAD:
+        st.error(f"Publishing failed after {job['attempts']} attempts: {job['error']}")
+        if st.button("Retry publishing"):
+            requeue_listing_job(job['id'])
+    else:
+        done = PUBLISH_STEPS.index(step) + 1 if step else 0
+        st.progress(done / len(PUBLISH_STEPS),
+                    text=f"Publishing ({job['status']}, step: {step or 'starting'}, attempt {max(job['attempts'], 1)})")
+        if job['error']:
+            st.caption(f"Last error: {job['error']}")
+
+    if marketplaces:
+        st.dataframe([{
+            'Marketplace': marketplace_id,
+            'Category': result.get('category_id'),
+            'Offer': result.get('offer_id'),
+            'Listing': result.get('listing_id'),
+            'Error': result.get('error')
+        } for marketplace_id, result in marketplaces.items()], hide_index=True)
+
+
+def aspect_picker(aspect, index, selected=None, key=None):
+    """
+    Display a picker for an aspect, sending only the matching values to the browser
     
+    Args:
+        aspect (dict): Aspect details (name, data_type, mode, values)
+        index (AspectValueIndex): Index over the aspect values
+        selected (str): Previously selected value
+        key (str): Widget key, when the same aspect is picked more than once on the page
+        
+    Returns:
+        str: The selected value
+    """
+    free_text = aspect.get('mode') == 'FREE_TEXT'
+    widget_key = f"aspect_{key}" if key else None
+
+    # Aspects without predefined values can only be typed
+    if not len(index):
+        return st.text_input(aspect['name'], value=selected or '', key=widget_key)
+
+    # Small value lists are shown in full
+    if len(index) <= ASPECT_FULL_LIST_LIMIT and not free_text:
+        position = index.position(selected)
+        return st.selectbox(aspect['name'], options=index.values, index=position or 0, key=widget_key)
+
+    query = st.text_input(f"Search {aspect['name']}", key=f"aspect_query_{key or aspect['name']}",
+                          placeholder="Type to search" + (" or enter a custom value" if free_text else ""))
+    query = query.strip()
+    options = index.search(query, limit=ASPECT_MATCH_LIMIT)
+
+    # FREE_TEXT aspects accept values that aren't in eBay's list. The typed value
+    # goes first unless known values still start with it (the user is completing one)
+    if free_text and query and index.lookup(query) is None:
+        if options and options[0].casefold().startswith(query.casefold()):
+            options.append(query)
+        else:
+            options.insert(0, query)
+
+    # Keep the current selection available while searching
+    if selected and selected not in options:
+        options.append(selected)
+
+    if not options:
+        st.caption(f"No {aspect['name']} values match \"{query}\"")
+        return selected
+
+    # While searching, preselect the best match, otherwise keep the current selection
+    default = options[0] if query or selected not in options else selected
+
+    return st.selectbox(aspect['name'], options=options, index=options.index(default), key=widget_key)
+
 def display_suggestions(title, manufacturer, categories=None):
     if not categories:
         search_query = f"{title} {manufacturer}".strip()
         # Verify ebay_production has a valid user token
-        if not st.session_state.ebay_production.app_token:
+        if get_service_client() is None and not st.session_state.ebay_production.app_token:
             st.error("App token is not available. Please log in.")
             return
 
         try:
-            suggestions = st.session_state.ebay_production.get_category_suggestions(search_query)
+            suggestions = category_suggester().get_category_suggestions(search_query,
+                                                                         marketplace_id=selected_marketplace())
         except ValueError as ve:
             st.error(f"Error: {ve}")
             return
         
         if 'categorySuggestions' in suggestions:
-            st.session_state.categories = [(suggestion['categoryTreeNodeAncestors'][0]['categoryName'],
-            suggestion['category']['categoryId'],
-            suggestion['category']['categoryName']) for suggestion in suggestions['categorySuggestions']]
+            st.session_state.categories = suggestions_to_categories(suggestions)
+            prefetch_aspects(st.session_state.categories)
+
+
+def suggestions_to_categories(suggestions):
+    """
+    Convert category suggestions to the options of the category selectbox
+    
+    Args:
+        suggestions (dict): getCategorySuggestions response
+        
+    Returns:
+        list: (ancestor path, category ID, category name) tuples, e.g.
+        ("Clothing, Shoes & Accessories > Men > Men's Clothing > Shirts", "15687", "T-Shirts")
+    """
+    # Ancestors come nearest first, the whole path is in the response so the selectbox needs no tree lookup
+    return [(' > '.join(ancestor['categoryName'] for ancestor in reversed(suggestion.get('categoryTreeNodeAncestors', []))),
+             suggestion['category']['categoryId'],
+             suggestion['category']['categoryName']) for suggestion in suggestions.get('categorySuggestions', [])]
+
+
+def listing_composer():
+    """
+    Returns:
+        callable: compose_listing_stream of the listing service if LISTING_SERVICE_URL is set, otherwise the local one
+    """
+    service = get_service_client()
+    return service.compose_listing_stream if service else compose_listing_stream
+
+
+def category_suggester():
+    """
+    Returns:
+        The listing service if LISTING_SERVICE_URL is set, otherwise the production eBay client
+    """
+    return get_service_client() or st.session_state.ebay_production
+
+
+def category_aspects_loader(client):
+    """
+    Get the functions loading the aspect schema of a category for the environment of a client,
+    through the listing service if LISTING_SERVICE_URL is set
+    
+    Args:
+        client (EbayAPI): Client of the environment
+        
+    Returns:
+        tuple: get_category_schema and is_category_aspects_cached functions
+    """
+    service = get_service_client()
+    if service is None:
+        return client.get_category_schema, client.is_category_aspects_cached
+    return (functools.partial(service.get_category_schema, env=client.env),
+            functools.partial(service.is_category_aspects_cached, env=client.env))
+
+
+def prefetch_aspects(categories):
+    """
+    Load the aspects of the top suggested categories in the background, so
+    switching between them in the selectbox doesn't wait for eBay
+    
+    Args:
+        categories (list): Suggested categories, most relevant first
+    """
+    client = st.session_state.ebay_client
+    marketplace_id = selected_marketplace()
+    load_schema, is_aspects_cached = category_aspects_loader(client)
+    get_aspect_prefetcher().prefetch(
+        [(client.env, marketplace_id, category[1]) for category in categories],
+        async_schema_loader(client) if get_service_client() is None else
+        lambda key: load_schema(key[2], marketplace_id=key[1]),
+        is_cached=lambda key: is_aspects_cached(key[2], marketplace_id=key[1]))
+
+
+# Async clients of the prefetcher's event loop, per environment and application
+_async_clients = {}
+
+
+def async_schema_loader(client):
+    """
+    Get a coroutine function loading the aspect schema of a prefetch key with
+    AsyncEbayAPI, so the prefetches of every session share one event loop and its
+    concurrency limits. The schemas land in the caches EbayAPI reads.
+
+    Args:
+        client (EbayAPI): Client of the environment
+
+    Returns:
+        callable: Coroutine function of an (env, marketplace_id, category_id) key
+    """
+    async def load(key):
+        # Only ever run on the prefetcher's event loop, the clients are bound to it
+        async_client = _async_clients.get((client.env, client.client_id))
+        if async_client is None:
+            async_client = _async_clients[(client.env, client.client_id)] = AsyncEbayAPI.from_client(client)
+        await async_client.get_app_token()
+        await async_client.get_category_schema(key[2], marketplace_id=key[1])
+
+    return load
+
+
+def start_listing_prep(title, manufacturer, summary):
+    """
+    Start generating the listing copy, suggesting categories and loading the
+    aspects of the top suggestion concurrently
+
+    A run still going for the same inputs is kept, one for other inputs is cancelled.
+    The run lives in a private session key, so it is not persisted.
+    
+    Args:
+        title (str): Product title
+        manufacturer (str): Manufacturer
+        summary (str): Product summary
+        
+    Returns:
+        Pipeline: The run for these inputs
+    """
+    marketplace_id = selected_marketplace()
+    key = input_key(title, manufacturer, summary, st.session_state.ebay_client.env, marketplace_id)
+
+    run = st.session_state.get('_listing_prep')
+    if run is not None:
+        if run.key == key and not run.done:
+            return run
+        run.cancel()
+
+    # The copy as the run starts: if the seller edits it meanwhile, the edit is kept
+    st.session_state._listing_prep_base = {field: st.session_state.get(field)
+                                           for field in ('gen_title', 'gen_description')}
+
+    # Tasks run outside the script thread, they must not touch the session state
+    load_schema, _ = category_aspects_loader(st.session_state.ebay_client)
+    run = build_listing_prep(key, title, manufacturer, summary, listing_composer(), category_suggester(), load_schema,
+                             marketplace_id=marketplace_id)
+    st.session_state._listing_prep = run.start()
+    return run
+
+
+def build_listing_prep(key, title, manufacturer, summary, compose, suggester, load_aspects, marketplace_id='EBAY_US'):
+    """
+    Build the listing preparation tasks: listing copy, category suggestions, and
+    the aspects of the top suggestion once the suggestions are in
+    
+    Args:
+        key (str): Input key of the run
+        title (str): Product title
+        manufacturer (str): Manufacturer
+        summary (str): Product summary
+        compose (callable): Streams the generated listing
+        suggester: Client with get_category_suggestions
+        load_aspects (callable): Loads the aspect schema of a category
+        marketplace_id (str): Marketplace whose category tree the categories and aspects come from
+        
+    Returns:
+        Pipeline: The run, not started yet
+    """
+    run = Pipeline(key)
+
+    def listing():
+        partial = None
+        for partial in compose(title, manufacturer, summary):
+            if run.cancelled:
+                return None
+            run.report('listing', partial)
+        if partial is None:
+            # e.g. the listing service closed the stream before sending anything
+            raise ValueError("No listing was generated")
+        return partial
+
+    def categories():
+        return suggestions_to_categories(suggester.get_category_suggestions(f"{title} {manufacturer}".strip(),
+                                                                            marketplace_id=marketplace_id))
+
+    def aspects(categories):
+        # Loads the aspects into the cache the form reads them from
+        return load_aspects(categories[0][1], marketplace_id=marketplace_id) if categories else None
+
+    return run.add('listing', listing).add('categories', categories).add('aspects', aspects, deps=('categories',))
+
+
+@st.fragment(run_every=LISTING_PREP_POLL_INTERVAL)
+def listing_prep_status():
+    """
+    Show the progress of the listing preparation, and merge its results into the form once it is done
+    """
+    run = st.session_state.get('_listing_prep')
+    if run is None:
+        return
+
+    if not run.done:
+        partial = run.progress.get('listing') or {}
+        st.info("Preparing listing... " + ", ".join(f"{name}: {status}" for name, status in run.status.items()))
+        if partial.get('title'):
+            st.markdown(f"**{partial['title']}**")
+        if partial.get('description'):
+            st.write(partial['description'])
+        return
+
+    st.session_state._listing_prep = None
+    if run.cancelled:
+        return
+
+    base = st.session_state.pop('_listing_prep_base', {})
+    listing = run.results.get('listing')
+    if listing:
+        for field, value in (('gen_title', listing.get('title')), ('gen_description', listing.get('description'))):
+            if st.session_state.get(field) == base.get(field):
+                st.session_state[field] = value
+
+    if run.results.get('categories'):
+        st.session_state.categories = run.results['categories']
+        st.session_state.selected_category_index = 0
+        prefetch_aspects(st.session_state.categories)
+
+    for name, error in run.errors.items():
+        print(f"Listing preparation {name} failed: {error}")
+    if 'listing' in run.errors:
+        st.session_state._listing_prep_error = True
+
+    print(f"Listing prepared in {run.elapsed:.2f}s (" +
+          ", ".join(f"{name} {timing:.2f}s" for name, timing in run.timings.items()) + ")")
+
+    save_session_state()
+    st.rerun(scope='app')
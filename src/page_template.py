@@ -1,5 +1,12 @@
 import streamlit as st
 
+import sys
+import os
+
+# Add the project root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from lib.metrics import get_metrics
+
 # Define the unified header
 def header():
     st.markdown("""
@@ -29,3 +36,46 @@ def navigation():
         </div>
         <hr>
     """, unsafe_allow_html=True)
+
+# Define the performance panel
+
+def performance_panel(rerun_span):
+    """
+    Show where the time of the last rerun went, and the latency, cache and transfer metrics of the process
+
+    Args:
+        rerun_span (Span): The finished span of this rerun
+    """
+    metrics = get_metrics()
+    snapshot = metrics.to_json()
+
+    with st.expander(f"Performance: rerun took {rerun_span.duration * 1000:.0f} ms"):
+        st.caption("This rerun")
+        st.dataframe([{
+            'span': ' ' * depth + name,
+            'labels': ', '.join(f"{key}={value}" for key, value in labels.items()),
+            'start (ms)': round(offset * 1000, 1),
+            'duration (ms)': round(duration * 1000, 1)
+        } for depth, name, labels, offset, duration in rerun_span.trace()], hide_index=True)
+
+        st.caption("Latency since the process started")
+        st.dataframe([{
+            'metric': histogram['name'],
+            'labels': ', '.join(f"{key}={value}" for key, value in histogram['labels'].items()),
+            'count': histogram['count'],
+            'mean (ms)': round(histogram['sum'] / histogram['count'] * 1000, 1),
+            'p50 (ms)': round(histogram['p50'] * 1000, 1),
+            'p95 (ms)': round(histogram['p95'] * 1000, 1),
+            'p99 (ms)': round(histogram['p99'] * 1000, 1)
+        } for histogram in snapshot['histograms'] if histogram['count']], hide_index=True)
+
+        st.caption("Counters and caches")
+        st.dataframe([{
+            'metric': metric['name'],
+            'labels': ', '.join(f"{key}={value}" for key, value in metric['labels'].items()),
+            'value': metric['value']
+        } for metric in snapshot['counters'] + snapshot['gauges']], hide_index=True)
+
+        col1, col2 = st.columns(2)
+        col1.download_button("Prometheus metrics", metrics.to_prometheus(), file_name='metrics.prom', mime='text/plain')
+        col2.download_button("JSON metrics", metrics.dumps(), file_name='metrics.json', mime='application/json')
@@ -0,0 +1,403 @@
+"""
+Background publishing of listings.
+
+Listings are published by jobs of the durable job queue (.cache/jobs): the
+Streamlit app and the listing service only queue them. Every process using
+the queue can run workers, and this script runs more of them on their own.
+
+Usage:
+    python src/publisher.py [--workers 8]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from eBay import EbayAPI, EbayAPIError
+from bulk_lister import BulkListingPipeline, Checkpoint, batched, headless_client
+
+# Add the project root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from lib.jobqueue import PermanentJobError, WorkerPool, get_job_queue
+from lib.listing import build_inventory_item, build_offer
+from lib.media import get_media_store, upload_images, upload_video
+
+# Worker threads per process
+PUBLISH_WORKERS = 4
+
+# Steps of a listing job in order, saved in the job progress as they complete
+PUBLISH_STEPS = ('media', 'item', 'offer', 'published')
+
+# Marketplaces of a listing resolved and published at the same time
+MARKETPLACE_WORKERS = 8
+
+
+def job_client(payload):
+    try:
+        return headless_client(payload['env'], payload['refresh_token'])
+    except ValueError as e:
+        # Without a valid refresh token, retrying can't succeed
+        raise PermanentJobError(str(e))
+
+
+def suggestion_client():
+    # Category suggestions always come from production, whatever the environment of the job
+    client = EbayAPI(**EbayAPI.load_credentials(env='production'), env='production')
+    client.get_app_token()
+    return client
+
+
+def is_permanent(error):
+    # Throttling and server errors were already retried by the client, other client errors won't go away
+    if isinstance(error, EbayAPIError):
+        return 400 <= error.status_code < 500 and error.status_code != 429
+    return isinstance(error, PermanentJobError)
+
+
+def step_done(job, step):
+    reached = job.progress.get('step')
+    return reached is not None and PUBLISH_STEPS.index(reached) >= PUBLISH_STEPS.index(step)
+
+
+def publish_listing(payload, job):
+    """
+    Job handler creating and publishing one listing: media upload, inventory item, offer, publish
+
+    Steps completed by an earlier attempt are skipped, and each step is
+    idempotent per SKU, so a retried or taken over job never creates a second
+    offer or listing.
+
+    Args:
+        payload (dict): env, refresh_token, publish, the listing record, the
+            digests of its images and video in the media store, and optionally the
+            marketplaces to publish on with their prices, categories and aspects
+        job (JobContext): Progress of earlier attempts
+
+    Returns:
+        dict: SKU, offer ID and listing ID, or the results per marketplace
+    """
+    client = job_client(payload)
+    record = payload['record']
+    marketplaces = payload.get('marketplaces') or [record['marketplace_id']]
+
+    try:
+        if not step_done(job, 'media'):
+            store = get_media_store()
+            image_urls = upload_images(client, store, payload.get('images', []))
+            video_ids = [upload_video(client, store, payload['video'], record['title'])] if payload.get('video') else []
+            job.update(step='media', image_urls=image_urls, video_ids=video_ids)
+
+        record = {**record,
+                  'image_urls': record['image_urls'] + job.progress['image_urls'],
+                  'video_ids': record.get('video_ids', []) + job.progress['video_ids']}
+
+        if not step_done(job, 'item'):
+            client.create_or_replace_inventory_item(record['sku'], build_inventory_item(record))
+            job.update(step='item')
+
+        if marketplaces != [record['marketplace_id']]:
+            return publish_marketplaces(client, payload, job, record, marketplaces)
+
+        if not step_done(job, 'offer'):
+            offer = build_offer(record)
+            # An offer created by an attempt that stopped before saving its progress is updated, not duplicated
+            existing = client.get_offers(record['sku'], record['marketplace_id'])
+            if existing:
+                offer_id = existing[0]['offerId']
+                client.update_offer(offer_id, offer)
+            else:
+                offer_id = client.create_offer(offer)
+            job.update(step='offer', offer_id=offer_id)
+
+        if payload.get('publish', True) and not step_done(job, 'published'):
+            listing_id = client.publish_offer(job.progress['offer_id'])
+            job.update(step='published', listing_id=listing_id)
+
+    except EbayAPIError as e:
+        if is_permanent(e):
+            raise PermanentJobError(str(e))
+        raise
+
+    return {
+        'sku': record['sku'],
+        'offer_id': job.progress.get('offer_id'),
+        'listing_id': job.progress.get('listing_id')
+    }
+
+
+class ListingInputError(Exception):
+    """
+    Raised when a marketplace needs a category or aspects from the seller: retrying
+    can't help, publishing again with them in the form can
+    """
+    pass
+
+
+def resolve_marketplace(client, suggester, record, marketplace_id, listing=None):
+    """
+    Resolve the category and aspects of a listing on a marketplace
+
+    On its own marketplace the record is used as it is. On the others, the
+    category and aspects the seller picked in the form are used, otherwise the
+    top suggestion for the title and the record's aspects mapped to the schema
+    of that category by name (see CategorySchema.map_aspects).
+
+    Args:
+        client (EbayAPI): Client of the job
+        suggester (EbayAPI): Production client suggesting the categories of the other marketplaces
+        record (dict): Listing record
+        marketplace_id (str): Target marketplace ID
+        listing (dict): category_id and aspects picked for the marketplace
+
+    Returns:
+        dict: Category ID and aspects
+    """
+    if marketplace_id == record['marketplace_id']:
+        return {'category_id': record['category_id'], 'aspects': record['aspects']}
+
+    listing = listing or {}
+    category_id = listing.get('category_id')
+    if not category_id:
+        suggestions = suggester.get_category_suggestions(record['title'], marketplace_id=marketplace_id)
+        categories = suggestions.get('categorySuggestions') or []
+        if not categories:
+            raise ListingInputError(f"No {marketplace_id} category found for {record['title']}")
+        category_id = categories[0]['category']['categoryId']
+
+    schema = client.get_category_schema(category_id, marketplace_id)
+    aspects = listing.get('aspects') or schema.map_aspects(
+        record['aspects'], client.get_category_schema(record['category_id'], record['marketplace_id']))
+
+    problems = schema.validate(aspects)
+    if problems:
+        raise ListingInputError(f"Category {category_id}: {'; '.join(problems)}")
+    return {'category_id': category_id, 'aspects': aspects}
+
+
+def merge_aspects(record, resolved):
+    """
+    Merge the aspects of every marketplace into those of the record, for the one
+    inventory item all the offers share
+
+    Args:
+        record (dict): Listing record
+        resolved (dict): Marketplace ID -> result with its aspects, in priority order
+
+    Returns:
+        tuple: (merged aspects, marketplace IDs whose aspects conflict with those merged before them)
+    """
+    merged = dict(record['aspects'])
+    conflicts = []
+    for marketplace_id, result in resolved.items():
+        aspects = result['aspects']
+        if any(name in merged and merged[name] != values for name, values in aspects.items()):
+            conflicts.append(marketplace_id)
+            continue
+        merged.update(aspects)
+    return merged, conflicts
+
+
+def marketplace_offer(client, record, marketplace_id, category_id, price=None, publish=True):
+    """
+    Create or update, then publish, the offer of the listing's inventory item on one marketplace
+
+    Every marketplace gets its own offer on the same inventory item, so they all
+    sell from the same quantity.
+
+    Args:
+        client (EbayAPI): Client of the job
+        record (dict): Listing record
+        marketplace_id (str): Target marketplace ID
+        category_id (str): Category in the tree of that marketplace
+        price (float): Price in the currency of the marketplace, required on the other marketplaces
+        publish (bool): Publish the offer
+
+    Returns:
+        dict: Offer ID and listing ID
+    """
+    if marketplace_id != record['marketplace_id'] and price is None:
+        raise ListingInputError(f"No {marketplace_id} price given")
+
+    offer = build_offer(record, marketplace_id=marketplace_id, category_id=category_id, price=price)
+    existing = client.get_offers(record['sku'], marketplace_id)
+    if existing:
+        offer_id = existing[0]['offerId']
+        client.update_offer(offer_id, offer)
+    else:
+        offer_id = client.create_offer(offer)
+
+    return {
+        'offer_id': offer_id,
+        'listing_id': client.publish_offer(offer_id) if publish else None
+    }
+
+
+def _failure(error):
+    return {'error': str(error), 'permanent': is_permanent(error), 'needs_input': isinstance(error, ListingInputError)}
+
+
+def publish_marketplaces(client, payload, job, record, marketplaces):
+    """
+    Publish a listing on several marketplaces at once
+
+    Each marketplace resolves its category tree, category, schema and aspects in
+    its own thread. The aspects of all of them are then merged into the one
+    inventory item of the listing, and each marketplace submits its offer on it.
+    Results are saved in the job progress as they arrive. Marketplaces done by an
+    earlier attempt, rejected by eBay, or waiting for the seller's category,
+    aspects or price are skipped when the job is retried; the others are retried.
+
+    Args:
+        client (EbayAPI): Client of the job
+        payload (dict): Job payload, with the prices, categories and aspects per marketplace
+        job (JobContext): Progress of earlier attempts
+        record (dict): Listing record with its uploaded media
+        marketplaces (list): Target marketplace IDs
+
+    Returns:
+        dict: SKU and the result of each marketplace (category, aspects, offer and listing IDs, or error)
+    """
+    results = dict(job.progress.get('marketplaces', {}))
+    pending = [marketplace_id for marketplace_id in marketplaces
+               if 'offer_id' not in results.get(marketplace_id, {}) and
+               not results.get(marketplace_id, {}).get('permanent') and
+               not results.get(marketplace_id, {}).get('needs_input')]
+
+    if pending:
+        client.get_app_token()
+        suggester = suggestion_client() if set(pending) - {record['marketplace_id']} else None
+        prices = payload.get('prices', {})
+        listings = payload.get('marketplace_listings', {})
+
+        with ThreadPoolExecutor(max_workers=min(MARKETPLACE_WORKERS, len(pending))) as executor:
+            futures = {executor.submit(resolve_marketplace, client, suggester, record, marketplace_id,
+                                       listings.get(marketplace_id)): marketplace_id
+                       for marketplace_id in pending}
+            for future in as_completed(futures):
+                marketplace_id = futures[future]
+                try:
+                    results[marketplace_id] = future.result()
+                except Exception as e:
+                    print(f"Resolving {record['sku']} on {marketplace_id} failed: {e}")
+                    results[marketplace_id] = _failure(e)
+            job.update(marketplaces=results)
+
+            # Marketplaces published by earlier attempts keep their aspects, the new ones must agree with them
+            resolved = {marketplace_id: results[marketplace_id] for marketplace_id in
+                        sorted(marketplaces, key=lambda marketplace_id: marketplace_id in pending)
+                        if 'aspects' in results[marketplace_id]}
+            aspects, conflicts = merge_aspects(record, resolved)
+            for marketplace_id in conflicts:
+                results[marketplace_id] = _failure(ListingInputError(
+                    f"The {marketplace_id} aspects conflict with those of the other marketplaces"))
+
+            ready = [marketplace_id for marketplace_id in pending if 'aspects' in results[marketplace_id]]
+            if ready and aspects != record['aspects']:
+                client.create_or_replace_inventory_item(record['sku'], build_inventory_item({**record,
+                                                                                             'aspects': aspects}))
+
+            futures = {executor.submit(marketplace_offer, client, record, marketplace_id,
+                                       results[marketplace_id]['category_id'], prices.get(marketplace_id),
+                                       payload.get('publish', True)): marketplace_id
+                       for marketplace_id in ready}
+            for future in as_completed(futures):
+                marketplace_id = futures[future]
+                try:
+                    results[marketplace_id] = {**results[marketplace_id], **future.result()}
+                except Exception as e:
+                    print(f"Publishing {record['sku']} on {marketplace_id} failed: {e}")
+                    results[marketplace_id] = _failure(e)
+                # The job progress is only saved from this thread
+                job.update(marketplaces=results)
+
+    failed = [marketplace_id for marketplace_id in marketplaces if 'error' in results[marketplace_id]]
+    retryable = [marketplace_id for marketplace_id in failed
+                 if not results[marketplace_id]['permanent'] and not results[marketplace_id].get('needs_input')]
+    if retryable:
+        raise RuntimeError(f"Publishing failed on {', '.join(retryable)}: "
+                           f"{results[retryable[0]]['error']}")
+    if len(failed) == len(marketplaces) and all(results[marketplace_id]['permanent'] for marketplace_id in failed):
+        raise PermanentJobError(f"Publishing failed on every marketplace: {results[failed[0]]['error']}")
+
+    # Marketplaces waiting for the seller are listed in the result, publishing the form again completes them
+    job.update(step='published')
+    return {
+        'sku': record['sku'],
+        'marketplaces': {marketplace_id: results[marketplace_id] for marketplace_id in marketplaces}
+    }
+
+
+def publish_listings(payload, job):
+    """
+    Job handler creating (and publishing) many listings with the bulk calls
+
+    Args:
+        payload (dict): env, publish, refresh_token, checkpoint path and the listing records
+        job (JobContext): Used to report the counts after each batch
+
+    Returns:
+        dict: Counts per stage, skipped SKUs and errors per failed SKU
+    """
+    client = job_client(payload)
+    # The checkpoint makes the job resumable: SKUs done by an earlier attempt are skipped
+    checkpoint = Checkpoint(payload['checkpoint'])
+    pipeline = BulkListingPipeline(client, checkpoint, publish=payload['publish'])
+    try:
+        for batch in batched(payload['records'], pipeline.batch_size):
+            pipeline.process_batch(batch)
+            job.update(counts=pipeline.counts, skipped=pipeline.skipped, failed=len(pipeline.failures))
+    finally:
+        checkpoint.close()
+
+    return {
+        'counts': pipeline.counts,
+        'skipped': pipeline.skipped,
+        'failures': pipeline.failures
+    }
+
+
+JOB_HANDLERS = {
+    'publish_listing': publish_listing,
+    'publish_listings': publish_listings
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def start_workers(workers=PUBLISH_WORKERS):
+    """
+    Start the publishing workers of this process, once
+
+    Returns:
+        WorkerPool: The running pool
+    """
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = WorkerPool(get_job_queue(), JOB_HANDLERS, workers=workers)
+                _pool.start()
+    return _pool
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=PUBLISH_WORKERS, help='Worker threads')
+    args = parser.parse_args()
+
+    pool = start_workers(args.workers)
+    print(f"Publishing with {args.workers} workers, jobs: {get_job_queue().counts()}")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"Jobs: {get_job_queue().counts()}")
+    except KeyboardInterrupt:
+        pool.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Shared fixtures: the repository on sys.path, a scratch working directory for the
+stores under .cache/, and the local eBay stand-in (tools/mock_ebay.py)
+"""
+import os
+import sys
+
+import pytest
+
+# Add the project root, src and tools directories to sys.path
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, 'src'))
+sys.path.append(os.path.join(ROOT_DIR, 'tools'))
+
+from mock_ebay import MockEbay, mock_credentials, start_server
+
+TAKAMOCHA_ASPECTS = os.path.join(ROOT_DIR, 'Takamocha', 'sample_category_aspects_takamocha.json')
+TAKAMOCHA_SUGGESTIONS = os.path.join(ROOT_DIR, 'Takamocha', 'sample_suggested_category_takamocha.json')
+SAMPLE_SUGGESTIONS = os.path.join(ROOT_DIR, 'Sample_listing', 'sample_suggested_category.json')
+
+# eBay.py points its endpoints at EBAY_MOCK_URL when it is imported, the mock is started before any test imports it
+_mock = MockEbay()
+_, MOCK_URL = start_server(_mock)
+os.environ['EBAY_MOCK_URL'] = MOCK_URL
+
+
+@pytest.fixture(scope='session', autouse=True)
+def workdir(tmp_path_factory):
+    # The stores use paths relative to the working directory
+    path = tmp_path_factory.mktemp('workdir')
+    cwd = os.getcwd()
+    os.chdir(path)
+    yield path
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def mock():
+    """
+    The mock eBay API, with its inventory and call counts cleared
+    """
+    with _mock.lock:
+        _mock.inventory_items.clear()
+        _mock.offers.clear()
+        _mock.videos.clear()
+        _mock.counts.clear()
+    return _mock
+
+
+@pytest.fixture
+def ebay_client(mock):
+    """
+    Production client of the mock, with an app token
+    """
+    from eBay import EbayAPI
+
+    client = EbayAPI(**mock_credentials('production'), env='production')
+    client.get_app_token()
+    return client
+
+
+@pytest.fixture
+def seller_client(mock):
+    """
+    Sandbox client of the mock, logged in as a seller
+    """
+    from eBay import EbayAPI
+
+    client = EbayAPI(**mock_credentials('sandbox'), env='sandbox')
+    client.get_user_token('mock-authorization-code')
+    return client
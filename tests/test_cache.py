@@ -0,0 +1,68 @@
+from lib.cache import TTLCache
+
+
+def test_get_returns_fresh_values_and_counts_hits():
+    cache = TTLCache(maxsize=4, ttl=60)
+    cache.set('a', 1)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert 'a' in cache and 'b' not in cache
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_expired_entries_are_misses_but_kept_for_revalidation():
+    cache = TTLCache(maxsize=4, ttl=60)
+    cache.set('a', 1, etag='"v1"', ttl=0)
+
+    assert cache.get('a') is None
+    assert 'a' not in cache
+    assert cache.get_stale('a').etag == '"v1"'
+
+    assert cache.revalidated('a') == 1
+    assert cache.get('a') == 1
+    assert cache.stats()['revalidations'] == 1
+
+
+def test_revalidating_an_evicted_entry_returns_none():
+    cache = TTLCache(maxsize=1, ttl=60)
+    cache.set('a', 1, etag='"v1"', ttl=0)
+    cache.set('b', 2)
+
+    assert cache.revalidated('a') is None
+
+
+def test_least_recently_used_entries_are_evicted_first():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+    assert cache.stats()['evictions'] == 1
+
+
+def test_expired_category_schema_is_revalidated_with_its_etag(mock, ebay_client):
+    from eBay import category_aspects_cache
+
+    category_aspects_cache.clear()
+    path = '/commerce/taxonomy/v1/category_tree/0/get_item_aspects_for_category'
+    schema = ebay_client.get_category_schema('15687')
+    assert mock.counts[path] == 1
+
+    # Cached: no request
+    assert ebay_client.get_category_schema('15687') is schema
+    assert mock.counts[path] == 1
+
+    # Expired: a conditional request answered with 304 keeps the cached schema
+    cache_key = ('production', 'EBAY_US', '15687')
+    category_aspects_cache.set(cache_key, schema, etag=category_aspects_cache.get_stale(cache_key).etag, ttl=0)
+    revalidations = category_aspects_cache.stats()['revalidations']
+    assert ebay_client.get_category_schema('15687') is schema
+    assert mock.counts[path] == 2
+    assert category_aspects_cache.stats()['revalidations'] == revalidations + 1
@@ -0,0 +1,184 @@
+import json
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from lib import jobqueue
+from lib.jobqueue import DEAD, QUEUED, RUNNING, SUCCEEDED, JobQueue, LeaseLost, PermanentJobError, WorkerPool
+
+CREDENTIALS = {'refresh_token': 'v^1.1#i^1#r^1#mock-refresh-token'}
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    # Retry at once
+    monkeypatch.setattr(jobqueue, 'RETRY_BASE', 0)
+    return JobQueue(str(tmp_path / 'jobs'))
+
+
+def stored_payload(queue, job_id):
+    connection = sqlite3.connect(queue._db_path)
+    try:
+        return json.loads(connection.execute('SELECT payload FROM jobs WHERE id = ?', (job_id,)).fetchone()[0])
+    finally:
+        connection.close()
+
+
+def run_pool(queue, handlers, until, timeout=10):
+    pool = WorkerPool(queue, handlers, workers=2, poll_interval=0.01)
+    pool.start()
+    try:
+        deadline = time.time() + timeout
+        while not until():
+            assert time.time() < deadline, queue.counts()
+            time.sleep(0.01)
+    finally:
+        pool.stop(timeout)
+
+
+def test_dedupe_key_returns_the_pending_job(queue):
+    first = queue.submit('publish', {'sku': 'TKM-00001'}, dedupe_key='TKM-00001')
+
+    assert queue.submit('publish', {'sku': 'TKM-00001'}, dedupe_key='TKM-00001') == first
+    assert queue.submit('revise', {'sku': 'TKM-00001'}, dedupe_key='TKM-00001') != first
+
+    job = queue.claim('worker', ['publish'])
+    queue.complete(job['id'], 'worker', {})
+    assert queue.submit('publish', {'sku': 'TKM-00001'}, dedupe_key='TKM-00001') != first
+
+
+def test_expired_lease_is_taken_over(queue, monkeypatch):
+    monkeypatch.setattr(jobqueue, 'LEASE_SECONDS', 0.05)
+    job_id = queue.submit('publish', {'sku': 'TKM-00001'})
+
+    first = queue.claim('crashed', ['publish'])
+    assert queue.claim('other', ['publish']) is None
+    first_context = jobqueue.JobContext(queue, first, 'crashed')
+    first_context.update(step='item')
+
+    time.sleep(0.1)
+    second = queue.claim('other', ['publish'])
+    assert second['id'] == job_id
+    assert second['attempt'] == 2
+    assert second['progress'] == {'step': 'item'}
+
+    # The first worker's late writes don't overwrite the new run
+    with pytest.raises(LeaseLost):
+        queue.complete(job_id, 'crashed', {})
+    queue.complete(job_id, 'other', {'offer_id': '1'})
+    assert queue.get(job_id)['status'] == SUCCEEDED
+    assert queue.get(job_id)['result'] == {'offer_id': '1'}
+
+
+def test_job_lost_on_its_last_attempt_is_dead_lettered(queue, monkeypatch):
+    monkeypatch.setattr(jobqueue, 'LEASE_SECONDS', 0.05)
+    job_id = queue.submit('publish', {'sku': 'TKM-00001', **CREDENTIALS}, max_attempts=1)
+
+    queue.claim('crashed', ['publish'])
+    time.sleep(0.1)
+
+    assert queue.claim('other', ['publish']) is None
+    assert queue.get(job_id)['status'] == DEAD
+    assert 'refresh_token' not in stored_payload(queue, job_id)
+
+
+def test_failed_job_is_retried_then_dead_lettered(queue):
+    job_id = queue.submit('publish', {'sku': 'TKM-00001', **CREDENTIALS}, max_attempts=2)
+
+    job = queue.claim('worker', ['publish'])
+    assert queue.fail(job['id'], 'worker', 'eBay returned 500') == QUEUED
+    assert stored_payload(queue, job_id)['refresh_token'] == CREDENTIALS['refresh_token']
+
+    job = queue.claim('worker', ['publish'])
+    assert job['attempt'] == 2
+    assert queue.fail(job['id'], 'worker', 'eBay returned 500') == DEAD
+
+    dead = queue.dead_letters()
+    assert [job['id'] for job in dead] == [job_id]
+    assert dead[0]['error'] == 'eBay returned 500'
+    assert stored_payload(queue, job_id) == {'sku': 'TKM-00001'}
+    assert queue.claim('worker', ['publish']) is None
+
+
+def test_permanent_failure_is_dead_lettered_at_once(queue):
+    job_id = queue.submit('publish', {'sku': 'TKM-00001'})
+    job = queue.claim('worker', ['publish'])
+
+    assert queue.fail(job['id'], 'worker', 'Missing title', permanent=True) == DEAD
+    assert queue.get(job_id)['attempts'] == 1
+
+
+def test_requeue_puts_credentials_back(queue):
+    job_id = queue.submit('publish', {'sku': 'TKM-00001', **CREDENTIALS})
+    assert not queue.requeue(job_id)
+
+    job = queue.claim('worker', ['publish'])
+    queue.fail(job['id'], 'worker', 'Token revoked', permanent=True)
+
+    assert queue.requeue(job_id, CREDENTIALS)
+    assert queue.get(job_id)['status'] == QUEUED
+    job = queue.claim('worker', ['publish'])
+    assert job['payload'] == {'sku': 'TKM-00001', **CREDENTIALS}
+    assert job['attempt'] == 1
+
+
+def test_credentials_are_scrubbed_on_success_and_hidden_from_get(queue):
+    job_id = queue.submit('publish', {'sku': 'TKM-00001', **CREDENTIALS})
+
+    job = queue.claim('worker', ['publish'])
+    assert job['payload']['refresh_token'] == CREDENTIALS['refresh_token']
+    assert queue.get(job_id)['status'] == RUNNING
+    assert 'payload' not in queue.get(job_id)
+
+    queue.complete(job['id'], 'worker', {'listing_id': '110561385373'})
+    assert stored_payload(queue, job_id) == {'sku': 'TKM-00001'}
+
+
+def test_worker_pool_runs_retries_and_dead_letters(queue):
+    attempts = {}
+
+    def publish(payload, context):
+        attempts[payload['sku']] = context.attempt
+        if payload['sku'] == 'flaky' and context.attempt == 1:
+            raise RuntimeError('eBay returned 500')
+        if payload['sku'] == 'invalid':
+            raise PermanentJobError('Missing title')
+        return {'sku': payload['sku']}
+
+    ids = {sku: queue.submit('publish', {'sku': sku}) for sku in ('ok', 'flaky', 'invalid')}
+    run_pool(queue, {'publish': publish}, lambda: queue.counts().get(QUEUED, 0) + queue.counts().get(RUNNING, 0) == 0)
+
+    assert queue.get(ids['ok'])['status'] == SUCCEEDED
+    assert queue.get(ids['flaky'])['status'] == SUCCEEDED
+    assert attempts['flaky'] == 2
+    assert queue.get(ids['invalid'])['status'] == DEAD
+    assert attempts['invalid'] == 1
+
+
+def test_worker_pool_survives_database_errors(queue, monkeypatch):
+    monkeypatch.setattr(jobqueue, 'DB_ERROR_BACKOFF', 0.01)
+    errors = {'claim': 2, 'complete': 2}
+    lock = threading.Lock()
+
+    def flaky(name, method):
+        def call(*args, **kwargs):
+            with lock:
+                if errors[name]:
+                    errors[name] -= 1
+                    raise sqlite3.OperationalError('database is locked')
+            return method(*args, **kwargs)
+        return call
+
+    monkeypatch.setattr(queue, 'claim', flaky('claim', queue.claim))
+    monkeypatch.setattr(queue, 'complete', flaky('complete', queue.complete))
+
+    runs = []
+    job_id = queue.submit('publish', {'sku': 'TKM-00001'})
+    run_pool(queue, {'publish': lambda payload, context: runs.append(payload) or {}},
+             lambda: queue.get(job_id)['status'] == SUCCEEDED)
+
+    assert errors == {'claim': 0, 'complete': 0}
+    # The outcome was retried, not the job
+    assert len(runs) == 1
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from lib.partial_json import PartialJSONParser
+
+LISTING = {
+    'title': 'Takamocha T-Shirt "Coffee Lover" ☕ Japanese Graphic Tee',
+    'description': 'Soft cotton tee.\nMachine washable \\ tumble dry low.',
+    'tags': ['coffee', 'tee', {'size': 'M', 'note': 'runs "small", order up}'}],
+    'price': 19.99,
+    'in_stock': True,
+    'variant': None
+}
+
+
+def test_chunked_object_parses_like_json_loads():
+    text = json.dumps(LISTING)
+
+    for size in (1, 3, 7, len(text)):
+        parser = PartialJSONParser()
+        for start in range(0, len(text), size):
+            parser.feed(text[start:start + size])
+        assert parser.done
+        assert parser.result() == LISTING
+
+
+def test_unicode_escape_split_across_chunks():
+    parser = PartialJSONParser()
+    parser.feed('{"title": "Caf\\u00')
+    assert parser.feed('e9"}') == {'title': 'Café'}
+
+
+def test_partial_string_is_readable_while_it_is_received():
+    parser = PartialJSONParser()
+
+    assert parser.feed('{"title": "Takamocha T-Sh') == {'title': 'Takamocha T-Sh'}
+    assert parser.missing(['title', 'description']) == ['title', 'description']
+
+    assert parser.feed('irt", "description": "Soft') == {'title': 'Takamocha T-Shirt', 'description': 'Soft'}
+    assert parser.missing(['title', 'description']) == ['description']
+    assert not parser.done
+
+
+def test_text_before_the_object_is_ignored():
+    parser = PartialJSONParser()
+    parser.feed('```json\n{"title": "Tee"}\n```')
+
+    assert parser.done
+    assert parser.result() == {'title': 'Tee'}
+
+
+def test_unexpected_characters_raise_value_error():
+    with pytest.raises(ValueError):
+        PartialJSONParser().feed('{title: "Tee"}')
+    with pytest.raises(ValueError):
+        PartialJSONParser().feed('{"title" "Tee"}')
@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from lib.ratelimit import (BACKOFF_CAP, BULK, INTERACTIVE, MAX_RETRY_AFTER, QuotaExceeded, RateLimiter, retry_delay,
+                           retry_statuses, send_with_retry)
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def limiter(daily=1000, burst=10, rate=0.001):
+    # A rate this low doesn't refill the bucket during a test
+    return RateLimiter({'test': {'daily': daily, 'burst': burst, 'rate': rate}})
+
+
+def sender(*responses):
+    responses = list(responses)
+    sent = []
+
+    def send():
+        sent.append(responses[0])
+        return responses.pop(0)
+    return send, sent
+
+
+def test_burst_is_granted_then_calls_wait():
+    rate_limiter = limiter(burst=3)
+
+    assert [rate_limiter.try_acquire('test') for _ in range(3)] == [0, 0, 0]
+    assert rate_limiter.try_acquire('test') > 0
+
+
+def test_bulk_calls_leave_a_reserve_to_interactive_ones():
+    rate_limiter = limiter(burst=10)
+
+    granted = 0
+    while not rate_limiter.try_acquire('test', BULK):
+        granted += 1
+    assert granted == 8
+    assert rate_limiter.try_acquire('test', INTERACTIVE) == 0
+    assert rate_limiter.metrics()['test']['granted'] == {INTERACTIVE: 1, BULK: 8}
+
+
+def test_daily_budget_raises_quota_exceeded():
+    rate_limiter = limiter(daily=2, burst=10)
+    rate_limiter.try_acquire('test')
+    rate_limiter.try_acquire('test')
+
+    with pytest.raises(QuotaExceeded):
+        rate_limiter.try_acquire('test')
+
+
+def test_unknown_family_is_rejected():
+    with pytest.raises(ValueError):
+        limiter().try_acquire('unknown')
+
+
+def test_server_errors_are_only_retried_for_idempotent_methods():
+    assert 503 in retry_statuses('get') and 503 in retry_statuses('PUT')
+    assert 503 not in retry_statuses('POST')
+    assert 429 in retry_statuses('POST')
+
+
+def test_retry_delay_honors_retry_after():
+    assert retry_delay(1, {'Retry-After': '7'}) == 7
+    in_a_minute = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+    assert 55 < retry_delay(1, {'Retry-After': in_a_minute}) <= 60
+    # Malformed values fall back to the jittered backoff
+    assert 0 <= retry_delay(10, {'Retry-After': 'soon'}) <= BACKOFF_CAP
+
+
+def test_throttled_call_is_retried_after_retry_after():
+    rate_limiter = limiter()
+    throttled = Response(429, {'Retry-After': '0'})
+    send, sent = sender(throttled, Response(200))
+
+    response = send_with_retry(send, rate_limiter, 'test')
+
+    assert response.status_code == 200
+    assert len(sent) == 2
+    assert throttled.closed
+    assert rate_limiter.metrics()['test']['retries'] == 1
+    assert rate_limiter.metrics()['test']['statuses'] == {429: 1, 200: 1}
+
+
+def test_failed_post_is_not_retried():
+    send, sent = sender(Response(503, {'Retry-After': '0'}), Response(201))
+
+    response = send_with_retry(send, limiter(), 'test', statuses=retry_statuses('POST'))
+
+    assert response.status_code == 503
+    assert len(sent) == 1
+
+
+def test_retry_after_beyond_the_limit_returns_the_response():
+    send, sent = sender(Response(429, {'Retry-After': str(MAX_RETRY_AFTER + 1)}), Response(200))
+
+    assert send_with_retry(send, limiter(), 'test').status_code == 429
+    assert len(sent) == 1
+
+
+def test_retries_stop_after_max_retries():
+    send, sent = sender(*[Response(503, {'Retry-After': '0'}) for _ in range(3)])
+
+    assert send_with_retry(send, limiter(), 'test', max_retries=2).status_code == 503
+    assert len(sent) == 3
+
+
+def test_retried_errors_are_raised_once_retries_are_used_up(monkeypatch):
+    monkeypatch.setattr('lib.ratelimit.time.sleep', lambda delay: None)
+    calls = []
+
+    def send():
+        calls.append(1)
+        raise ConnectionError('reset')
+
+    with pytest.raises(ConnectionError):
+        send_with_retry(send, limiter(), 'test', max_retries=2, retry_errors=(ConnectionError,))
+    assert len(calls) == 3
@@ -0,0 +1,107 @@
+import json
+
+import pytest
+
+from conftest import TAKAMOCHA_ASPECTS
+from lib.schema import CategorySchema, SchemaStore, normalize_name
+
+
+@pytest.fixture(scope='module')
+def takamocha():
+    with open(TAKAMOCHA_ASPECTS, encoding='utf-8') as f:
+        return CategorySchema.from_response('15687', json.load(f))
+
+
+def aspect(name, values=(), required=True, mode='SELECTION_ONLY', cardinality='SINGLE', max_length=None):
+    # An aspect as in getItemAspectsForCategory responses
+    return {
+        'localizedAspectName': name,
+        'aspectConstraint': {'aspectRequired': required, 'aspectUsage': 'RECOMMENDED', 'aspectMode': mode,
+                             'itemToAspectCardinality': cardinality, 'aspectDataType': 'STRING',
+                             'aspectMaxLength': max_length},
+        'aspectValues': [{'localizedValue': value} for value in values]
+    }
+
+
+def test_only_required_and_recommended_aspects_are_kept(takamocha):
+    assert [takamocha.names[aspect_id] for aspect_id in takamocha.required] == \
+        ['Brand', 'Size', 'Size Type', 'Color', 'Department']
+    assert takamocha.mode(takamocha.aspect_id('Department')) == 'SELECTION_ONLY'
+    assert takamocha.is_multi(takamocha.aspect_id('Theme'))
+    assert takamocha.aspect_id('Not an aspect') is None
+
+
+def test_bytes_round_trip_keeps_aspects_values_and_header(takamocha):
+    schema, header = CategorySchema.from_bytes(takamocha.to_bytes(etag='"v1"'))
+
+    assert header['etag'] == '"v1"'
+    assert schema.category_id == '15687'
+    assert schema.names == takamocha.names
+    assert schema.required_aspects() == takamocha.required_aspects()
+    for aspect_id in range(len(takamocha)):
+        assert schema.values(aspect_id) == takamocha.values(aspect_id)
+        assert schema.mode(aspect_id) == takamocha.mode(aspect_id)
+        assert schema.is_multi(aspect_id) == takamocha.is_multi(aspect_id)
+        assert schema.data_type(aspect_id) == takamocha.data_type(aspect_id)
+
+
+def test_from_bytes_rejects_other_files():
+    with pytest.raises(ValueError):
+        CategorySchema.from_bytes(b'EBTX' + bytes(16))
+
+
+def test_schema_store_round_trip(tmp_path, takamocha):
+    store = SchemaStore(str(tmp_path))
+    assert store.load('production', 'EBAY_US', '15687') is None
+
+    store.save('production', 'EBAY_US', '15687', takamocha, etag='"v1"')
+    schema, etag, age = store.load('production', 'EBAY_US', '15687')
+
+    assert etag == '"v1"'
+    assert 0 <= age < 60
+    assert schema.names == takamocha.names
+
+
+def test_validate_reports_missing_invalid_and_multiple_values(takamocha):
+    valid = {'Brand': ['Takamocha'], 'Size': ['M'], 'Size Type': ['Regular'], 'Color': ['Black'],
+             'Department': ['Men']}
+    assert takamocha.validate(valid) == []
+
+    problems = takamocha.validate({**valid, 'Brand': [], 'Department': ['Kids'], 'Color': ['Black', 'White']})
+    assert problems == ['Brand is required', 'Color accepts a single value', 'Kids is not a valid Department']
+
+    # Free text aspects take any value, multi-value ones several
+    assert takamocha.validate({**valid, 'Color': ['Coffee brown'], 'Theme': ['Coffee', 'Japan']}) == []
+
+
+def test_validate_checks_maximum_lengths():
+    schema = CategorySchema.from_aspects('1', [aspect('Model', mode='FREE_TEXT', max_length=5)])
+
+    assert schema.validate({'Model': ['ABCDEF']}) == ['Model values are limited to 5 characters']
+
+
+def test_normalize_name_ignores_case_punctuation_and_spacing():
+    assert normalize_name('Screen-Size ') == normalize_name('screen size') == 'screen size'
+
+
+def test_map_aspects_matches_exact_and_normalized_names_only(takamocha):
+    # The same category on another marketplace, partly localized
+    target = CategorySchema.from_aspects('15687', [
+        aspect('Marke', mode='FREE_TEXT'),
+        aspect('size', ['xs', 's', 'm', 'l'], mode='FREE_TEXT'),
+        aspect('Size-Type', ['Normal', 'Big & Tall']),
+        aspect('Farbe', ['Schwarz', 'Weiß'])
+    ])
+
+    mapped = target.map_aspects({'Brand': ['Takamocha'], 'Size': ['M'], 'Size Type': ['Regular'],
+                                 'Color': ['Black'], 'Print': ['Logo']}, takamocha)
+
+    # Localized aspects and values are never guessed, custom aspects are kept
+    assert mapped == {'size': ['m'], 'Size-Type': [], 'Print': ['Logo']}
+    assert target.validate(mapped) == ['Marke is required', 'Size-Type is required', 'Farbe is required']
+
+
+def test_map_aspects_keeps_free_text_values_without_a_match(takamocha):
+    target = CategorySchema.from_aspects('15687', [aspect('Color', ['Black', 'Blue'], mode='FREE_TEXT')])
+
+    assert target.map_aspects({'Color': ['Coffee brown', 'BLACK']}, takamocha) == {'Color': ['Coffee brown', 'Black']}
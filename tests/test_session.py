@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+from lib import session
+from lib.session import SessionStore, is_persistent_key
+
+SESSION_ID = 'a' * 32
+
+
+class Counted:
+    """
+    Value counting how many times it is pickled
+    """
+    pickled = 0
+
+    def __init__(self, data):
+        self.data = data
+
+    def __getstate__(self):
+        Counted.pickled += 1
+        return self.__dict__
+
+    def __eq__(self, other):
+        return isinstance(other, Counted) and self.data == other.data
+
+
+@pytest.fixture
+def store(tmp_path):
+    Counted.pickled = 0
+    return SessionStore(str(tmp_path / 'sessions'))
+
+
+def reopened(store):
+    # A new store reads everything from disk, as after a restart
+    return SessionStore(store.root)
+
+
+def test_private_keys_and_form_buttons_are_not_saved():
+    assert is_persistent_key('gen_title')
+    assert not is_persistent_key('_session_id')
+    assert not is_persistent_key('FormSubmitter:listing_form-Submit')
+    assert not is_persistent_key('selected_category')
+
+
+def test_unchanged_objects_are_not_pickled_again(store):
+    images = Counted(['s-l1600.jpg'])
+    state = {'images': images, 'gen_title': 'Takamocha T-Shirt', '_session_id': SESSION_ID}
+
+    assert store.save(SESSION_ID, state) == 2
+    assert Counted.pickled == 1
+    assert store.save(SESSION_ID, state) == 0
+    assert Counted.pickled == 1
+
+    # Changed in place: only saved when marked dirty
+    images.data.append('s-l500.jpg')
+    assert store.save(SESSION_ID, state) == 0
+    assert store.save(SESSION_ID, state, dirty={'images'}) == 1
+    assert reopened(store).load(SESSION_ID) == {'images': Counted(['s-l1600.jpg', 's-l500.jpg']),
+                                                'gen_title': 'Takamocha T-Shirt'}
+
+
+def test_equal_value_is_not_written_again(store):
+    store.save(SESSION_ID, {'gen_title': 'Takamocha T-Shirt'})
+
+    assert store.save(SESSION_ID, {'gen_title': ''.join(['Takamocha ', 'T-Shirt'])}) == 0
+
+
+def test_removed_keys_are_deleted_unless_kept(store):
+    store.save(SESSION_ID, {'gen_title': 'Takamocha T-Shirt', 'images': Counted([]), 'page': 'Home'})
+
+    # A page that only loaded some of the keys doesn't delete the others
+    assert store.save(SESSION_ID, {'page': 'Home'}, keep={'images'}) == 1
+    assert sorted(reopened(store).keys(SESSION_ID)) == ['images', 'page']
+
+
+def test_load_reads_only_the_requested_keys(store):
+    store.save(SESSION_ID, {'gen_title': 'Takamocha T-Shirt', 'images': Counted(['s-l1600.jpg']), 'page': 'Home'})
+
+    fresh = reopened(store)
+    assert sorted(fresh.keys(SESSION_ID)) == ['gen_title', 'images', 'page']
+    assert fresh.load(SESSION_ID, ['page', 'missing']) == {'page': 'Home'}
+
+    # The loaded value is known, saving it again writes nothing
+    state = {'page': 'Home'}
+    assert fresh.save(SESSION_ID, state, keep={'gen_title', 'images'}) == 0
+    assert fresh.load(SESSION_ID, ['images']) == {'images': Counted(['s-l1600.jpg'])}
+
+
+def test_large_values_are_written_once_to_blobs(store, monkeypatch):
+    monkeypatch.setattr(session, 'BLOB_THRESHOLD', 1024)
+    video = b'\x00' * 4096
+    store.save(SESSION_ID, {'video': video})
+    store.save('b' * 32, {'video': video})
+
+    blobs = [name for _, _, files in os.walk(store.blob_dir) for name in files]
+    assert len(blobs) == 1
+    assert reopened(store).load('b' * 32) == {'video': video}
+
+
+def test_cleanup_deletes_expired_sessions_and_their_blobs(store, monkeypatch):
+    monkeypatch.setattr(session, 'BLOB_THRESHOLD', 1024)
+    store.save(SESSION_ID, {'video': b'\x00' * 4096, 'page': 'Home'})
+    for directory, _, files in os.walk(store.blob_dir):
+        for name in files:
+            os.utime(os.path.join(directory, name), (0, 0))
+
+    assert store.cleanup(ttl=3600) == (0, 0)
+    assert store.cleanup(ttl=-1) == (1, 1)
+    assert store.keys(SESSION_ID) == []
+    assert reopened(store).load(SESSION_ID) == {}
@@ -0,0 +1,150 @@
+import copy
+import json
+import os
+
+import pytest
+
+from conftest import ROOT_DIR
+from lib.listing import build_inventory_item, build_offer, normalize_record
+from lib.sync import (ITEM, NEW, OFFER, PRICE_QUANTITY, SyncIndex, classify, item_digest, offer_digest,
+                      record_state)
+
+SAMPLE_ITEM = os.path.join(ROOT_DIR, 'Takamocha', 'sample_inventory_item_takamocha.json')
+SAMPLE_OFFER = os.path.join(ROOT_DIR, 'Takamocha', 'sample_createOffer_takamocha.json')
+
+
+def load(path):
+    """
+    Loads the last JSON document of a fixture, which may hold the responses before the request
+    """
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    decoder, position, document = json.JSONDecoder(), 0, None
+    while text[position:].strip():
+        document, position = decoder.raw_decode(text, len(text) - len(text[position:].lstrip()))
+    return document
+
+
+def record(sku='TKM-00001', **fields):
+    return normalize_record({
+        'sku': sku,
+        'title': 'Takamocha T-Shirt Coffee Lover Japanese Graphic Tee',
+        'description': 'Soft cotton tee with the Takamocha coffee logo.',
+        'aspects': {'Brand': ['Takamocha'], 'Size': ['M'], 'Color': ['Black']},
+        'image_urls': ['https://i.ebayimg.com/images/g/00001/s-l1600.jpg'],
+        'price': 24.99,
+        'quantity': 3,
+        'category_id': '15687',
+        **fields
+    })
+
+
+def state(listing_record):
+    return record_state(listing_record, build_inventory_item(listing_record), build_offer(listing_record))
+
+
+def test_item_digest_ignores_quantity_key_order_and_fields_ebay_adds():
+    item = load(SAMPLE_ITEM)
+    remote = copy.deepcopy(item)
+    remote['availability']['shipToLocationAvailability']['quantity'] = 999
+    remote['sku'] = 'TKM-00001'
+    remote['locale'] = 'en_US'
+    remote['product'] = dict(reversed(list(remote['product'].items())))
+
+    assert item_digest(remote) == item_digest(item)
+
+    remote['product']['title'] += ' (2 pack)'
+    assert item_digest(remote) != item_digest(item)
+
+
+def test_offer_digest_ignores_price_quantity_and_offer_state():
+    offer = load(SAMPLE_OFFER)
+    remote = {**offer, 'offerId': '1', 'status': 'PUBLISHED', 'listing': {'listingId': '2'}, 'availableQuantity': 7,
+              'pricingSummary': {'price': {'value': '1.00', 'currency': 'USD'}}}
+
+    assert offer_digest(remote) == offer_digest(offer)
+    assert offer_digest({**offer, 'categoryId': '53159'}) != offer_digest(offer)
+
+
+def test_classify_returns_the_most_expensive_change():
+    pushed = {**state(record()), 'offer_id': '1'}
+
+    assert classify(state(record()), None) == NEW
+    assert classify(state(record()), pushed) is None
+    assert classify(state(record(title='Takamocha Hoodie')), pushed) == ITEM
+    assert classify(state(record(title='Takamocha Hoodie', price=30)), pushed) == ITEM
+    assert classify(state(record(category_id='53159')), pushed) == OFFER
+    assert classify(state(record(marketplace_id='EBAY_GB', currency='GBP')), pushed) == OFFER
+    assert classify(state(record(price=19.99)), pushed) == PRICE_QUANTITY
+    assert classify(state(record(quantity=0)), pushed) == PRICE_QUANTITY
+    # Listed before the offer could be created
+    assert classify(state(record()), {**pushed, 'offer_id': None}) == OFFER
+
+
+def test_index_merges_fields_into_saved_rows(tmp_path):
+    index = SyncIndex(str(tmp_path / 'sync.db'))
+    try:
+        index.put_many([{**state(record('A')), 'offer_id': '1', 'listing_id': '10'}, state(record('B'))])
+        index.put_many([{'sku': 'A', 'quantity': 0}])
+
+        rows = index.get_many(['A', 'B', 'C'])
+        assert set(rows) == {'A', 'B'}
+        assert rows['A']['quantity'] == 0
+        assert rows['A']['offer_id'] == '1'
+        assert rows['A']['item_digest'] == state(record('A'))['item_digest']
+
+        index.delete_many(['B'])
+        assert list(index.skus()) == ['A']
+        assert len(index) == 1
+    finally:
+        index.close()
+
+
+@pytest.fixture
+def sync_factory(tmp_path, seller_client):
+    from bulk_lister import Checkpoint
+    from inventory_sync import InventorySync
+
+    index = SyncIndex(str(tmp_path / 'sync.db'))
+    checkpoints = []
+
+    def make(dry_run=False):
+        checkpoint = Checkpoint(str(tmp_path / 'sync.checkpoint.jsonl'))
+        checkpoints.append(checkpoint)
+        return InventorySync(seller_client, index, checkpoint, dry_run=dry_run)
+
+    yield make
+    for checkpoint in checkpoints:
+        checkpoint.close()
+    index.close()
+
+
+def test_sync_pushes_only_what_changed(mock, sync_factory):
+    catalog = [record(f"TKM-{i:05}") for i in range(3)]
+    report = sync_factory().run(catalog)
+    assert report['failures'] == {}
+    assert report['counts'][NEW] == 3
+    assert set(mock.inventory_items) == {record['sku'] for record in catalog}
+
+    calls = sum(mock.counts.values())
+    report = sync_factory().run(catalog)
+    assert report['counts']['unchanged'] == 3
+    assert sum(mock.counts.values()) == calls
+
+    catalog[0] = record('TKM-00000', price=19.99)
+    catalog[1] = record('TKM-00001', title='Takamocha Hoodie')
+    report = sync_factory().run(catalog)
+    assert report['failures'] == {}
+    assert report['counts'][PRICE_QUANTITY] == 1
+    assert report['counts'][ITEM] == 1
+    assert report['counts']['unchanged'] == 1
+    assert mock.inventory_items['TKM-00001']['product']['title'] == 'Takamocha Hoodie'
+
+
+def test_dry_run_counts_changes_without_calls(mock, sync_factory):
+    calls = sum(mock.counts.values())
+    report = sync_factory(dry_run=True).run([record()])
+
+    assert report['counts'][NEW] == 1
+    assert sum(mock.counts.values()) == calls
+    assert mock.inventory_items == {}
@@ -0,0 +1,156 @@
+import json
+
+import pytest
+
+from conftest import TAKAMOCHA_ASPECTS, TAKAMOCHA_SUGGESTIONS
+from lib.taxonomy import (CategoryTreeSnapshot, iter_aspects, read_suggestions, tokenize, write_snapshot,
+                          write_snapshot_stream)
+from mock_ebay import build_category_tree, load_fixtures
+
+
+@pytest.fixture(scope='module')
+def snapshot(tmp_path_factory):
+    # Every category of the fixture suggestions (Takamocha T-shirt, game controller) and their ancestors
+    path = tmp_path_factory.mktemp('taxonomy') / 'tree.ebtx'
+    write_snapshot(build_category_tree(load_fixtures(), '0'), str(path), marketplace_id='EBAY_US')
+    snapshot = CategoryTreeSnapshot(str(path))
+    yield snapshot
+    snapshot.close()
+
+
+def chunked(document, size=7):
+    # Small chunks split keys, strings and multi-byte characters between reads
+    data = json.dumps(document, ensure_ascii=False).encode('utf-8')
+    return (data[start:start + size] for start in range(0, len(data), size))
+
+
+def suggested_ids(suggestions):
+    return [suggestion['category']['categoryId'] for suggestion in suggestions['categorySuggestions']]
+
+
+def test_tokenize_folds_case_and_strips_plurals():
+    assert tokenize("Men's T-Shirts, Dress & Bus") == ['men', 's', 't', 'shirt', 'dress', 'bus']
+
+
+def test_suggest_ranks_the_category_named_after_the_product_first(snapshot):
+    suggestions = snapshot.suggest('takamocha t-shirt', limit=5)
+
+    assert suggested_ids(suggestions)[0] == '15687'
+    assert suggestions['categoryTreeId'] == '0'
+    top = suggestions['categorySuggestions'][0]
+    assert [ancestor['categoryName'] for ancestor in top['categoryTreeNodeAncestors']] == \
+        ['Shirts', "Men's Clothing", 'Men', 'Clothing, Shoes & Accessories']
+
+
+def test_suggest_falls_back_to_the_leaves_below_matching_parents(snapshot):
+    # No leaf is named after accessories, "Video Game Accessories" and "Clothing, Shoes & Accessories" are
+    suggestions = snapshot.suggest('accessories', limit=50)
+
+    assert {'117042', '171831', '15687'} <= set(suggested_ids(suggestions))
+    assert all(snapshot.is_leaf(snapshot.find(category_id)) for category_id in suggested_ids(suggestions))
+
+
+def test_suggest_only_returns_leaves_of_the_fixture_suggestions(snapshot):
+    with open(TAKAMOCHA_SUGGESTIONS, encoding='utf-8') as f:
+        expected = set(suggested_ids(json.load(f)))
+
+    assert set(suggested_ids(snapshot.suggest('shirts tops', limit=50))) <= expected
+
+
+def test_suggest_without_known_tokens_is_empty(snapshot):
+    assert snapshot.suggest('zzzz')['categorySuggestions'] == []
+
+
+def test_children_ancestors_and_breadcrumb(snapshot):
+    shirts = snapshot.find('15687')
+    assert snapshot.breadcrumb('15687') == "Clothing, Shoes & Accessories > Men > Men's Clothing > Shirts > T-Shirts"
+    assert snapshot.category_path(shirts)[-2:] == ['Shirts', 'T-Shirts']
+
+    parent = snapshot.ancestors(shirts)[0]
+    assert snapshot.name(parent) == 'Shirts'
+    assert {snapshot.name(child) for child in snapshot.children(parent)} >= {'T-Shirts', 'Casual Button-Down Shirts'}
+    assert all(snapshot.ancestors(child)[0] == parent for child in snapshot.children(parent))
+
+    # The direct children of the root are the top level categories
+    top_level = {snapshot.name(child) for child in snapshot.children(0)}
+    assert {'Clothing, Shoes & Accessories', 'Video Games & Consoles'} <= top_level
+    assert snapshot.children(shirts) == []
+
+
+def test_find_ignores_unknown_and_malformed_ids(snapshot):
+    assert snapshot.find('999999999') is None
+    assert snapshot.find('abc') is None
+    assert snapshot.breadcrumb('999999999') is None
+
+
+def test_check_category_only_accepts_existing_leaves(snapshot):
+    assert snapshot.check_category('15687') is None
+    assert "doesn't exist" in snapshot.check_category('999999999')
+    assert "doesn't exist" in snapshot.check_category('0')
+
+    shirts = snapshot.ancestors(snapshot.find('15687'))[0]
+    assert "isn't a leaf" in snapshot.check_category(str(snapshot.node(shirts)[0]))
+
+
+def test_search_matches_every_token_top_level_first(snapshot):
+    names = [snapshot.name(index) for index in snapshot.search('clothing')]
+
+    assert names[0] == 'Clothing, Shoes & Accessories'
+    assert "Men's Clothing" in names
+    assert snapshot.search('clothing zzzz') == []
+
+
+def test_category_tree_is_downloaded_once_per_version(mock, ebay_client):
+    path = '/commerce/taxonomy/v1/category_tree/0'
+    tree = ebay_client.get_category_tree('EBAY_US')
+    assert tree.check_category('15687') is None
+    assert mock.counts[path] == 1
+
+    assert ebay_client.get_category_tree('EBAY_US') is tree
+    assert mock.counts[path] == 1
+
+
+def snapshot_nodes(path):
+    # The name offsets differ, the root name is written last when streaming
+    snapshot = CategoryTreeSnapshot(path)
+    try:
+        return (snapshot.category_tree_version, snapshot.marketplace_id,
+                [snapshot.node(index)[:4] + snapshot.node(index)[6:] + (snapshot.name(index),)
+                 for index in range(len(snapshot))])
+    finally:
+        snapshot.close()
+
+
+def test_streamed_snapshot_holds_the_same_tree(tmp_path):
+    tree = build_category_tree(load_fixtures(), '0')
+    write_snapshot(tree, str(tmp_path / 'parsed.ebtx'), marketplace_id='EBAY_US')
+
+    count = write_snapshot_stream(chunked(tree), str(tmp_path / 'streamed.ebtx'), marketplace_id='EBAY_US')
+
+    streamed = snapshot_nodes(str(tmp_path / 'streamed.ebtx'))
+    assert streamed == snapshot_nodes(str(tmp_path / 'parsed.ebtx'))
+    assert len(streamed[2]) == count
+
+
+def test_streamed_aspects_keep_required_and_recommended_ones():
+    with open(TAKAMOCHA_ASPECTS, encoding='utf-8') as f:
+        response = json.load(f)
+    expected = [aspect['localizedAspectName'] for aspect in response['aspects']
+                if aspect['aspectConstraint'].get('aspectRequired')
+                or aspect['aspectConstraint'].get('aspectUsage') == 'RECOMMENDED']
+
+    assert [aspect['localizedAspectName'] for aspect in iter_aspects(chunked(response))] == expected
+    assert 'Brand' in expected
+
+
+def test_streamed_suggestions_keep_the_fields_the_app_uses():
+    with open(TAKAMOCHA_SUGGESTIONS, encoding='utf-8') as f:
+        response = json.load(f)
+
+    suggestions = read_suggestions(chunked(response))
+
+    assert suggestions['categoryTreeId'] == response['categoryTreeId']
+    assert suggested_ids(suggestions) == suggested_ids(response)
+    assert suggestions == read_suggestions(json.dumps(response).encode('utf-8'))
+    for suggestion in suggestions['categorySuggestions']:
+        assert 'categorySubtreeNodeHref' not in suggestion['category']
@@ -0,0 +1,113 @@
+import threading
+import time
+
+from lib.tokens import TokenManager
+from mock_ebay import mock_credentials
+
+TOKEN_PATH = '/identity/v1/oauth2/token'
+
+
+def manager():
+    # No background renewal: tokens put without a fetch function are never renewed
+    return TokenManager(margin=300)
+
+
+def test_stored_tokens_get_an_absolute_expiry():
+    tokens = manager()
+    token = tokens.put(('app',), {'access_token': 'a', 'expires_in': 7200})
+
+    assert 7100 < token['expires_at'] - time.time() <= 7200
+    assert tokens.is_valid(('app',))
+    assert tokens.current(('app',)) is token
+
+
+def test_tokens_inside_the_margin_are_invalid_but_still_current():
+    tokens = manager()
+    tokens.put(('app',), {'access_token': 'a', 'expires_in': 60})
+
+    assert not tokens.is_valid(('app',))
+    assert tokens.current(('app',))['access_token'] == 'a'
+    assert not tokens.is_valid(('unknown',))
+
+
+def test_a_token_expiring_earlier_does_not_replace_the_stored_one():
+    tokens = manager()
+    tokens.put(('user',), {'access_token': 'new', 'expires_in': 7200})
+    tokens.put(('user',), {'access_token': 'old', 'expires_in': 3600})
+
+    assert tokens.current(('user',))['access_token'] == 'new'
+
+
+def test_concurrent_callers_share_a_single_fetch():
+    tokens = manager()
+    fetches = []
+    started = threading.Event()
+
+    def fetch():
+        fetches.append(1)
+        started.set()
+        time.sleep(0.2)
+        return {'access_token': f"token-{len(fetches)}", 'expires_in': 7200}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(tokens.get(('app',), fetch))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(fetches) == 1
+    assert {token['access_token'] for token in results} == {'token-1'}
+
+
+def test_refresh_coalesces_callers_arriving_during_a_refresh():
+    tokens = manager()
+    tokens.put(('user',), {'access_token': 'expired', 'expires_in': 0})
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        time.sleep(0.2)
+        return {'access_token': 'renewed', 'expires_in': 7200}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(tokens.refresh(('user',), fetch))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(fetches) == 1
+    assert {token['access_token'] for token in results} == {'renewed'}
+
+
+def test_failed_fetch_returns_none_and_keeps_no_token():
+    tokens = manager()
+
+    assert tokens.get(('app',), lambda: None) is None
+    assert tokens.current(('app',)) is None
+
+
+def test_clients_of_the_same_application_share_the_app_token(mock):
+    from eBay import EbayAPI, token_manager
+
+    credentials = {**mock_credentials('sandbox'), 'client_id': 'tokens-test-client'}
+    token_manager.discard(('app', 'sandbox', 'tokens-test-client'))
+    first, second = EbayAPI(**credentials, env='sandbox'), EbayAPI(**credentials, env='sandbox')
+
+    assert first.get_app_token()
+    assert second.get_app_token()
+    assert first.app_token is second.app_token
+    assert mock.counts[TOKEN_PATH] == 1
+    # Validity is checked locally
+    assert first.is_app_token_valid()
+    assert mock.counts[TOKEN_PATH] == 1
+
+
+def test_client_without_a_user_is_not_logged_in():
+    from eBay import EbayAPI
+
+    client = EbayAPI(**mock_credentials('sandbox'), env='sandbox')
+
+    assert client.is_user_token_expired()
+    assert not client.is_user_token_valid()
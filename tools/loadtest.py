@@ -0,0 +1,316 @@
+"""
+Load test: many operators creating listings at the same time.
+
+Each simulated session runs the steps of an operator in the listing form
+(login, generate, suggest, aspects, images, publish) with the same calls as
+the app, against the local mock eBay API and the stub LLM. Like a rerun of
+the app, every step loads and saves the session state in the shared session
+store. Publishing goes through the job queue and the publishing workers.
+
+All state (sessions, media, jobs, LLM cache) is kept in a scratch directory.
+For each concurrency level it reports the throughput, the p50/p95/p99 latency
+of each step and of whole sessions, the errors, and the memory per session.
+
+Usage:
+    python tools/loadtest.py [--concurrency 1,4,16] [--sessions 32] [--latency 50] [--llm-latency 1.5]
+    python tools/loadtest.py --mock-url http://127.0.0.1:8900   # mock started separately
+"""
+import argparse
+import io
+import os
+import pickle
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from mock_ebay import MockEbay, start_server, use_mock_credentials
+
+# Add the project root and src directories to sys.path
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, 'src'))
+
+STEPS = ('login', 'generate', 'suggest', 'aspects', 'images', 'publish')
+
+# Seconds between two polls of the publishing job, like the job status fragment
+JOB_POLL_INTERVAL = 0.1
+# Seconds a session waits for its listing to be published
+PUBLISH_TIMEOUT = 120
+
+
+def rss_bytes():
+    """
+    Returns:
+        int: Resident memory of this process, its peak where the current one isn't available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        # KB on Linux, bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def make_image(seed, size=(1200, 900)):
+    # Noise keeps every image distinct and about as hard to compress as a photo
+    rng = random.Random(seed)
+    image = Image.effect_noise(size, 40).convert('RGB')
+    image.paste((rng.randrange(256), rng.randrange(256), rng.randrange(256)), (0, 0, size[0] // 4, size[1] // 4))
+    data = io.BytesIO()
+    image.save(data, 'JPEG', quality=85)
+    return data.getvalue()
+
+
+class Session:
+    def __init__(self, number, app, photos):
+        """
+        One simulated operator
+
+        Args:
+            number (int): Session number, makes the product unique
+            app (App): Shared services of the process
+            photos (list): JPEG files uploaded in the session
+        """
+        self.number = number
+        self.app = app
+        self.photos = photos
+        self.session_id = uuid.uuid4().hex
+        self.state = {}
+        self.timings = {}
+
+    def rerun(self, step, fn):
+        # Like a script run: load the saved state (first run only), run the step, save the state
+        started_at = time.perf_counter()
+        if not self.state:
+            self.state.update(self.app.sessions.load(self.session_id))
+        fn()
+        self.app.sessions.save(self.session_id, self.state)
+        self.timings[step] = time.perf_counter() - started_at
+
+    def login(self):
+        EbayAPI = self.app.EbayAPI
+        production = EbayAPI(**EbayAPI.load_credentials(env='production'), env='production')
+        sandbox = EbayAPI(**EbayAPI.load_credentials(env='sandbox'), env='sandbox')
+        production.get_app_token()
+        sandbox.get_app_token()
+        # The mock accepts any authorization code
+        sandbox.get_user_token(f"loadtest-{self.session_id}")
+        self.state.update(ebay_production=production, ebay_sandbox=sandbox, ebay_client=sandbox,
+                          auth_state='authorized')
+
+    def generate(self):
+        listing = None
+        for listing in self.app.compose_listing_stream(f"Takamocha T-Shirt {self.number}", 'Takamocha',
+                                                       f"Cotton tee with a coffee print, lot {self.number}"):
+            pass
+        self.state.update(gen_title=listing['title'], gen_description=listing['description'])
+
+    def suggest(self):
+        suggestions = self.state['ebay_production'].get_category_suggestions(f"Takamocha T-Shirt {self.number}")
+        self.state.update(categories=self.app.suggestions_to_categories(suggestions), selected_category_index=0)
+
+    def aspects(self):
+        category_id = self.state['categories'][0][1]
+        aspects = self.state['ebay_client'].get_category_aspects(category_id)
+        self.state.update(selected_category_id=category_id,
+                          selected_aspects={aspect['name']: aspect['values'][0] if aspect['values'] else 'Unbranded'
+                                            for aspect in aspects})
+
+    def upload_images(self):
+        store = self.app.media
+        digests = []
+        for i, photo in enumerate(self.photos):
+            digest = store.put(photo, f"photo_{i}.jpg")
+            # The form shows a thumbnail of each image
+            store.thumbnail(digest)
+            digests.append(digest)
+        self.state['uploaded_images'] = digests
+
+    def publish(self):
+        client = self.state['ebay_client']
+        sku = f"LOADTEST-{self.session_id[:12]}"
+        record = self.app.normalize_record({
+            'sku': sku,
+            'title': self.state['gen_title'],
+            'description': self.state['gen_description'],
+            'aspects': {name: [value] for name, value in self.state['selected_aspects'].items()},
+            'condition': 'NEW',
+            'price': 19.99,
+            'category_id': self.state['selected_category_id']
+        })
+        job_id = self.app.queue.submit('publish_listing', {
+            'env': client.env,
+            'refresh_token': client.user_token['refresh_token'],
+            'publish': True,
+            'record': record,
+            'images': self.state['uploaded_images'],
+            'video': None
+        }, dedupe_key=f"{client.env}:{sku}")
+        self.state['listing_job_id'] = job_id
+
+        deadline = time.monotonic() + PUBLISH_TIMEOUT
+        while time.monotonic() < deadline:
+            job = self.app.queue.get(job_id)
+            if job['status'] == self.app.SUCCEEDED:
+                return
+            if job['status'] == self.app.DEAD:
+                raise RuntimeError(f"Publishing failed: {job['error']}")
+            time.sleep(JOB_POLL_INTERVAL)
+        raise TimeoutError(f"Listing {sku} not published after {PUBLISH_TIMEOUT}s")
+
+    def run(self):
+        """
+        Returns:
+            tuple: Step timings, total seconds, error (None if the session completed)
+        """
+        started_at = time.perf_counter()
+        steps = {'login': self.login, 'generate': self.generate, 'suggest': self.suggest,
+                 'aspects': self.aspects, 'images': self.upload_images, 'publish': self.publish}
+        try:
+            for step in STEPS:
+                self.rerun(step, steps[step])
+        except Exception as e:
+            return self.timings, time.perf_counter() - started_at, f"{type(e).__name__}: {e}"
+        return self.timings, time.perf_counter() - started_at, None
+
+    def state_size(self):
+        return sum(len(pickle.dumps(value)) for value in self.state.values())
+
+
+class App:
+    def __init__(self, llm_latency, publish_workers):
+        """
+        The app modules, imported once EBAY_MOCK_URL points to the mock and the
+        working directory is the scratch directory
+        """
+        from eBay import EbayAPI
+        # There is no secrets file here, the mock accepts any credentials
+        use_mock_credentials(EbayAPI)
+        from listing_creator import suggestions_to_categories
+        from publisher import start_workers
+        from lib.ai import StubBackend, compose_listing_stream, set_backend
+        from lib.jobqueue import DEAD, SUCCEEDED, get_job_queue
+        from lib.listing import normalize_record
+        from lib.media import get_media_store
+        from lib.metrics import get_metrics
+        from lib.session import get_store
+
+        set_backend(StubBackend(delay=llm_latency))
+        self.EbayAPI = EbayAPI
+        self.suggestions_to_categories = suggestions_to_categories
+        self.compose_listing_stream = compose_listing_stream
+        self.normalize_record = normalize_record
+        self.SUCCEEDED = SUCCEEDED
+        self.DEAD = DEAD
+        self.sessions = get_store()
+        self.media = get_media_store()
+        self.queue = get_job_queue()
+        self.metrics = get_metrics()
+        self.pool = start_workers(publish_workers)
+
+
+def run_level(app, concurrency, sessions, images, first_number):
+    """
+    Run sessions with a fixed number of them active at any time
+
+    Returns:
+        dict: Results of the level
+    """
+    # Photos are made before the clock starts, on a real client they come from the operator's disk
+    runs = [Session(number, app, [make_image(number * 1000 + i) for i in range(images)])
+            for number in range(first_number, first_number + sessions)]
+    rss_before = rss_bytes()
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(Session.run, runs))
+    elapsed = time.perf_counter() - started_at
+
+    completed = [result for result in results if result[2] is None]
+    errors = [result[2] for result in results if result[2] is not None]
+    return {
+        'concurrency': concurrency,
+        'sessions': sessions,
+        'elapsed': elapsed,
+        'throughput': len(completed) / elapsed,
+        'steps': {step: [timings[step] for timings, _, _ in results if step in timings] for step in STEPS},
+        'totals': [total for _, total, error in completed],
+        'errors': errors,
+        'rss_growth': rss_bytes() - rss_before,
+        'state_size': statistics.mean(session.state_size() for session in runs)
+    }
+
+
+def print_level(level):
+    print(f"\nConcurrency {level['concurrency']}: {level['sessions']} sessions in {level['elapsed']:.1f}s, "
+          f"{level['throughput']:.2f} sessions/s, {len(level['errors'])} failed")
+    print(f"  {'step':<10} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10}")
+    for step, values in list(level['steps'].items()) + [('session', level['totals'])]:
+        if values:
+            print(f"  {step:<10} " + " ".join(f"{percentile(values, q) * 1000:>10.0f}" for q in (0.5, 0.95, 0.99)))
+    print(f"  memory: {level['rss_growth'] / level['sessions'] / 1e6:+.2f} MB RSS per session, "
+          f"{level['state_size'] / 1e3:.1f} KB session state")
+    for error in sorted(set(level['errors']))[:5]:
+        print(f"  error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', default='1,4,16', help='Comma separated concurrent session counts')
+    parser.add_argument('--sessions', type=int, default=32, help='Sessions per concurrency level')
+    parser.add_argument('--images', type=int, default=3, help='Images uploaded per session')
+    parser.add_argument('--latency', type=float, default=50, help='Mock eBay latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=20, help='Mock eBay latency jitter in milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of eBay calls failing with a 503')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='Share of eBay calls throttled with a 429')
+    parser.add_argument('--llm-latency', type=float, default=1.5, help='Seconds the stub LLM takes per listing')
+    parser.add_argument('--publish-workers', type=int, default=4, help='Publishing job workers')
+    parser.add_argument('--mock-url', help='Use a mock eBay API already running at this URL')
+    parser.add_argument('--workdir', help='Scratch directory, a temporary one by default')
+    args = parser.parse_args()
+
+    mock_url = args.mock_url
+    if not mock_url:
+        mock = MockEbay(latency=args.latency / 1000, jitter=args.jitter / 1000, error_rate=args.error_rate,
+                        throttle_rate=args.throttle_rate)
+        _, mock_url = start_server(mock)
+    os.environ['EBAY_MOCK_URL'] = mock_url
+
+    # The stores use paths relative to the working directory
+    workdir = args.workdir or tempfile.mkdtemp(prefix='loadtest-')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    print(f"Mock eBay at {mock_url}, scratch directory {workdir}")
+
+    app = App(args.llm_latency, args.publish_workers)
+    number = 0
+    try:
+        for concurrency in [int(value) for value in args.concurrency.split(',')]:
+            level = run_level(app, concurrency, args.sessions, args.images, number)
+            number += args.sessions
+            print_level(level)
+    finally:
+        app.pool.stop(timeout=5)
+
+    cache_stats = app.metrics.to_json()['gauges']
+    hit_rates = {gauge['labels'].get('cache'): gauge['value'] for gauge in cache_stats
+                 if gauge['name'] == 'ttl_cache_hit_rate'}
+    print(f"\nTaxonomy cache hit rates: {hit_rates}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,611 @@
+"""
+Local stand-in for the eBay APIs used by EbayAPI.
+
+Serves OAuth tokens, the taxonomy calls (tree ID, category tree, suggestions,
+item aspects), the identity user, the inventory item/offer calls and the media
+uploads. Taxonomy answers come from the fixtures in Sample_listing/ and
+Takamocha/, and inventory calls are kept in memory. Latency, server errors and
+throttling can be injected.
+
+Point the app at it with EBAY_MOCK_URL, which makes every eBay host resolve to it,
+and give it the stand-in credentials the mock writes with --secrets:
+
+    python tools/mock_ebay.py --port 8900 --latency 80 --error-rate 0.01 --throttle-rate 0.02 --secrets .cache/mock_secrets.toml
+    EBAY_MOCK_URL=http://127.0.0.1:8900 streamlit run src/home.py --secrets.files .cache/mock_secrets.toml
+
+Record real traffic, then replay it deterministically:
+
+    python tools/mock_ebay.py --record cassette.jsonl --upstream sandbox
+    python tools/mock_ebay.py --replay cassette.jsonl
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+import sys
+import os
+
+# Add the project root directory to sys.path
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT_DIR)
+
+# Fixtures: (inventory item, suggestions, aspects) per product
+FIXTURES = (
+    ('Sample_listing/sample_inventory_item.json', 'Sample_listing/sample_suggested_category.json',
+     'Sample_listing/sample_category_aspects.json'),
+    ('Takamocha/sample_inventory_item_takamocha.json', 'Takamocha/sample_suggested_category_takamocha.json',
+     'Takamocha/sample_category_aspects_takamocha.json')
+)
+
+CATEGORY_TREE_IDS = {'EBAY_US': '0', 'EBAY_CA': '2', 'EBAY_GB': '3', 'EBAY_AU': '15',
+                     'EBAY_DE': '77', 'EBAY_FR': '71', 'EBAY_IT': '101', 'EBAY_ES': '186'}
+CATEGORY_TREE_VERSION = '131'
+
+# Hosts the recorder forwards to, by path prefix
+UPSTREAM_HOSTS = {
+    'production': {'identity': 'https://apiz.ebay.com', 'media': 'https://apim.ebay.com', 'api': 'https://api.ebay.com'},
+    'sandbox': {'identity': 'https://apiz.sandbox.ebay.com', 'media': 'https://apim.sandbox.ebay.com',
+                'api': 'https://api.sandbox.ebay.com'}
+}
+
+# Token fields never written to a cassette
+SECRET_FIELDS = ('access_token', 'refresh_token')
+
+
+def tokens(text):
+    return {token for token in ''.join(c.lower() if c.isalnum() else ' ' for c in text).split() if len(token) > 2}
+
+
+def load_fixtures(root=ROOT_DIR):
+    """
+    Returns:
+        list: (suggestions, aspects body, category IDs of the suggestions, words describing the product)
+            per fixture product
+    """
+    fixtures = []
+    for item_path, suggestions_path, aspects_path in FIXTURES:
+        with open(os.path.join(root, item_path), encoding='utf-8') as f:
+            title = json.load(f)['product']['title']
+        with open(os.path.join(root, suggestions_path), encoding='utf-8') as f:
+            suggestions = json.load(f)
+        with open(os.path.join(root, aspects_path), 'rb') as f:
+            aspects = f.read()
+        category_ids = {suggestion['category']['categoryId'] for suggestion in suggestions['categorySuggestions']}
+        names = ' '.join([title] + [category['categoryName'] for suggestion in suggestions['categorySuggestions']
+                                    for category in [suggestion['category']] + suggestion['categoryTreeNodeAncestors']])
+        fixtures.append((suggestions, aspects, category_ids, tokens(names)))
+    return fixtures
+
+
+def build_category_tree(fixtures, category_tree_id):
+    """
+    Build a category tree holding every category of the fixture suggestions and their ancestors
+    """
+    nodes = {'0': {'category': {'categoryId': '0', 'categoryName': 'Root'}, 'categoryTreeNodeLevel': 0,
+                   'childCategoryTreeNodes': []}}
+
+    for suggestions, _, _, _ in fixtures:
+        for suggestion in suggestions['categorySuggestions']:
+            # Ancestors are listed nearest first
+            path = list(reversed(suggestion['categoryTreeNodeAncestors'])) + [suggestion['category']]
+            parent = nodes['0']
+            for level, category in enumerate(path, start=1):
+                node = nodes.get(category['categoryId'])
+                if node is None:
+                    node = {'category': {'categoryId': category['categoryId'], 'categoryName': category['categoryName']},
+                            'categoryTreeNodeLevel': level, 'childCategoryTreeNodes': []}
+                    nodes[category['categoryId']] = node
+                    parent['childCategoryTreeNodes'].append(node)
+                parent = node
+
+    for node in nodes.values():
+        if not node['childCategoryTreeNodes']:
+            node['leafCategoryTreeNode'] = True
+
+    return {
+        'categoryTreeId': category_tree_id,
+        'categoryTreeVersion': CATEGORY_TREE_VERSION,
+        'applicableMarketplaceIds': [marketplace for marketplace, tree_id in CATEGORY_TREE_IDS.items()
+                                     if tree_id == category_tree_id],
+        'rootCategoryNode': nodes['0']
+    }
+
+
+class Cassette:
+    def __init__(self, path, mode):
+        """
+        Recorded responses, one JSON line per request
+
+        Args:
+            path (str): Cassette file
+            mode (str): record or replay
+        """
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._responses = defaultdict(deque)
+
+        if mode == 'replay':
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._responses[(entry['method'], entry['path'])].append(entry)
+
+    def record(self, method, path, status, headers, body):
+        entry = {'method': method, 'path': path, 'status': status, 'headers': headers,
+                 'body': body.decode('utf-8', errors='replace')}
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def replay(self, method, path):
+        """
+        Returns:
+            dict: Next recorded response of the request, the last one is repeated
+        """
+        with self._lock:
+            responses = self._responses.get((method, path))
+            if not responses:
+                return None
+            return responses.popleft() if len(responses) > 1 else responses[0]
+
+
+class MockEbay:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, seed=None,
+                 cassette=None, upstream=None):
+        """
+        State and fault injection settings of the mock
+
+        Args:
+            latency (float): Seconds added to every response
+            jitter (float): Random extra seconds, up to this much
+            error_rate (float): Share of requests answered with a 503
+            throttle_rate (float): Share of requests answered with a 429 and Retry-After
+            seed (int): Random seed, for reproducible fault sequences
+            cassette (Cassette): Records or replays responses
+            upstream (str): sandbox or production, where requests are forwarded to when recording
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.cassette = cassette
+        self.upstream = upstream
+
+        self.fixtures = load_fixtures()
+        self.lock = threading.Lock()
+        self.inventory_items = {}
+        self.offers = {}
+        self.videos = {}
+        self.counts = defaultdict(int)
+
+    def pick_fixture(self, query):
+        # The fixture whose product title and category names share the most words with the query
+        query_tokens = tokens(query)
+        return max(self.fixtures, key=lambda fixture: len(query_tokens & fixture[3]))
+
+    def aspects_for(self, category_id):
+        for _, aspects, category_ids, _ in self.fixtures:
+            if category_id in category_ids:
+                return aspects
+        return self.fixtures[0][1]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that clients keep their connections alive
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status, body=b'', headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body and 'Content-Type' not in (headers or {}):
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _error(self, status, error_id, message, parameters=None):
+        error = {'errorId': error_id, 'domain': 'API_MOCK', 'category': 'REQUEST', 'message': message}
+        if parameters:
+            error['parameters'] = parameters
+        self._send(status, {'errors': [error]})
+
+    def _handle(self):
+        mock = self.mock
+        url = urlsplit(self.path)
+        body = self._body()
+        with mock.lock:
+            mock.counts[url.path] += 1
+
+        delay = mock.latency + mock.random.uniform(0, mock.jitter) if mock.jitter else mock.latency
+        if delay:
+            time.sleep(delay)
+
+        if mock.throttle_rate and mock.random.random() < mock.throttle_rate:
+            return self._send(429, {'errors': [{'errorId': 2001, 'message': 'Too many requests'}]},
+                              headers={'Retry-After': '1'})
+        if mock.error_rate and mock.random.random() < mock.error_rate:
+            return self._error(503, 2003, 'Internal error (injected)')
+
+        if mock.cassette is not None and mock.cassette.mode == 'replay':
+            entry = mock.cassette.replay(self.command, self.path)
+            if entry is not None:
+                return self._send(entry['status'], entry['body'].encode(), entry['headers'])
+
+        if mock.cassette is not None and mock.cassette.mode == 'record':
+            return self._forward(url, body)
+
+        return self._route(url, parse_qs(url.query), body)
+
+    def _forward(self, url, body):
+        # Send the request to eBay and record its response
+        family = 'identity' if url.path.startswith('/commerce/identity/') else \
+            'media' if url.path.startswith('/commerce/media/') else 'api'
+        headers = {name: value for name, value in self.headers.items() if name.lower() not in ('host', 'content-length')}
+        response = requests.request(self.command, f"{UPSTREAM_HOSTS[self.mock.upstream][family]}{self.path}",
+                                    headers=headers, data=body, allow_redirects=False, timeout=(5, 300))
+
+        content = response.content
+        if url.path.endswith('/oauth2/token') and response.ok:
+            token = response.json()
+            recorded = json.dumps({**token, **{field: 'recorded' for field in SECRET_FIELDS if field in token}}).encode()
+        else:
+            recorded = content
+
+        kept_headers = {name: value for name, value in response.headers.items()
+                        if name in ('Content-Type', 'ETag', 'Location', 'Retry-After')}
+        self.mock.cassette.record(self.command, self.path, response.status_code, kept_headers, recorded)
+        self._send(response.status_code, content, kept_headers)
+
+    def _route(self, url, query, body):
+        path = url.path.rstrip('/')
+        method = self.command
+        parts = path.split('/')
+
+        if path.endswith('/oauth2/token') and method == 'POST':
+            return self._token(parse_qs(body.decode()))
+        if path == '/oauth2/authorize':
+            return self._send(200, {'code': 'mock-authorization-code', 'state': query.get('state', [''])[0]})
+        if path == '/commerce/identity/v1/user':
+            return self._send(200, {'userId': 'mock-user', 'username': 'mock_seller', 'accountType': 'INDIVIDUAL',
+                                    'registrationMarketplaceId': 'EBAY_US'})
+        if path.startswith('/commerce/taxonomy/v1/'):
+            return self._taxonomy(parts[4:], query)
+        if path.startswith('/sell/inventory/v1/'):
+            return self._inventory(method, parts[4:], query, json.loads(body) if body else None)
+        if path.startswith('/commerce/media/v1_beta/'):
+            return self._media(method, parts[4:], body)
+
+        self._error(404, 1, f"No mock for {method} {path}")
+
+    def _token(self, form):
+        token = {'access_token': f"mock-{uuid.uuid4().hex}", 'expires_in': 7200, 'token_type': 'User Access Token'}
+        grant_type = form.get('grant_type', [''])[0]
+        if grant_type == 'client_credentials':
+            token['token_type'] = 'Application Access Token'
+        elif grant_type == 'authorization_code':
+            token.update(refresh_token=f"mock-refresh-{uuid.uuid4().hex}", refresh_token_expires_in=47304000)
+        elif grant_type != 'refresh_token':
+            return self._send(400, {'error': 'unsupported_grant_type'})
+        self._send(200, token)
+
+    def _taxonomy(self, parts, query):
+        mock = self.mock
+        if parts == ['get_default_category_tree_id']:
+            marketplace_id = query.get('marketplace_id', ['EBAY_US'])[0]
+            return self._send(200, {'categoryTreeId': CATEGORY_TREE_IDS.get(marketplace_id, '0'),
+                                    'categoryTreeVersion': CATEGORY_TREE_VERSION})
+
+        if len(parts) < 2 or parts[0] != 'category_tree':
+            return self._error(404, 62004, 'Unknown taxonomy call')
+        category_tree_id = parts[1]
+
+        if len(parts) == 2:
+            return self._send(200, build_category_tree(mock.fixtures, category_tree_id))
+
+        if parts[2] == 'get_category_suggestions':
+            suggestions = mock.pick_fixture(query.get('q', [''])[0])[0]
+            return self._send(200, {**suggestions, 'categoryTreeId': category_tree_id,
+                                    'categoryTreeVersion': CATEGORY_TREE_VERSION})
+
+        if parts[2] == 'get_item_aspects_for_category':
+            aspects = mock.aspects_for(query.get('category_id', [''])[0])
+            etag = f'"{hashlib.sha1(aspects).hexdigest()}"'
+            if self.headers.get('If-None-Match') == etag:
+                return self._send(304, headers={'ETag': etag})
+            return self._send(200, aspects, {'Content-Type': 'application/json', 'ETag': etag})
+
+        self._error(404, 62004, 'Unknown taxonomy call')
+
+    def _offer_response(self, offer):
+        return {key: value for key, value in offer.items() if key != '_sku'}
+
+    def _create_offer(self, offer):
+        # Called with the mock lock held
+        mock = self.mock
+        for existing in mock.offers.values():
+            if existing['sku'] == offer.get('sku') and existing['marketplaceId'] == offer.get('marketplaceId'):
+                return 400, {'errors': [{'errorId': 25002, 'message': 'Offer entity already exists',
+                                         'parameters': [{'name': 'offerId', 'value': existing['offerId']}]}]}
+        if offer.get('sku') not in mock.inventory_items:
+            return 400, {'errors': [{'errorId': 25702, 'message': f"SKU {offer.get('sku')} is not available"}]}
+
+        offer_id = str(len(mock.offers) + 1000000)
+        mock.offers[offer_id] = {**offer, 'offerId': offer_id, 'status': 'UNPUBLISHED'}
+        return 201, {'offerId': offer_id}
+
+    def _publish_offer(self, offer_id):
+        offer = self.mock.offers.get(offer_id)
+        if offer is None:
+            return 404, {'errors': [{'errorId': 25713, 'message': f"Offer {offer_id} not found"}]}
+        offer['status'] = 'PUBLISHED'
+        offer.setdefault('listing', {'listingId': str(110000000000 + int(offer_id)), 'listingStatus': 'ACTIVE'})
+        return 200, {'listingId': offer['listing']['listingId']}
+
+    def _page(self, field, items, query):
+        # One page of a paginated Inventory API listing, limit and offset as eBay takes them
+        limit = int(query.get('limit', ['25'])[0])
+        offset = int(query.get('offset', ['0'])[0])
+        page = {field: items[offset:offset + limit], 'total': len(items), 'limit': limit, 'offset': offset,
+                'size': len(items[offset:offset + limit])}
+        if offset + limit < len(items):
+            page['next'] = f"{self.path.split('?')[0]}?limit={limit}&offset={offset + limit}"
+        return page
+
+    def _inventory(self, method, parts, query, payload):
+        mock = self.mock
+        with mock.lock:
+            if parts[:1] == ['inventory_item'] and len(parts) == 2:
+                if method == 'PUT':
+                    mock.inventory_items[parts[1]] = payload
+                    return self._send(204)
+                if method == 'GET' and parts[1] in mock.inventory_items:
+                    return self._send(200, {'sku': parts[1], **mock.inventory_items[parts[1]]})
+                return self._error(404, 25710, f"SKU {parts[1]} not found")
+
+            if parts == ['inventory_item'] and method == 'GET':
+                skus = sorted(mock.inventory_items)
+                return self._send(200, self._page(
+                    'inventoryItems', [{'sku': sku, **mock.inventory_items[sku]} for sku in skus], query))
+
+            if parts == ['bulk_create_or_replace_inventory_item'] and method == 'POST':
+                responses = []
+                for request in payload.get('requests', []):
+                    item = {key: value for key, value in request.items() if key not in ('sku', 'locale')}
+                    mock.inventory_items[request['sku']] = item
+                    responses.append({'statusCode': 200, 'sku': request['sku'], 'locale': request.get('locale')})
+                return self._send(200, {'responses': responses})
+
+            if parts == ['offer']:
+                if method == 'POST':
+                    status, response = self._create_offer(payload)
+                    return self._send(status, response)
+                offers = [self._offer_response(offer) for offer in mock.offers.values()
+                          if offer['sku'] == query.get('sku', [''])[0]
+                          and ('marketplace_id' not in query or offer['marketplaceId'] == query['marketplace_id'][0])]
+                if not offers:
+                    return self._error(404, 25713, 'No offers found')
+                return self._send(200, self._page('offers', offers, query))
+
+            if parts == ['bulk_update_price_quantity'] and method == 'POST':
+                responses = []
+                for request in payload.get('requests', []):
+                    sku = request.get('sku')
+                    if sku not in mock.inventory_items:
+                        responses.append({'statusCode': 404, 'sku': sku,
+                                          'errors': [{'errorId': 25710, 'message': f"SKU {sku} not found"}]})
+                        continue
+                    if 'shipToLocationAvailability' in request:
+                        mock.inventory_items[sku]['availability'] = {
+                            'shipToLocationAvailability': request['shipToLocationAvailability']}
+                    for update in request.get('offers', []):
+                        offer = mock.offers.get(update.get('offerId'))
+                        if offer is None or offer['sku'] != sku:
+                            responses.append({'statusCode': 404, 'sku': sku, 'offerId': update.get('offerId'),
+                                              'errors': [{'errorId': 25713, 'message': 'Offer not found'}]})
+                            continue
+                        if 'price' in update:
+                            offer['pricingSummary'] = {**offer.get('pricingSummary', {}), 'price': update['price']}
+                        if 'availableQuantity' in update:
+                            offer['availableQuantity'] = update['availableQuantity']
+                        responses.append({'statusCode': 200, 'sku': sku, 'offerId': update['offerId']})
+                    if not request.get('offers'):
+                        responses.append({'statusCode': 200, 'sku': sku})
+                return self._send(207 if any(r['statusCode'] != 200 for r in responses) else 200,
+                                  {'responses': responses})
+
+            if parts == ['bulk_create_offer'] and method == 'POST':
+                responses = []
+                for offer in payload.get('requests', []):
+                    status, response = self._create_offer(offer)
+                    responses.append({'statusCode': status, 'sku': offer.get('sku'),
+                                      'marketplaceId': offer.get('marketplaceId'), **response})
+                return self._send(207 if any(r['statusCode'] != 201 for r in responses) else 200,
+                                  {'responses': responses})
+
+            if parts == ['bulk_publish_offer'] and method == 'POST':
+                responses = []
+                for request in payload.get('requests', []):
+                    status, response = self._publish_offer(request['offerId'])
+                    responses.append({'statusCode': status, 'offerId': request['offerId'], **response})
+                return self._send(207 if any(r['statusCode'] != 200 for r in responses) else 200,
+                                  {'responses': responses})
+
+            if parts[:1] == ['offer'] and len(parts) == 2 and method == 'PUT':
+                if parts[1] not in mock.offers:
+                    return self._error(404, 25713, f"Offer {parts[1]} not found")
+                mock.offers[parts[1]].update(payload)
+                return self._send(204)
+
+            if parts[:1] == ['offer'] and parts[2:] == ['publish'] and method == 'POST':
+                status, response = self._publish_offer(parts[1])
+                return self._send(status, response)
+
+        self._error(404, 2004, 'Unknown inventory call')
+
+    def _media(self, method, parts, body):
+        mock = self.mock
+        host = self.headers.get('Host', 'localhost')
+        if parts == ['image', 'create_image_from_file'] and method == 'POST':
+            digest = hashlib.sha256(body).hexdigest()
+            expiration = datetime.now(timezone.utc) + timedelta(days=365)
+            return self._send(201, {'imageUrl': f"http://{host}/images/{digest}.jpg",
+                                    'expirationDate': expiration.strftime('%Y-%m-%dT%H:%M:%S.000Z')})
+
+        if parts == ['video'] and method == 'POST':
+            video_id = uuid.uuid4().hex
+            with mock.lock:
+                mock.videos[video_id] = json.loads(body)
+            return self._send(201, headers={'Location': f"http://{host}/commerce/media/v1_beta/video/{video_id}"})
+
+        if parts[:1] == ['video'] and parts[2:] == ['upload'] and method == 'POST':
+            with mock.lock:
+                video = mock.videos.get(parts[1])
+                if video is None:
+                    return self._error(404, 190002, f"Video {parts[1]} not found")
+                # Chunks are sent in order, a chunk may be sent again after a failure
+                content_range = self.headers.get('Content-Range')
+                if content_range:
+                    start, end = (int(value) for value in content_range.split()[1].split('/')[0].split('-'))
+                    if start > video.get('received', 0) or end - start + 1 != len(body):
+                        return self._error(400, 190003, f"Unexpected range {content_range}")
+                    video['received'] = end + 1
+                else:
+                    video['received'] = len(body)
+            return self._send(200)
+
+        self._error(404, 190001, 'Unknown media call')
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+def mock_secrets():
+    """
+    Stand-in credentials, the mock accepts any. Real ones are never sent to it.
+
+    Returns:
+        dict: Secrets in the layout of .streamlit/secrets.toml, as read by EbayAPI.load_credentials
+    """
+    return {
+        'dev_id': 'mock-dev',
+        **{f'{env}-credentials': {'client_id': f'mock-{env}-client', 'client_secret': 'mock-secret',
+                                  'ru_name': f'mock-{env}-ru-name'} for env in ('sandbox', 'production')}
+    }
+
+
+def mock_credentials(env):
+    """
+    Returns:
+        dict: Keyword arguments of EbayAPI for an environment, with the stand-in credentials
+    """
+    secrets = mock_secrets()
+    return {**secrets[f'{env}-credentials'], 'dev_id': secrets['dev_id']}
+
+
+def use_mock_credentials(ebay_api):
+    """
+    Make EbayAPI.load_credentials return the stand-in credentials in this process,
+    for tools running the app modules outside Streamlit (no secrets file)
+
+    Args:
+        ebay_api (type): EbayAPI class
+    """
+    ebay_api.load_credentials = staticmethod(lambda env, config_file=None: mock_credentials(env))
+
+
+def write_secrets(path):
+    """
+    Write the stand-in credentials as a secrets file, for streamlit run --secrets.files
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for key, value in mock_secrets().items():
+            if not isinstance(value, dict):
+                f.write(f"{key} = {json.dumps(value)}\n")
+        for section, values in mock_secrets().items():
+            if isinstance(values, dict):
+                f.write(f"\n[{json.dumps(section)}]\n")
+                f.writelines(f"{key} = {json.dumps(value)}\n" for key, value in values.items())
+
+
+def start_server(mock, host='127.0.0.1', port=0):
+    """
+    Serve the mock in a background thread
+
+    Returns:
+        tuple: The server and its base URL (to use as EBAY_MOCK_URL)
+    """
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.mock = mock
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0, help='Milliseconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0, help='Random extra milliseconds, up to this much')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of requests answered with a 503')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='Share of requests answered with a 429')
+    parser.add_argument('--seed', type=int, help='Random seed for reproducible faults')
+    parser.add_argument('--record', metavar='CASSETTE', help='Forward requests to eBay and record the responses')
+    parser.add_argument('--upstream', default='sandbox', choices=['sandbox', 'production'])
+    parser.add_argument('--replay', metavar='CASSETTE', help='Answer recorded requests from a cassette')
+    parser.add_argument('--secrets', metavar='FILE', help='Write the stand-in credentials to this secrets file')
+    args = parser.parse_args()
+
+    if args.secrets:
+        write_secrets(args.secrets)
+        print(f"Stand-in credentials written to {args.secrets}")
+
+    cassette = None
+    if args.record:
+        cassette = Cassette(args.record, 'record')
+    elif args.replay:
+        cassette = Cassette(args.replay, 'replay')
+
+    mock = MockEbay(latency=args.latency / 1000, jitter=args.jitter / 1000, error_rate=args.error_rate,
+                    throttle_rate=args.throttle_rate, seed=args.seed, cassette=cassette, upstream=args.upstream)
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    server.daemon_threads = True
+    server.mock = mock
+
+    print(f"Mock eBay listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()